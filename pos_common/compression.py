@@ -0,0 +1,166 @@
+"""
+Message body compression shared by the POS services.
+
+The codec is declared in the 'content_encoding' message attribute. zstd may use
+a trained dictionary per table; the dictionary's zstd ID travels in the
+'compression_dict' attribute so the consumer can pick the matching one.
+Dictionaries are '<table>.zdict' files in COMPRESSION_DICT_DIR.
+
+Train a dictionary from sample message bodies (one JSON message per line):
+    python -m pos_common.compression train --table pos_checks --samples checks.jsonl --out-dir dicts/
+"""
+import os
+import sys
+import gzip
+import glob
+import zlib
+import logging
+import argparse
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional; gzip is always available.
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_ENCODING_ATTRIBUTE = "content_encoding"
+DICTIONARY_ATTRIBUTE = "compression_dict"
+IDENTITY = "identity"
+SUPPORTED_CODECS = {IDENTITY, "gzip", "zstd"}
+ZSTD_LEVEL = 3
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+
+class CorruptPayloadError(ValueError):
+    """A message body could not be decoded with its declared codec."""
+
+
+def resolve_codec(codec: Optional[str]) -> str:
+    """Normalizes a configured codec name, falling back to gzip when zstd is unavailable."""
+    codec = (codec or IDENTITY).lower()
+    if codec in ("", "none"):
+        codec = IDENTITY
+    if codec not in SUPPORTED_CODECS:
+        raise ValueError(f"Unsupported compression codec '{codec}'. Use one of {sorted(SUPPORTED_CODECS)}.")
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstd compression requested but the 'zstandard' package is not installed; using gzip.")
+        return "gzip"
+    return codec
+
+
+@lru_cache(maxsize=1)
+def load_dictionaries() -> Dict[str, "zstandard.ZstdCompressionDict"]:
+    """Loads every '<name>.zdict' file from COMPRESSION_DICT_DIR, keyed by file stem."""
+    directory = os.environ.get("COMPRESSION_DICT_DIR")
+    if not directory or zstandard is None:
+        return {}
+    dictionaries = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.zdict"))):
+        with open(path, "rb") as handle:
+            dictionaries[os.path.splitext(os.path.basename(path))[0]] = zstandard.ZstdCompressionDict(handle.read())
+    logger.info(f"Loaded {len(dictionaries)} zstd dictionaries from {directory}: {sorted(dictionaries)}")
+    return dictionaries
+
+
+@lru_cache(maxsize=1)
+def _dictionaries_by_id() -> Dict[str, "zstandard.ZstdCompressionDict"]:
+    return {str(dictionary.dict_id()): dictionary for dictionary in load_dictionaries().values()}
+
+
+# ZstdCompressor instances must not be shared between threads.
+_thread_local = threading.local()
+
+
+def _zstd_compressor(dictionary: Optional["zstandard.ZstdCompressionDict"]) -> "zstandard.ZstdCompressor":
+    compressors = getattr(_thread_local, "compressors", None)
+    if compressors is None:
+        compressors = _thread_local.compressors = {}
+    key = dictionary.dict_id() if dictionary is not None else None
+    compressor = compressors.get(key)
+    if compressor is None:
+        compressor = compressors[key] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary)
+    return compressor
+
+
+def compress(data: bytes, codec: str, dict_name: Optional[str] = None) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Compresses a message body and returns (body, attributes). dict_name selects
+    a loaded zstd dictionary (usually the table name) when one exists.
+    """
+    if codec == IDENTITY:
+        return data, {}
+    if codec == "gzip":
+        # mtime=0 keeps output deterministic for identical payloads.
+        return gzip.compress(data, compresslevel=6, mtime=0), {CONTENT_ENCODING_ATTRIBUTE: "gzip"}
+    if codec == "zstd":
+        dictionary = load_dictionaries().get(dict_name) if dict_name else None
+        attributes = {CONTENT_ENCODING_ATTRIBUTE: "zstd"}
+        if dictionary is not None:
+            attributes[DICTIONARY_ATTRIBUTE] = str(dictionary.dict_id())
+        return _zstd_compressor(dictionary).compress(data), attributes
+    raise ValueError(f"Unsupported compression codec '{codec}'.")
+
+
+def decompress(data: bytes, attributes: Optional[dict]) -> bytes:
+    """Reverses compress() based on the message attributes. Uncompressed bodies pass through."""
+    attributes = attributes or {}
+    codec = attributes.get(CONTENT_ENCODING_ATTRIBUTE, IDENTITY)
+    if codec == IDENTITY:
+        return data
+    if codec == "gzip":
+        try:
+            return gzip.decompress(data)
+        # A bad header or CRC raises OSError, a truncated body EOFError, corrupt deflate data zlib.error.
+        except (OSError, EOFError, zlib.error) as e:
+            raise CorruptPayloadError(f"Invalid gzip message body: {e}") from e
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Received a zstd-compressed message but the 'zstandard' package is not installed.")
+        dictionary = None
+        dict_id = attributes.get(DICTIONARY_ATTRIBUTE)
+        if dict_id:
+            dictionary = _dictionaries_by_id().get(dict_id)
+            if dictionary is None:
+                raise RuntimeError(f"No zstd dictionary with ID {dict_id} is available in COMPRESSION_DICT_DIR.")
+        try:
+            return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+        except zstandard.ZstdError as e:
+            raise CorruptPayloadError(f"Invalid zstd message body: {e}") from e
+    raise CorruptPayloadError(f"Unsupported content encoding '{codec}'.")
+
+
+def train_dictionary(samples: List[bytes], size: int = DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """Trains a zstd dictionary from sample message bodies."""
+    if zstandard is None:
+        raise RuntimeError("Training a dictionary requires the 'zstandard' package.")
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Message compression utilities.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train", help="Train a zstd dictionary for one table.")
+    train.add_argument("--table", required=True)
+    train.add_argument("--samples", required=True, help="File with one sample message body per line.")
+    train.add_argument("--out-dir", required=True)
+    train.add_argument("--size", type=int, default=DEFAULT_DICTIONARY_SIZE)
+    args = parser.parse_args(argv)
+
+    with open(args.samples, "rb") as handle:
+        samples = [line.rstrip(b"\n") for line in handle if line.strip()]
+    dictionary = train_dictionary(samples, args.size)
+    os.makedirs(args.out_dir, exist_ok=True)
+    path = os.path.join(args.out_dir, f"{args.table}.zdict")
+    with open(path, "wb") as handle:
+        handle.write(dictionary)
+    print(f"Wrote {len(dictionary)}-byte dictionary trained on {len(samples)} samples to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+On-demand CPU profiling for the POS services.
+
+Provides a low-overhead sampling profiler that emits collapsed stacks (the input
+format of flamegraph.pl and speedscope), a cProfile-based profiler for the next
+N requests that emits pstats, and an authenticated Flask blueprint exposing both.
+"""
+import os
+import io
+import sys
+import hmac
+import time
+import uuid
+import marshal
+import logging
+import cProfile
+import pstats
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Iterable, Optional, Tuple, TypeVar
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.005
+MAX_PROFILE_SECONDS = 120
+MAX_STORED_PROFILES = 20
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the Python stacks of running threads from a background
+    thread. Only the sampled threads pay for profiling, and only at sample time.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS, thread_ids: Optional[Iterable[int]] = None):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample_once(self) -> None:
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._sample_once()
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        """Stops sampling and returns the collected samples as collapsed stacks."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def sample_for(seconds: float, interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS) -> str:
+    """Samples every thread of the process for the given duration and returns collapsed stacks."""
+    profiler = SamplingProfiler(interval=interval).start()
+    time.sleep(seconds)
+    return profiler.stop()
+
+
+def profile_call(func: Callable[..., T], *args, **kwargs) -> Tuple[T, str]:
+    """Runs func on the current thread under the sampling profiler. Returns (result, collapsed stacks)."""
+    profiler = SamplingProfiler(thread_ids=[threading.get_ident()]).start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        collapsed = profiler.stop()
+    return result, collapsed
+
+
+# --- Stored results ---
+_stored_profiles: "OrderedDict[str, str]" = OrderedDict()
+_stored_lock = threading.Lock()
+
+
+def store_profile(collapsed: str, prefix: str = "profile") -> str:
+    """Keeps a profile in a small in-memory ring buffer and returns its ID."""
+    profile_id = f"{prefix}-{uuid.uuid4().hex[:12]}"
+    with _stored_lock:
+        _stored_profiles[profile_id] = collapsed
+        while len(_stored_profiles) > MAX_STORED_PROFILES:
+            _stored_profiles.popitem(last=False)
+    return profile_id
+
+
+def get_stored_profile(profile_id: str) -> Optional[str]:
+    with _stored_lock:
+        return _stored_profiles.get(profile_id)
+
+
+class RequestProfiler:
+    """Profiles the next N requests with cProfile and aggregates them into one pstats dump."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._profiled = 0
+        self._local = threading.local()
+
+    def arm(self, count: int) -> None:
+        with self._lock:
+            self._remaining = count
+            self._stats = None
+            self._profiled = 0
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"remaining": self._remaining, "profiled": self._profiled}
+
+    def before_request(self) -> None:
+        if not self._remaining or request.path.startswith("/debug/"):
+            return
+        with self._lock:
+            if self._remaining <= 0:
+                return
+            self._remaining -= 1
+        profile = cProfile.Profile()
+        self._local.profile = profile
+        profile.enable()
+
+    def after_request(self, response: Response) -> Response:
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        self._local.profile = None
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._profiled += 1
+        return response
+
+    def dump(self) -> Optional[bytes]:
+        """Returns the aggregated stats in the binary format read by pstats.Stats/snakeviz."""
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+
+    def text(self, limit: int = 50) -> Optional[str]:
+        with self._lock:
+            if self._stats is None:
+                return None
+            stream = io.StringIO()
+            self._stats.stream = stream
+            self._stats.sort_stats("cumulative").print_stats(limit)
+            return stream.getvalue()
+
+
+def _check_debug_auth() -> None:
+    """Aborts unless the request carries the configured DEBUG_AUTH_TOKEN."""
+    expected = os.environ.get("DEBUG_AUTH_TOKEN")
+    if not expected:
+        # The debug endpoints are disabled entirely unless a token is configured.
+        abort(404)
+    provided = request.headers.get("X-Debug-Token", "")
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        provided = auth_header[len("Bearer "):]
+    if not hmac.compare_digest(provided.encode(), expected.encode()):
+        abort(403)
+
+
+def create_debug_blueprint(request_profiler: RequestProfiler) -> Blueprint:
+    """Builds the authenticated /debug/profile endpoints."""
+    debug = Blueprint("debug", __name__, url_prefix="/debug")
+    debug.before_request(_check_debug_auth)
+
+    @debug.route("/profile", methods=["POST"])
+    def profile_process() -> Response:
+        """Samples every thread for ?seconds=N and returns collapsed stacks."""
+        try:
+            seconds = float(request.args.get("seconds", 10))
+            interval = float(request.args.get("interval", DEFAULT_SAMPLE_INTERVAL_SECONDS))
+        except ValueError:
+            return jsonify({"error": "seconds and interval must be numbers"}), 400
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or interval <= 0:
+            return jsonify({"error": f"seconds must be between 0 and {MAX_PROFILE_SECONDS}"}), 400
+        logger.info(f"Starting sampling profile for {seconds}s at {interval}s intervals.")
+        return Response(sample_for(seconds, interval), mimetype="text/plain")
+
+    @debug.route("/profile/requests", methods=["POST"])
+    def arm_request_profiler() -> Response:
+        """Profiles the next ?count=N requests with cProfile."""
+        try:
+            count = int(request.args.get("count", 1))
+        except ValueError:
+            return jsonify({"error": "count must be an integer"}), 400
+        if count <= 0:
+            return jsonify({"error": "count must be positive"}), 400
+        request_profiler.arm(count)
+        logger.info(f"Request profiler armed for the next {count} request(s).")
+        return jsonify({"status": "armed", **request_profiler.status()}), 202
+
+    @debug.route("/profile/requests", methods=["GET"])
+    def get_request_profile() -> Response:
+        """Returns the aggregated request profile as pstats (default) or ?format=text."""
+        if request.args.get("format") == "text":
+            text = request_profiler.text()
+            if text is None:
+                return jsonify({"error": "No requests have been profiled yet.", **request_profiler.status()}), 404
+            return Response(text, mimetype="text/plain")
+        dump = request_profiler.dump()
+        if dump is None:
+            return jsonify({"error": "No requests have been profiled yet.", **request_profiler.status()}), 404
+        return Response(dump, mimetype="application/octet-stream",
+                        headers={"Content-Disposition": "attachment; filename=requests.pstats"})
+
+    @debug.route("/profile/results/<profile_id>", methods=["GET"])
+    def get_profile_result(profile_id: str) -> Response:
+        """Returns a stored collapsed-stack profile, e.g. one captured by a profiled sync."""
+        collapsed = get_stored_profile(profile_id)
+        if collapsed is None:
+            return jsonify({"error": f"Profile '{profile_id}' not found."}), 404
+        return Response(collapsed, mimetype="text/plain")
+
+    return debug
+
+
+def install_profiling(app) -> RequestProfiler:
+    """Registers the debug blueprint and request hooks on a Flask app."""
+    request_profiler = RequestProfiler()
+    app.before_request(request_profiler.before_request)
+    app.after_request(request_profiler.after_request)
+    app.register_blueprint(create_debug_blueprint(request_profiler))
+    return request_profiler
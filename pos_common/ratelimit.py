@@ -0,0 +1,40 @@
+"""
+Thread-safe token bucket rate limiter shared by the POS services.
+"""
+import time
+import threading
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """
+    Refills at `rate` tokens per second up to `capacity`. acquire() takes tokens
+    and sleeps for any shortfall, so a large request is paced rather than refused.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Takes tokens, sleeping until the bucket has refilled enough. Returns the time waited."""
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
@@ -0,0 +1,241 @@
+"""
+Compact binary row encoding derived from the JSON Schemas in 'schemas/'.
+
+Each table's field order is the order of the schema's data.properties, so a
+message carries values only. A message is laid out as:
+
+    magic (2 bytes) | format version (1 byte) | table name (varint length + UTF-8)
+    | field count (varint) | schema fingerprint (4 bytes)
+    | record_id, sync_id, event_type, processed_at | one value per schema field
+    | extra data fields as JSON (or null)
+
+Values are tagged: absent, null, false, true, zigzag varint int, 8-byte
+double, UTF-8 string, or JSON for nested values. The fingerprint is a hash of
+the field names in order. A decoder also accepts the fingerprint of every
+prefix of its field list, so when fields are appended to a schema the
+processor can be deployed first and keep reading the older poller's messages.
+Messages from a writer that is ahead raise UnknownSchemaVersionError, which
+the processor answers with a 500 so Pub/Sub redelivers them after its rollout.
+"""
+import json
+import struct
+import hashlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pos_common.schema_store import get_schema_store
+
+CONTENT_TYPE = "application/x-pos-row"
+CONTENT_TYPE_ATTRIBUTE = "content_type"
+FINGERPRINT_ATTRIBUTE = "schema_fingerprint"
+
+MAGIC = b"\xb1R"
+FORMAT_VERSION = 1
+ENVELOPE_FIELDS = ("record_id", "sync_id", "event_type", "processed_at")
+
+_ABSENT, _NULL, _FALSE, _TRUE, _INT, _FLOAT, _STRING, _JSON = range(8)
+_DOUBLE = struct.Struct("<d")
+_ABSENT_VALUE = object()
+
+
+class RowCodecError(ValueError):
+    """A binary message body is truncated or otherwise malformed."""
+
+
+class UnknownSchemaVersionError(RuntimeError):
+    """A message was written with a schema layout this side does not know (yet)."""
+
+
+def schema_fingerprint(fields: Iterable[str]) -> bytes:
+    """The 4-byte layout fingerprint of an ordered field list."""
+    return hashlib.sha256("\n".join(fields).encode("utf-8")).digest()[:4]
+
+
+# --- Primitive Encoding ---
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise RowCodecError("Truncated varint.")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_bytes(buffer: bytearray, raw: bytes) -> None:
+    _write_varint(buffer, len(raw))
+    buffer += raw
+
+
+def _read_bytes(data: bytes, pos: int) -> Tuple[bytes, int]:
+    length, pos = _read_varint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise RowCodecError("Truncated string.")
+    return data[pos:end], end
+
+
+def _write_value(buffer: bytearray, value) -> None:
+    if value is None:
+        buffer.append(_NULL)
+    elif value is True:
+        buffer.append(_TRUE)
+    elif value is False:
+        buffer.append(_FALSE)
+    elif isinstance(value, int):
+        buffer.append(_INT)
+        _write_varint(buffer, (value << 1) if value >= 0 else ((-value) << 1) - 1)
+    elif isinstance(value, float):
+        buffer.append(_FLOAT)
+        buffer += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        buffer.append(_STRING)
+        _write_bytes(buffer, value.encode("utf-8"))
+    else:
+        buffer.append(_JSON)
+        _write_bytes(buffer, json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def _read_value(data: bytes, pos: int):
+    """Returns (value, new_pos); absent values are returned as _ABSENT_VALUE."""
+    if pos >= len(data):
+        raise RowCodecError("Truncated value.")
+    tag = data[pos]
+    pos += 1
+    if tag == _STRING:
+        raw, pos = _read_bytes(data, pos)
+        return raw.decode("utf-8"), pos
+    if tag == _NULL:
+        return None, pos
+    if tag == _ABSENT:
+        return _ABSENT_VALUE, pos
+    if tag == _INT:
+        zigzag, pos = _read_varint(data, pos)
+        return (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1), pos
+    if tag == _FLOAT:
+        if pos + 8 > len(data):
+            raise RowCodecError("Truncated float.")
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _JSON:
+        raw, pos = _read_bytes(data, pos)
+        return json.loads(raw), pos
+    raise RowCodecError(f"Unknown value tag {tag}.")
+
+
+# --- Codecs ---
+
+class RowCodec:
+    """Encodes and decodes the messages of one table with a fixed field order."""
+
+    def __init__(self, table_name: str, fields: List[str]):
+        self.table_name = table_name
+        self.fields = list(fields)
+        self.fingerprint = schema_fingerprint(self.fields)
+        self._field_set = set(self.fields)
+        self._header = bytearray(MAGIC)
+        self._header.append(FORMAT_VERSION)
+        _write_bytes(self._header, table_name.encode("utf-8"))
+        _write_varint(self._header, len(self.fields))
+        self._header += self.fingerprint
+        # Fingerprints of every prefix, keyed by field count, for older writers.
+        self._accepted = {count: schema_fingerprint(self.fields[:count]) for count in range(len(self.fields) + 1)}
+
+    def encode(self, message: dict) -> bytes:
+        buffer = bytearray(self._header)
+        for name in ENVELOPE_FIELDS:
+            _write_value(buffer, message.get(name))
+        data = message.get("data") or {}
+        for name in self.fields:
+            if name in data:
+                _write_value(buffer, data[name])
+            else:
+                buffer.append(_ABSENT)
+        extras = {key: value for key, value in data.items() if key not in self._field_set}
+        _write_value(buffer, json.dumps(extras, separators=(",", ":")) if extras else None)
+        return bytes(buffer)
+
+    def decode_body(self, data: bytes, pos: int, field_count: int) -> dict:
+        """Decodes the values following the header into a message dict."""
+        message = {"table_name": self.table_name}
+        for name in ENVELOPE_FIELDS:
+            value, pos = _read_value(data, pos)
+            if value is not None and value is not _ABSENT_VALUE:
+                message[name] = value
+        row = {}
+        for name in self.fields[:field_count]:
+            value, pos = _read_value(data, pos)
+            if value is not _ABSENT_VALUE:
+                row[name] = value
+        extras, pos = _read_value(data, pos)
+        if extras:
+            row.update(json.loads(extras))
+        if pos != len(data):
+            raise RowCodecError("Trailing bytes after the encoded row.")
+        message["data"] = row
+        return message
+
+    def accepts(self, field_count: int, fingerprint: bytes) -> bool:
+        return self._accepted.get(field_count) == fingerprint
+
+
+class RowCodecRegistry:
+    """All table codecs derived from a schema store ({'$id': schema})."""
+
+    def __init__(self, schema_store: Dict[str, dict]):
+        self.codecs: Dict[str, RowCodec] = {}
+        for schema in schema_store.values():
+            properties = schema.get("properties", {})
+            table_name = properties.get("table_name", {}).get("const")
+            fields = properties.get("data", {}).get("properties")
+            if table_name and fields:
+                self.codecs[table_name] = RowCodec(table_name, list(fields))
+
+    def get(self, table_name: str) -> Optional[RowCodec]:
+        return self.codecs.get(table_name)
+
+    def encode(self, message: dict) -> Tuple[bytes, Dict[str, str]]:
+        """Encodes a message and returns (body, attributes). Raises KeyError for tables without a schema."""
+        codec = self.codecs[message["table_name"]]
+        return codec.encode(message), {
+            CONTENT_TYPE_ATTRIBUTE: CONTENT_TYPE,
+            FINGERPRINT_ATTRIBUTE: codec.fingerprint.hex(),
+        }
+
+    def decode(self, data: bytes) -> dict:
+        if data[:2] != MAGIC:
+            raise RowCodecError("Not a binary row message.")
+        if len(data) < 3 or data[2] != FORMAT_VERSION:
+            raise UnknownSchemaVersionError(f"Unsupported row format version {data[2] if len(data) > 2 else None}.")
+        raw_table, pos = _read_bytes(data, 3)
+        table_name = raw_table.decode("utf-8")
+        field_count, pos = _read_varint(data, pos)
+        fingerprint = data[pos:pos + 4]
+        pos += 4
+        codec = self.codecs.get(table_name)
+        if codec is None or not codec.accepts(field_count, fingerprint):
+            raise UnknownSchemaVersionError(
+                f"No schema for {table_name} with {field_count} fields and fingerprint {fingerprint.hex()}."
+            )
+        return codec.decode_body(data, pos, field_count)
+
+
+@lru_cache(maxsize=1)
+def get_row_codecs() -> RowCodecRegistry:
+    """Returns the binary row codecs derived from the loaded JSON schemas."""
+    return RowCodecRegistry(get_schema_store())
@@ -0,0 +1,57 @@
+"""
+Loading of the JSON Schema data contracts shared by the poller and the processor.
+
+Configuration (environment):
+    SCHEMA_DIR   directory holding the schema files (default: the image copy in
+                 pos_common/schemas, or the repository's top-level 'schemas')
+"""
+import os
+import json
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+def get_schema_dir() -> str:
+    """
+    Resolves the schema directory: SCHEMA_DIR if set, otherwise the copy baked
+    into the image next to this package, falling back to the repository's
+    top-level 'schemas' directory when running from a checkout.
+    """
+    if os.environ.get("SCHEMA_DIR"):
+        return os.path.abspath(os.environ["SCHEMA_DIR"])
+    package_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'schemas'))
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'schemas'))
+    if not os.path.isdir(package_dir) and os.path.isdir(repo_dir):
+        return repo_dir
+    return package_dir
+
+@lru_cache(maxsize=1)
+def get_schema_store() -> dict:
+    """
+    Loads all JSON schemas from the 'schemas' directory into a store.
+    """
+    store = {}
+    schema_dir_path = get_schema_dir()
+    logger.info(f"Attempting to load schemas from absolute path: {schema_dir_path}")
+    try:
+        filenames = os.listdir(schema_dir_path)
+        logger.info(f"Found files in schema directory: {filenames}")
+    except FileNotFoundError:
+        logger.error(f"FATAL: Schema directory not found at {schema_dir_path}")
+        return {}
+
+    for filename in filenames:
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(schema_dir_path, filename), 'r') as f:
+                    schema = json.load(f)
+                    if '$id' in schema:
+                        store[schema['$id']] = schema
+                    else:
+                        logger.warning(f"Schema file {filename} is missing a top-level '$id' property.")
+            except Exception as e:
+                logger.error(f"Failed to load or parse schema file {filename}: {e}")
+
+    logger.info(f"SCHEMA STORE INITIALIZED. Contains IDs: {list(store.keys())}")
+    return store
@@ -0,0 +1,184 @@
+"""
+Startup timing, warm-up and readiness shared by the POS services.
+
+A service creates one StartupTracker as early as possible in its main module,
+records checkpoints while it imports and configures itself, and registers
+warm-up steps (client creation, schema compilation, secret prefetch). The
+warm-up runs after the app object exists, by default on a background thread so
+the port opens immediately, and GET /ready answers 503 until it has finished.
+Point the Cloud Run startup probe at /ready.
+
+WARMUP_ON_STARTUP defaults to true on Cloud Run (K_SERVICE is set) and false
+elsewhere. STARTUP_BUDGET_SECONDS sets the cold-start budget that the report
+and the startup CLI check against.
+
+Measure a cold start locally (the process exits 1 when over budget):
+    python -m pos_common.startup pos_processor.main --budget 3
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+# Deliberately light: services import this module first so the tracker's clock
+# starts before Flask and the rest of the application are imported.
+from pos_common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE_SECONDS = REGISTRY.gauge("pos_startup_phase_seconds", "Duration of each startup phase.", ["phase"])
+STARTUP_SECONDS = REGISTRY.gauge("pos_startup_seconds_to_ready", "Seconds from process start until the service was ready.")
+
+
+def warmup_enabled() -> bool:
+    default = "true" if os.environ.get("K_SERVICE") else "false"
+    return os.environ.get("WARMUP_ON_STARTUP", default).lower() == "true"
+
+
+def _budget_from_env() -> Optional[float]:
+    value = os.environ.get("STARTUP_BUDGET_SECONDS")
+    return float(value) if value else None
+
+
+class StartupTracker:
+    """Records a startup timing breakdown, runs warm-up steps and tracks readiness."""
+
+    def __init__(self, service: str, budget_seconds: Optional[float] = None,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.service = service
+        self.budget_seconds = budget_seconds if budget_seconds is not None else _budget_from_env()
+        self._clock = clock
+        self.started_at = clock()
+        self._last_checkpoint = self.started_at
+        self.phases: List[dict] = []
+        self.warmup_steps: List[Tuple[str, Callable[[], object]]] = []
+        self.ready_after: Optional[float] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def _record(self, name: str, seconds: float, status: str = "ok", error: Optional[str] = None) -> None:
+        phase = {"phase": name, "seconds": round(seconds, 4), "status": status}
+        if error:
+            phase["error"] = error
+        with self._lock:
+            self.phases.append(phase)
+        STARTUP_PHASE_SECONDS.set(seconds, phase=name)
+
+    def checkpoint(self, name: str) -> None:
+        """Records the time since the previous checkpoint (or process start) as a phase."""
+        now = self._clock()
+        self._record(name, now - self._last_checkpoint)
+        self._last_checkpoint = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Times the enclosed block as a phase; exceptions are recorded and re-raised."""
+        start = self._clock()
+        try:
+            yield
+        except Exception as e:
+            self._record(name, self._clock() - start, "error", str(e))
+            raise
+        else:
+            self._record(name, self._clock() - start)
+        finally:
+            self._last_checkpoint = self._clock()
+
+    def add_warmup_step(self, name: str, func: Callable[[], object]) -> None:
+        self.warmup_steps.append((name, func))
+
+    def warm_up(self) -> None:
+        """
+        Runs every warm-up step and then marks the service ready. A failing step
+        is logged and reported but does not block readiness; the lazy path it
+        was warming still runs on the first request.
+        """
+        for name, func in self.warmup_steps:
+            try:
+                with self.phase(f"warmup:{name}"):
+                    func()
+            except Exception as e:
+                logger.warning(f"Warm-up step '{name}' failed: {e}")
+        self.mark_ready()
+
+    def start(self, warmup: Optional[bool] = None, background: bool = True) -> None:
+        """Starts the warm-up (or marks the service ready straight away when it is disabled)."""
+        if warmup is None:
+            warmup = warmup_enabled()
+        if not warmup:
+            self.mark_ready()
+        elif background:
+            threading.Thread(target=self.warm_up, name=f"{self.service}-warmup", daemon=True).start()
+        else:
+            self.warm_up()
+
+    def mark_ready(self) -> None:
+        if self._ready.is_set():
+            return
+        self.ready_after = self._clock() - self.started_at
+        STARTUP_SECONDS.set(self.ready_after)
+        self._ready.set()
+        if self.budget_seconds is not None and self.ready_after > self.budget_seconds:
+            logger.warning(f"{self.service} took {self.ready_after:.2f}s to become ready, "
+                           f"over the {self.budget_seconds:.2f}s startup budget: {self.phases}")
+        else:
+            logger.info(f"{self.service} ready after {self.ready_after:.2f}s.")
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def report(self) -> dict:
+        with self._lock:
+            phases = list(self.phases)
+        return {
+            "service": self.service,
+            "ready": self.is_ready(),
+            "seconds_to_ready": round(self.ready_after, 4) if self.ready_after is not None else None,
+            "budget_seconds": self.budget_seconds,
+            "within_budget": (self.ready_after <= self.budget_seconds
+                              if self.ready_after is not None and self.budget_seconds is not None else None),
+            "phases": phases,
+        }
+
+
+def install_readiness(app, tracker: StartupTracker) -> None:
+    """Adds GET /ready, which returns 503 until warm-up has finished, with the timing breakdown."""
+    from flask import jsonify
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        return jsonify(tracker.report()), 200 if tracker.is_ready() else 503
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure a service's cold start, including its warm-up.")
+    parser.add_argument("module", help="Service main module, e.g. pos_processor.main")
+    parser.add_argument("--budget", type=float, help="Fail when startup exceeds this many seconds.")
+    args = parser.parse_args(argv)
+
+    # The module starts its own tracker on import; force the warm-up on and wait for it below.
+    os.environ["WARMUP_ON_STARTUP"] = "true"
+    if args.budget is not None:
+        os.environ["STARTUP_BUDGET_SECONDS"] = str(args.budget)
+    started = time.perf_counter()
+    module = importlib.import_module(args.module)
+    tracker: StartupTracker = module.STARTUP
+    tracker.wait_until_ready()
+    report = tracker.report()
+    report["wall_seconds"] = round(time.perf_counter() - started, 4)
+    print(json.dumps(report, indent=2))
+    return 1 if report["within_budget"] is False else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from pos_common import compression
+from pos_common.compression import compress, decompress, resolve_codec, train_dictionary, CorruptPayloadError
+
+SAMPLE = json.dumps({
+    "record_id": "a1b2c3d4e5f6",
+    "table_name": "pos_checks",
+    "data": {"object_id": "36b492b3-d80e-4b5f-9ac6-35125a19fa0e", "net_sales": 100.5, "business_date": "2025-06-30"},
+}).encode('utf-8')
+
+@pytest.mark.parametrize("codec", ["identity", "gzip", "zstd"])
+def test_round_trip(codec):
+    """Every codec round-trips through the attributes it declares."""
+    body, attributes = compress(SAMPLE, codec)
+
+    assert decompress(body, attributes) == SAMPLE
+    if codec == "identity":
+        assert attributes == {} and body == SAMPLE
+    else:
+        assert attributes == {"content_encoding": codec}
+
+def test_resolve_codec_rejects_unknown_names():
+    assert resolve_codec(None) == "identity"
+    assert resolve_codec("none") == "identity"
+    assert resolve_codec("GZIP") == "gzip"
+    with pytest.raises(ValueError):
+        resolve_codec("brotli")
+
+def test_corrupt_body_raises_corrupt_payload_error():
+    with pytest.raises(CorruptPayloadError):
+        decompress(b"not gzip", {"content_encoding": "gzip"})
+    with pytest.raises(CorruptPayloadError):
+        decompress(SAMPLE, {"content_encoding": "lz4"})
+
+def test_corrupted_gzip_body_raises_corrupt_payload_error():
+    """Damaged deflate data, not only a truncated stream, is reported as a corrupt payload."""
+    body, attributes = compress(SAMPLE, "gzip")
+    # The deflate stream starts after the 10-byte gzip header; 0xff is an invalid block type.
+    corrupted = body[:10] + b"\xff" + body[11:]
+
+    with pytest.raises(CorruptPayloadError):
+        decompress(corrupted, attributes)
+    with pytest.raises(CorruptPayloadError):
+        decompress(body[:len(body) // 2], attributes)
+
+def test_trained_dictionary_is_used_and_declared(tmp_path, monkeypatch):
+    """A '<table>.zdict' dictionary is selected by name and announced by its ID."""
+    # --- Arrange ---
+    samples = [
+        json.dumps({"record_id": f"{i:012x}", "table_name": "pos_checks", "sync_id": f"Checks_20250630_{i:06d}",
+                    "data": {"id": i, "net_sales": i * 1.5, "business_date": "2025-06-30", "tax_owed": i / 10}}).encode()
+        for i in range(500)
+    ]
+    (tmp_path / "pos_checks.zdict").write_bytes(train_dictionary(samples, size=4096))
+    monkeypatch.setenv("COMPRESSION_DICT_DIR", str(tmp_path))
+    compression.load_dictionaries.cache_clear()
+    compression._dictionaries_by_id.cache_clear()
+
+    try:
+        # --- Act ---
+        with_dict, attributes = compress(samples[0], "zstd", dict_name="pos_checks")
+        without_dict, _ = compress(samples[0], "zstd", dict_name="pos_items")
+
+        # --- Assert ---
+        assert attributes["compression_dict"] == str(compression.load_dictionaries()["pos_checks"].dict_id())
+        assert len(with_dict) < len(without_dict)
+        assert decompress(with_dict, attributes) == samples[0]
+    finally:
+        compression.load_dictionaries.cache_clear()
+        compression._dictionaries_by_id.cache_clear()
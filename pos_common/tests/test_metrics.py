@@ -0,0 +1,47 @@
+import pytest
+
+from pos_common.metrics import MetricsRegistry
+
+def test_counter_renders_per_label_set():
+    """Counters keep one value per label set and render them in sorted order."""
+    registry = MetricsRegistry()
+    counter = registry.counter("pages_total", "Pages fetched.", ["endpoint"])
+    counter.inc(endpoint="Checks")
+    counter.inc(3, endpoint="ItemSales")
+    counter.inc(endpoint="Checks")
+
+    output = registry.render()
+
+    assert "# TYPE pages_total counter" in output
+    assert 'pages_total{endpoint="Checks"} 2' in output
+    assert 'pages_total{endpoint="ItemSales"} 3' in output
+
+def test_histogram_buckets_are_cumulative():
+    """Histogram buckets are cumulative and end with a +Inf bucket equal to the count."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ["table"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 5.0):
+        histogram.observe(value, table="pos_checks")
+
+    output = registry.render()
+
+    assert 'latency_seconds_bucket{table="pos_checks",le="0.1"} 1' in output
+    assert 'latency_seconds_bucket{table="pos_checks",le="1"} 3' in output
+    assert 'latency_seconds_bucket{table="pos_checks",le="+Inf"} 4' in output
+    assert 'latency_seconds_count{table="pos_checks"} 4' in output
+    assert histogram.get_sum(table="pos_checks") == pytest.approx(6.25)
+
+def test_registry_returns_existing_metric_and_rejects_type_clash():
+    """Registering the same name twice returns the same metric; a different type is an error."""
+    registry = MetricsRegistry()
+    first = registry.counter("events_total", "Events.")
+    assert registry.counter("events_total", "Events.") is first
+    with pytest.raises(ValueError):
+        registry.histogram("events_total", "Events.")
+
+def test_wrong_labels_raise():
+    """Observing with labels that do not match the declaration is rejected."""
+    registry = MetricsRegistry()
+    counter = registry.counter("rows_total", "Rows.", ["table"])
+    with pytest.raises(ValueError):
+        counter.inc(endpoint="Checks")
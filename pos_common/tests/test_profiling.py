@@ -0,0 +1,70 @@
+import time
+import marshal
+import pytest
+from flask import Flask
+
+from pos_common.profiling import install_profiling, profile_call, get_stored_profile, store_profile
+
+@pytest.fixture
+def client(monkeypatch):
+    """A minimal Flask app with the profiling blueprint installed."""
+    monkeypatch.setenv("DEBUG_AUTH_TOKEN", "secret-token")
+    app = Flask(__name__)
+    install_profiling(app)
+
+    @app.route('/work')
+    def work():
+        return str(sum(i * i for i in range(10000)))
+
+    with app.test_client() as client:
+        yield client
+
+def test_debug_endpoints_disabled_without_token(monkeypatch, client):
+    """Without DEBUG_AUTH_TOKEN configured the debug endpoints do not exist."""
+    monkeypatch.delenv("DEBUG_AUTH_TOKEN")
+    response = client.post('/debug/profile?seconds=0.1')
+    assert response.status_code == 404
+
+def test_debug_endpoints_require_matching_token(client):
+    """A wrong token is rejected."""
+    response = client.post('/debug/profile?seconds=0.1', headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 403
+
+def test_sampling_profile_returns_collapsed_stacks(client):
+    """The sampling endpoint returns 'frame;frame;frame count' lines."""
+    response = client.post('/debug/profile?seconds=0.2&interval=0.01', headers={"X-Debug-Token": "secret-token"})
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).strip().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+def test_request_profiler_produces_loadable_pstats(client):
+    """Arming the request profiler captures the next request as a pstats dump."""
+    headers = {"X-Debug-Token": "secret-token"}
+    assert client.get('/debug/profile/requests', headers=headers).status_code == 404
+
+    assert client.post('/debug/profile/requests?count=1', headers=headers).status_code == 202
+    client.get('/work')
+    client.get('/work')  # Only the first request is profiled.
+
+    response = client.get('/debug/profile/requests', headers=headers)
+    assert response.status_code == 200
+    stats = marshal.loads(response.data)
+    assert any(func_name == 'work' for (_, _, func_name) in stats)
+
+def test_profile_call_captures_caller_thread():
+    """profile_call returns the wrapped result plus collapsed stacks of that call."""
+    def busy():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        return 42
+
+    result, collapsed = profile_call(busy)
+
+    assert result == 42
+    assert "busy (" in collapsed
+    profile_id = store_profile(collapsed, prefix="Checks")
+    assert profile_id.startswith("Checks-")
+    assert get_stored_profile(profile_id) == collapsed
@@ -0,0 +1,30 @@
+import pytest
+
+from pos_common.ratelimit import TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+def test_acquire_sleeps_for_shortfall():
+    """Taking more tokens than available sleeps exactly long enough to refill them."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=10, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire(10) == 0
+    assert bucket.acquire(5) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.acquire(5) == 0
+    assert bucket.acquire(5) == pytest.approx(0.5)
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
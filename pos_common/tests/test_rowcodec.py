@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from pos_common.rowcodec import RowCodec, RowCodecRegistry, RowCodecError, UnknownSchemaVersionError
+from pos_common.schema_store import get_schema_store
+
+MESSAGE = {
+    "record_id": "a1b2c3d4e5f6",
+    "sync_id": "Paidouts_20250630_120000",
+    "event_type": "pos.paidouts",
+    "table_name": "pos_paidouts",
+    "processed_at": "2025-06-30T12:00:00+00:00",
+    "data": {
+        "id": 123,
+        "object_id": "36b492b3-d80e-4b5f-9ac6-35125a19fa0e",
+        "business_date": "2025-06-30",
+        "amount": -12.75,
+        "employee_number": None,
+        "notes": "Ice ❄",
+        "payment_number": -(2 ** 40),
+    },
+}
+
+@pytest.fixture
+def registry():
+    return RowCodecRegistry(get_schema_store())
+
+def test_registry_covers_every_table_schema(registry):
+    assert {"pos_checks", "pos_item_sales", "pos_paidouts", "pos_time_records"} <= set(registry.codecs)
+
+def test_round_trip_preserves_values_nulls_and_absence(registry):
+    """Decoding returns exactly the encoded message: absent fields stay absent, nulls stay null."""
+    body, attributes = registry.encode(MESSAGE)
+
+    assert attributes["content_type"] == "application/x-pos-row"
+    assert registry.decode(body) == MESSAGE
+    assert len(body) < len(json.dumps(MESSAGE))
+
+def test_fields_outside_the_schema_are_carried_as_extras(registry):
+    message = {**MESSAGE, "data": {**MESSAGE["data"], "unexpected": {"nested": [1, 2]}}}
+
+    body, _ = registry.encode(message)
+
+    assert registry.decode(body)["data"]["unexpected"] == {"nested": [1, 2]}
+
+def test_decoder_reads_messages_from_an_older_field_list():
+    """A processor with an appended field still decodes messages from an older poller."""
+    old = RowCodec("pos_demo", ["id", "name"])
+    new = RowCodecRegistry({})
+    new.codecs["pos_demo"] = RowCodec("pos_demo", ["id", "name", "added"])
+
+    body = old.encode({"table_name": "pos_demo", "data": {"id": 1, "name": "x"}})
+
+    assert new.decode(body)["data"] == {"id": 1, "name": "x"}
+
+def test_decoder_rejects_unknown_layouts():
+    writer = RowCodec("pos_demo", ["id", "renamed"])
+    reader = RowCodecRegistry({})
+    reader.codecs["pos_demo"] = RowCodec("pos_demo", ["id", "name"])
+
+    with pytest.raises(UnknownSchemaVersionError):
+        reader.decode(writer.encode({"table_name": "pos_demo", "data": {"id": 1}}))
+
+def test_truncated_body_raises_row_codec_error(registry):
+    body, _ = registry.encode(MESSAGE)
+
+    with pytest.raises(RowCodecError):
+        registry.decode(body[:-3])
@@ -0,0 +1,65 @@
+from flask import Flask
+
+from pos_common.startup import StartupTracker, install_readiness
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_checkpoints_and_warmup_steps_are_timed():
+    """Each checkpoint and warm-up step appears in the breakdown with its duration."""
+    # --- Arrange ---
+    clock = FakeClock()
+    tracker = StartupTracker("svc", budget_seconds=1.0, clock=clock)
+    clock.now = 0.25
+    tracker.checkpoint("imports")
+
+    def slow_step():
+        clock.now += 0.5
+
+    tracker.add_warmup_step("client", slow_step)
+
+    # --- Act ---
+    tracker.start(warmup=True, background=False)
+
+    # --- Assert ---
+    report = tracker.report()
+    assert report["ready"] is True
+    assert [(p["phase"], p["seconds"]) for p in report["phases"]] == [("imports", 0.25), ("warmup:client", 0.5)]
+    assert report["seconds_to_ready"] == 0.75
+    assert report["within_budget"] is True
+
+def test_failed_warmup_step_is_reported_but_does_not_block_readiness():
+    clock = FakeClock()
+    tracker = StartupTracker("svc", budget_seconds=0.1, clock=clock)
+
+    def broken():
+        clock.now += 1.0
+        raise RuntimeError("no credentials")
+
+    tracker.add_warmup_step("secrets", broken)
+    tracker.start(warmup=True, background=False)
+
+    report = tracker.report()
+    assert report["ready"] is True
+    assert report["phases"][0]["status"] == "error"
+    assert report["phases"][0]["error"] == "no credentials"
+    assert report["within_budget"] is False
+
+def test_ready_endpoint_returns_503_until_warm():
+    """/ready reports 503 while warming and 200 with the breakdown afterwards."""
+    # --- Arrange ---
+    tracker = StartupTracker("svc")
+    app = Flask(__name__)
+    install_readiness(app, tracker)
+    client = app.test_client()
+
+    # --- Act & Assert ---
+    assert client.get('/ready').status_code == 503
+    tracker.start(warmup=False)
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.get_json()["service"] == "svc"
@@ -0,0 +1,31 @@
+import json
+
+from pos_common import tracing
+
+def test_spans_nest_and_continue_across_services(tmp_path):
+    """A traceparent attribute carries the current span to another service; the file exporter keeps them all."""
+    # --- Arrange ---
+    exporter = tracing.FileExporter(str(tmp_path / "spans.jsonl"))
+    tracing.set_exporter(exporter)
+    poller, processor = tracing.Tracer("pos-poller"), tracing.Tracer("pos-processor")
+
+    # --- Act ---
+    try:
+        with poller.span("page", skip=0):
+            attributes = tracing.inject({})
+        with processor.span("process", parent=tracing.extract(attributes)):
+            with processor.span("insert"):
+                pass
+    finally:
+        tracing.set_exporter(None)
+
+    # --- Assert ---
+    page, insert, process = tracing.load_spans(exporter.path)
+    assert attributes["traceparent"] == f"00-{page['trace_id']}-{page['span_id']}-01"
+    assert insert["trace_id"] == process["trace_id"] == page["trace_id"]
+    assert (insert["parent_id"], process["parent_id"]) == (process["span_id"], page["span_id"])
+    assert tracing.summarize([insert, process, page])["end_to_end"]["count"] == 1
+    # Without an exporter nothing is recorded or propagated.
+    with poller.span("page"):
+        assert tracing.inject({}) == {}
+    assert tracing.extract({"traceparent": "garbage"}) is None
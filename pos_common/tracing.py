@@ -0,0 +1,241 @@
+"""
+Span-based tracing across the POS services, without a tracing backend.
+
+The poller records sync, endpoint, date and page spans. Each published
+message carries a W3C 'traceparent' attribute naming its page span, so the
+processor's process, decode, validate, normalize and insert spans join the
+same trace. That covers one record from OData fetch to BigQuery row.
+
+Finished spans go to an exporter:
+
+    TRACING_EXPORTER=memory   kept in process (InMemoryExporter; tests and the load harness)
+    TRACING_EXPORTER=file     appended as JSON lines to TRACING_FILE_PATH (default /tmp/pos_traces.jsonl)
+
+With no exporter (the default), spans are not recorded and cost one context
+manager call. Summarize an exported file offline:
+
+    python -m pos_common.tracing summarize --path /tmp/pos_traces.jsonl
+"""
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TRACEPARENT = "traceparent"
+DEFAULT_TRACE_FILE = "/tmp/pos_traces.jsonl"
+
+# (trace_id, span_id) of the span the current thread or request is inside.
+_current: ContextVar[Optional[Tuple[str, str]]] = ContextVar("pos_trace_context", default=None)
+
+
+# --- Exporters ---
+
+class InMemoryExporter:
+    """Keeps finished spans in a list."""
+
+    def __init__(self):
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: dict) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans = []
+
+
+class FileExporter:
+    """Appends finished spans to a JSONL file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: dict) -> None:
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(line)
+
+
+_exporter_override: List[Any] = []
+
+
+@lru_cache(maxsize=1)
+def _configured_exporter():
+    kind = os.environ.get("TRACING_EXPORTER", "").lower()
+    if kind == "memory":
+        return InMemoryExporter()
+    if kind == "file":
+        return FileExporter(os.environ.get("TRACING_FILE_PATH", DEFAULT_TRACE_FILE))
+    return None
+
+
+def get_exporter():
+    """The exporter set with set_exporter, else the one configured by TRACING_EXPORTER, else None."""
+    return _exporter_override[-1] if _exporter_override else _configured_exporter()
+
+
+def set_exporter(exporter) -> None:
+    """Routes spans to exporter (None restores the configured one)."""
+    _exporter_override.clear()
+    if exporter is not None:
+        _exporter_override.append(exporter)
+
+
+# --- Context propagation ---
+
+def inject(attributes: Dict[str, str]) -> Dict[str, str]:
+    """Adds the current span as a 'traceparent' attribute when tracing is on."""
+    context = _current.get()
+    if context is not None:
+        attributes[TRACEPARENT] = f"00-{context[0]}-{context[1]}-01"
+    return attributes
+
+
+def extract(attributes: Optional[Dict[str, str]]) -> Optional[Tuple[str, str]]:
+    """Reads (trace_id, parent span_id) from a 'traceparent' attribute; None if absent or malformed."""
+    value = (attributes or {}).get(TRACEPARENT)
+    if not value:
+        return None
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+# --- Spans ---
+
+class Span:
+    """One timed operation. Attributes can be added while it is open."""
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional[Tuple[str, str]], attributes: dict, exporter):
+        self.tracer = tracer
+        self.name = name
+        self.exporter = exporter
+        self.parent = parent if parent is not None else _current.get()
+        self.trace_id = self.parent[0] if self.parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = attributes
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self._token = _current.set((self.trace_id, self.span_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        _current.reset(self._token)
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent[1] if self.parent else None,
+            "service": self.tracer.service,
+            "name": self.name,
+            "start_unix_ns": self.start_ns,
+            "duration_ms": round(duration_ms, 3),
+            "attributes": self.attributes,
+        }
+        if exc is not None:
+            span["error"] = f"{exc_type.__name__}: {exc}"
+        self.exporter.export(span)
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Creates spans for one service."""
+
+    def __init__(self, service: str):
+        self.service = service
+
+    def span(self, name: str, parent: Optional[Tuple[str, str]] = None, **attributes):
+        """
+        A context manager timing the block. parent, from extract(), continues a
+        trace from another service; otherwise the enclosing span is the parent.
+        """
+        exporter = get_exporter()
+        if exporter is None:
+            return _NOOP_SPAN
+        return Span(self, name, parent, attributes, exporter)
+
+
+# --- Offline analysis ---
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(spans: Iterable[dict]) -> dict:
+    """
+    Latency breakdown per (service, span name): count, total, p50, p99 and max
+    in milliseconds. Each insert whose trace reaches back into the poller also
+    gives an end-to-end time, from the start of the page span that fetched the
+    record to the end of the insert.
+    """
+    durations: Dict[str, List[float]] = {}
+    by_id: Dict[str, dict] = {}
+    for span in spans:
+        durations.setdefault(f"{span['service']}/{span['name']}", []).append(span["duration_ms"])
+        by_id[span["span_id"]] = span
+
+    def stats(values: List[float]) -> dict:
+        values = sorted(values)
+        return {"count": len(values), "total_ms": round(sum(values), 3), "p50_ms": _percentile(values, 0.50),
+                "p99_ms": _percentile(values, 0.99), "max_ms": values[-1]}
+
+    end_to_end = []
+    for insert in (span for span in by_id.values() if span["name"] == "insert"):
+        origin = insert
+        while origin is not None and origin["service"] == insert["service"]:
+            origin = by_id.get(origin["parent_id"])
+        if origin is not None:
+            end_to_end.append((insert["start_unix_ns"] - origin["start_unix_ns"]) / 1e6 + insert["duration_ms"])
+    summary = {"spans": {name: stats(values) for name, values in sorted(durations.items())}}
+    if end_to_end:
+        summary["end_to_end"] = stats(end_to_end)
+    return summary
+
+
+def load_spans(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze exported POS trace spans.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summarize_parser = sub.add_parser("summarize", help="Latency breakdown per span name.")
+    summarize_parser.add_argument("--path", default=os.environ.get("TRACING_FILE_PATH", DEFAULT_TRACE_FILE))
+    args = parser.parse_args(argv)
+
+    print(json.dumps(summarize(load_spans(args.path)), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+In-process end-to-end load harness for the POS pipeline.
+
+Runs the real poller code (sync_endpoint, transform, encoding, compression,
+the streaming publisher) against a synthetic OData API. Messages go to an
+in-memory Pub/Sub publisher and are delivered to the real processor while the
+sync is still running:
+
+    push   one Pub/Sub push envelope per message through the Flask test client
+    pull   batches through the pull-mode path (DlqReplayer.process_batch)
+
+Inserts land in a fake BigQuery client. The report gives end-to-end
+records/sec, p50/p99 latency from page fetch to insert, and peak memory.
+Synthetic records are generated from the table schemas, so every field of
+every table is exercised. Values follow the field's role as the OData service
+sends it: dates and timestamps as Microsoft JSON dates on the queried business
+date, NUMERIC_FIELDS as numeric strings. --trace adds the span latency
+breakdown of pos_common/tracing.py (push mode covers both services).
+
+    python -m pos_harness.harness --endpoints Checks ItemSales --days-back 6 --records-per-date 2000
+    python -m pos_harness.harness --mode pull --compression zstd --encoding binary --trace-memory
+    python -m pos_harness.harness --endpoints Checks --trace
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import base64
+import random
+import logging
+import argparse
+import resource
+import threading
+import tracemalloc
+from concurrent.futures import Future
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from unittest.mock import patch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINTS = ["Checks", "ItemSales", "Payments"]
+# Business date of queries without a date filter (undated endpoints).
+DEFAULT_BUSINESS_DATE = "2024-06-30"
+DAY_MS = 86_400_000
+_STOP = object()
+_FILTER_DATE = re.compile(r"datetime'(\d{4}-\d{2}-\d{2})")
+
+
+# --- Fakes ---
+
+# Field roles, which decide how a synthetic value is shaped.
+NUMERIC, DATE, TIMESTAMP = "numeric", "date", "timestamp"
+
+def _types(spec: dict) -> List[str]:
+    types = spec.get("type", "string")
+    return [types] if isinstance(types, str) else list(types)
+
+def _field_role(name: str, spec: dict) -> Optional[str]:
+    from pos_poller.config import NUMERIC_FIELDS
+    raw_name = "".join(part[:1].upper() + part[1:] for part in name.split("_"))
+    if raw_name in NUMERIC_FIELDS:
+        return NUMERIC
+    if name == "business_date" or spec.get("format") == "date":
+        return DATE
+    if spec.get("format") == "date-time":
+        return TIMESTAMP
+    return None
+
+
+class SyntheticOdataApi:
+    """Serves records_per_date schema-conformant records for every (endpoint, date) query, paged by $skip/$top."""
+
+    def __init__(self, records_per_date: int, seed: int = 0):
+        from pos_poller.config import ODATA_ENDPOINTS
+        from pos_common.schema_store import get_schema_store
+        from pos_poller.utils import to_snake_case
+
+        self.records_per_date = records_per_date
+        self._rng = random.Random(seed)
+        self._fields: Dict[str, list] = {}
+        by_table = {schema.get("properties", {}).get("table_name", {}).get("const"): schema
+                    for schema in get_schema_store().values()}
+        for endpoint, config in ODATA_ENDPOINTS.items():
+            schema = by_table.get(config["table_name"])
+            if not schema:
+                continue
+            fields = []
+            for name, spec in schema["properties"]["data"].get("properties", {}).items():
+                raw_name = "".join(part[:1].upper() + part[1:] for part in name.split("_"))
+                if to_snake_case(raw_name) != name:
+                    continue
+                role = _field_role(name, spec)
+                if role == NUMERIC and not {"integer", "number"} & set(_types(spec)):
+                    # The poller turns any numeric string in these into a number, which their
+                    # string-only schema rejects; they are optional, so leave them out.
+                    continue
+                fields.append((raw_name, spec, role))
+            self._fields[endpoint] = fields
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def last_fetch_time(self) -> Optional[float]:
+        """The time of the calling thread's most recent page fetch."""
+        return getattr(self._local, "fetched_at", None)
+
+    def _numeric_string(self, spec: dict) -> str:
+        """The API sends numeric fields as strings; the poller converts them."""
+        if "number" in _types(spec):
+            return f"{self._rng.uniform(0, 500):.2f}"
+        return str(self._rng.randint(1, 10_000))
+
+    def _value(self, spec: dict, role: Optional[str], record_id: int, day_ms: int):
+        if role == NUMERIC:
+            return self._numeric_string(spec)
+        if role == DATE:
+            # Edm.DateTime at midnight; the processor normalizes it to the date.
+            return f"/Date({day_ms})/"
+        if role == TIMESTAMP:
+            return f"/Date({day_ms + self._rng.randrange(DAY_MS)})/"
+        fmt = spec.get("format")
+        if fmt == "uuid":
+            return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+        if fmt == "email":
+            return f"guest{record_id}@example.com"
+        primary = next((t for t in _types(spec) if t != "null"), "null")
+        if primary == "integer":
+            return self._rng.randint(1, 10_000)
+        if primary == "number":
+            return round(self._rng.uniform(0, 500), 2)
+        if primary == "boolean":
+            return self._rng.random() < 0.5
+        if primary == "string":
+            return f"value-{record_id}"
+        return None
+
+    def fetch_page(self, url: str, params: dict, access_token: Optional[str] = None) -> list:
+        self._local.fetched_at = time.perf_counter()
+        endpoint = url.rstrip("/").rsplit("/", 1)[-1]
+        skip, top = int(params.get("$skip", 0)), int(params.get("$top", 1000))
+        count = max(0, min(top, self.records_per_date - skip))
+        match = _FILTER_DATE.search(params.get("$filter", ""))
+        business_date = datetime.strptime(match.group(1) if match else DEFAULT_BUSINESS_DATE, "%Y-%m-%d")
+        day_ms = int(business_date.replace(tzinfo=timezone.utc).timestamp() * 1000)
+        records = []
+        with self._lock:
+            for _ in range(count):
+                self._next_id += 1
+                record = {}
+                for raw_name, spec, role in self._fields.get(endpoint, []):
+                    record[raw_name] = self._value(spec, role, self._next_id, day_ms)
+                record["Id"] = self._next_id
+                records.append(record)
+        return records
+
+
+class InMemoryPublisher:
+    """A PublisherClient stand-in that queues messages, stamped with their page's fetch time, for delivery."""
+
+    def __init__(self, api: SyntheticOdataApi):
+        self.api = api
+        self.messages: "queue.Queue" = queue.Queue()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def topic_path(self, project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic: str, data: bytes, **attributes) -> Future:
+        with self._lock:
+            self._sequence += 1
+            message_id = str(self._sequence)
+        self.messages.put((message_id, data, attributes, self.api.last_fetch_time()))
+        future = Future()
+        future.set_result(message_id)
+        return future
+
+
+class FakeBigQueryClient:
+    """Records insert_rows_json calls per table and always succeeds."""
+
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table_id: str, rows: list, **kwargs) -> list:
+        # Round-trip through JSON as the real client does, so serialization cost is counted.
+        json.dumps(rows)
+        table = table_id.rsplit(".", 1)[-1]
+        with self._lock:
+            self.rows[table] = self.rows.get(table, 0) + len(rows)
+        return []
+
+
+class _AckingSubscriber:
+    def acknowledge(self, request: dict) -> None:
+        pass
+
+    def modify_ack_deadline(self, request: dict) -> None:
+        pass
+
+
+# --- Delivery ---
+
+def _deliver_push(client, message_id: str, data: bytes, attributes: dict) -> bool:
+    envelope = {"message": {"data": base64.b64encode(data).decode("ascii"), "attributes": attributes,
+                            "messageId": message_id}}
+    return client.post("/", json=envelope).status_code == 204
+
+
+def _consume(publisher: InMemoryPublisher, mode: str, batch_size: int, latencies: List[float], outcome: dict) -> None:
+    from pos_processor import main as processor
+    from pos_processor.dlq_replay import DlqReplayer
+
+    client = processor.app.test_client()
+    replayer = DlqReplayer(_AckingSubscriber(), "harness", processor._insert_rows)
+    done = False
+    while not done:
+        batch = [publisher.messages.get()]
+        while len(batch) < (batch_size if mode == "pull" else 1):
+            try:
+                batch.append(publisher.messages.get_nowait())
+            except queue.Empty:
+                break
+        if batch[-1] is _STOP:
+            batch.pop()
+            done = True
+        if mode == "push":
+            for message_id, data, attributes, fetched_at in batch:
+                accepted = _deliver_push(client, message_id, data, attributes)
+                outcome["delivered" if accepted else "rejected"] += 1
+                if accepted and fetched_at is not None:
+                    latencies.append(time.perf_counter() - fetched_at)
+        elif batch:
+            received = [SimpleNamespace(ack_id=message_id, message=SimpleNamespace(
+                data=data, attributes=attributes, message_id=message_id)) for message_id, data, attributes, _ in batch]
+            replayer.process_batch(received)
+            now = time.perf_counter()
+            latencies.extend(now - fetched_at for _, _, _, fetched_at in batch if fetched_at is not None)
+    if mode == "pull":
+        totals = [report for report in replayer.report.values()]
+        outcome["delivered"] = sum(report["inserted"] for report in totals)
+        outcome["rejected"] = sum(report["invalid"] + report["insert_failed"] for report in totals)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# --- Runner ---
+
+def run_harness(
+    endpoints: List[str] = DEFAULT_ENDPOINTS,
+    days_back: int = 0,
+    records_per_date: int = 1000,
+    mode: str = "push",
+    batch_size: int = 500,
+    compression: Optional[str] = None,
+    encoding: Optional[str] = None,
+    trace_memory: bool = False,
+    trace: bool = False,
+) -> dict:
+    """Runs one end-to-end load test and returns its report."""
+    from pos_poller import poller
+    from pos_processor import main as processor
+    from pos_common.compression import resolve_codec
+    from pos_common import tracing
+
+    api = SyntheticOdataApi(records_per_date)
+    publisher = InMemoryPublisher(api)
+    bigquery = FakeBigQueryClient()
+    latencies: List[float] = []
+    outcome = {"delivered": 0, "rejected": 0}
+
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(poller, "get_publisher_client", return_value=publisher))
+        stack.enter_context(patch.object(poller, "fetch_odata_page", side_effect=api.fetch_page))
+        stack.enter_context(patch.object(poller, "get_api_credentials", return_value=("harness-site", "harness-token")))
+        stack.enter_context(patch.object(processor, "get_bigquery_client", return_value=bigquery))
+        if compression:
+            stack.enter_context(patch.object(poller, "PUBLISH_COMPRESSION", resolve_codec(compression)))
+        if encoding:
+            stack.enter_context(patch.object(poller, "PUBLISH_ENCODING", encoding))
+        spans = tracing.InMemoryExporter() if trace else None
+        if trace:
+            tracing.set_exporter(spans)
+            stack.callback(tracing.set_exporter, None)
+
+        if trace_memory:
+            tracemalloc.start()
+        consumer = threading.Thread(target=_consume, args=(publisher, mode, batch_size, latencies, outcome),
+                                    name="harness-consumer", daemon=True)
+        start = time.perf_counter()
+        consumer.start()
+        published = 0
+        for endpoint in endpoints:
+            published += poller.sync_endpoint(endpoint, days_back)
+        publisher.messages.put(_STOP)
+        consumer.join()
+        seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+
+    latencies.sort()
+    report = {
+        "mode": mode,
+        "endpoints": endpoints,
+        "records_published": published,
+        "records_inserted": sum(bigquery.rows.values()),
+        "records_rejected": outcome["rejected"],
+        "seconds": round(seconds, 3),
+        "records_per_second": round(sum(bigquery.rows.values()) / seconds) if seconds else None,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        },
+        "peak_traced_memory_mb": round(traced_peak / 1024 / 1024, 1) if traced_peak is not None else None,
+        # ru_maxrss is in kilobytes on Linux; it covers the whole process, including imports.
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "inserted_by_table": dict(sorted(bigquery.rows.items())),
+    }
+    if spans is not None:
+        report["trace"] = tracing.summarize(spans.spans)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the poller and processor end to end against in-memory fakes.")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--days-back", type=int, default=0)
+    parser.add_argument("--records-per-date", type=int, default=1000)
+    parser.add_argument("--mode", choices=["push", "pull"], default="push")
+    parser.add_argument("--batch-size", type=int, default=500, help="Messages per pull batch (pull mode).")
+    parser.add_argument("--compression", help="Override PUBLISH_COMPRESSION (identity, gzip, zstd).")
+    parser.add_argument("--encoding", choices=["json", "binary"], help="Override PUBLISH_ENCODING.")
+    parser.add_argument("--trace-memory", action="store_true", help="Track peak Python allocations (slows the run).")
+    parser.add_argument("--trace", action="store_true", help="Record spans and report the latency breakdown per span.")
+    args = parser.parse_args(argv)
+
+    report = run_harness(args.endpoints, args.days_back, args.records_per_date, args.mode, args.batch_size,
+                         args.compression, args.encoding, args.trace_memory, args.trace)
+    print(json.dumps(report, indent=2))
+    return 1 if report["records_rejected"] else 0
+
+
+if __name__ == "__main__":
+    # The services log every message at INFO; keep the harness measuring the pipeline, not log I/O.
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Bulk backfill path for the POS Poller.
+
+Historical reloads bypass Pub/Sub and streaming inserts: records are fetched
+page by page, run through transform_odata_record and the processor's
+validation and normalization, written as gzip-compressed newline-delimited JSON
+partitioned by table and business_date, and then loaded with BigQuery load jobs
+into a staging table that is MERGEd into the destination on (site_object_id, id).
+The loader is pluggable so file generation and load orchestration can be
+exercised offline with FakeLoader.
+
+Usage:
+    python -m pos_poller.backfill --days-back 365 --output-dir /tmp/backfill
+    python -m pos_poller.backfill --endpoints Checks,ItemSales --days-back 30 --output-dir /tmp/backfill --fake-load
+"""
+import os
+import sys
+import gzip
+import json
+import logging
+import argparse
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pos_poller.config import ODATA_ENDPOINTS, BACKFILL_PARTITIONED_TABLES
+from pos_poller.poller import (
+    API_BASE_URL, API_PAGE_SIZE, CHICAGO_TZ,
+    fetch_odata_page, transform_odata_record, get_api_credentials,
+    _build_odata_params, _create_pubsub_message_payload, _get_date_range_for_sync,
+)
+from pos_processor.schema_validator import validate_messages
+from pos_processor.normalize import normalize_record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS_PER_FILE = 100_000
+UNPARTITIONED = "__unpartitioned__"
+
+# --- File Generation ---
+
+class PartitionedFileWriter:
+    """
+    Writes rows as gzip-compressed NDJSON under
+    <output_dir>/<table>/business_date=<YYYY-MM-DD>/part-<n>.json.gz,
+    rolling over to a new part after max_rows_per_file rows.
+    """
+
+    def __init__(self, output_dir: str, max_rows_per_file: int = DEFAULT_MAX_ROWS_PER_FILE):
+        self.output_dir = output_dir
+        self.max_rows_per_file = max_rows_per_file
+        self._open_files: Dict[Tuple[str, str], Tuple[gzip.GzipFile, int, str]] = {}
+        self._part_counters: Dict[Tuple[str, str], int] = {}
+        self.files: Dict[Tuple[str, str], List[str]] = {}
+        self.rows_written: Dict[str, int] = {}
+
+    def _open_part(self, partition: Tuple[str, str]) -> Tuple[gzip.GzipFile, int, str]:
+        table_name, business_date = partition
+        part = self._part_counters.get(partition, 0)
+        self._part_counters[partition] = part + 1
+        directory = os.path.join(self.output_dir, table_name, f"business_date={business_date}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{part:05d}.json.gz")
+        self.files.setdefault(partition, []).append(path)
+        return gzip.open(path, 'wt', encoding='utf-8'), 0, path
+
+    def write(self, table_name: str, row: dict) -> None:
+        business_date = row.get('business_date') or UNPARTITIONED
+        partition = (table_name, str(business_date)[:10])
+        handle, count, path = self._open_files.get(partition) or self._open_part(partition)
+        if count >= self.max_rows_per_file:
+            handle.close()
+            handle, count, path = self._open_part(partition)
+        handle.write(json.dumps(row, separators=(',', ':')))
+        handle.write('\n')
+        self._open_files[partition] = (handle, count + 1, path)
+        self.rows_written[table_name] = self.rows_written.get(table_name, 0) + 1
+
+    def close_open_files(self) -> None:
+        """Closes the open parts; later rows for the same partition start a new part."""
+        for handle, _, _ in self._open_files.values():
+            handle.close()
+        self._open_files.clear()
+
+    def close(self) -> Dict[Tuple[str, str], List[str]]:
+        """Closes every open part and returns the files written, keyed by (table, business_date)."""
+        self.close_open_files()
+        return self.files
+
+# --- Loaders ---
+
+# Rows are matched on these columns; tables without site_object_id match on id alone.
+MERGE_KEY_COLUMNS = ("site_object_id", "id")
+STAGING_TABLE_TTL = timedelta(days=1)
+
+
+def _merge_sql(destination: str, staging: str, columns: List[str], business_date: Optional[str] = None) -> str:
+    """
+    MERGE of a staging table into the destination on (site_object_id, id).
+    Existing rows are updated and new ones inserted; rows of other sites, and
+    of records the backfill did not fetch, are left alone. With business_date,
+    the destination side is limited to that partition.
+    """
+    keys = [column for column in MERGE_KEY_COLUMNS if column in columns]
+    on = " AND ".join(f"IFNULL(CAST(T.{key} AS STRING), '') = IFNULL(CAST(S.{key} AS STRING), '')" for key in keys)
+    if business_date is not None:
+        on += f" AND DATE(T.business_date) = DATE '{business_date}'"
+    partition_by = ", ".join(f"CAST({key} AS STRING)" for key in keys)
+    updates = ", ".join(f"{column} = S.{column}" for column in columns if column not in keys)
+    return (
+        f"MERGE `{destination}` T "
+        f"USING (SELECT * FROM `{staging}` WHERE TRUE QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition_by}) = 1) S "
+        f"ON {on} "
+        f"WHEN MATCHED THEN UPDATE SET {updates} "
+        f"WHEN NOT MATCHED THEN INSERT ROW"
+    )
+
+
+class BigQueryLoader:
+    """
+    Loads NDJSON files with BigQuery load jobs into a staging table, then
+    MERGEs the staging table into the destination on (site_object_id, id).
+    The destination tables are shared by every site's poller, so a backfill of
+    one site, endpoint or date range never truncates a partition, and
+    re-running it updates rows instead of duplicating them.
+    """
+
+    def __init__(self, project_id: Optional[str] = None, dataset_id: Optional[str] = None):
+        from google.cloud import bigquery
+        self._bigquery = bigquery
+        self.client = bigquery.Client(project=project_id)
+        self.project_id = project_id or self.client.project
+        self.dataset_id = dataset_id or os.environ.get("BIGQUERY_DATASET_ID")
+
+    def load(self, table_name: str, business_date: str, paths: List[str]) -> int:
+        bigquery = self._bigquery
+        destination = f"{self.project_id}.{self.dataset_id}.{table_name}"
+        suffix = f"{business_date.replace('-', '')}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+        staging_id = f"{self.project_id}.{self.dataset_id}._backfill_staging_{table_name}_{suffix}"
+        schema = self.client.get_table(destination).schema
+        staging = bigquery.Table(staging_id, schema=schema)
+        # A crashed backfill leaves no staging tables behind for long.
+        staging.expires = datetime.now(timezone.utc) + STAGING_TABLE_TTL
+        self.client.create_table(staging)
+        try:
+            rows_loaded = 0
+            for path in paths:
+                job_config = bigquery.LoadJobConfig(
+                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                    schema=schema,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                )
+                with open(path, 'rb') as source:
+                    job = self.client.load_table_from_file(source, staging_id, job_config=job_config)
+                job.result()
+                rows_loaded += job.output_rows or 0
+                logger.info(f"Staged {job.output_rows} rows from {path} in {staging_id}")
+            partitioned = table_name in BACKFILL_PARTITIONED_TABLES and business_date != UNPARTITIONED
+            sql = _merge_sql(destination, staging_id, [field.name for field in schema],
+                             business_date if partitioned else None)
+            self.client.query(sql).result()
+            logger.info(f"Merged {rows_loaded} staged rows into {destination} ({business_date})")
+            return rows_loaded
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+
+
+class FakeLoader:
+    """An offline stand-in for BigQueryLoader that reads the files back and records each load."""
+
+    def __init__(self):
+        self.loads: List[dict] = []
+
+    def load(self, table_name: str, business_date: str, paths: List[str]) -> int:
+        rows = 0
+        for path in paths:
+            with gzip.open(path, 'rt', encoding='utf-8') as handle:
+                for line in handle:
+                    json.loads(line)
+                    rows += 1
+        self.loads.append({'table_name': table_name, 'business_date': business_date, 'paths': list(paths), 'rows': rows})
+        return rows
+
+# --- Orchestration ---
+
+def _backfill_date(url: str, endpoint_name: str, site_id: str, target_date: Optional[datetime],
+                   sync_id: str, writer: PartitionedFileWriter, rejects: List[dict]) -> int:
+    """Fetches every page for one date and writes the valid, normalized rows."""
+    endpoint_config = ODATA_ENDPOINTS[endpoint_name]
+    table_name = endpoint_config['table_name']
+    event_type = f"pos.{table_name.replace('pos_', '')}"
+    written = 0
+    skip = 0
+    while True:
+        params = _build_odata_params(endpoint_config, site_id, target_date, skip)
+        records = fetch_odata_page(url, params)
+        payloads = [
+            _create_pubsub_message_payload(transform_odata_record(record, endpoint_name), table_name, event_type, sync_id)
+            for record in records
+        ]
+        for payload, (is_valid, error) in zip(payloads, validate_messages(payloads)):
+            if not is_valid:
+                rejects.append({'record_id': payload['record_id'], 'table_name': table_name, 'error': error})
+                continue
+            writer.write(table_name, normalize_record(payload['data'], table_name))
+            written += 1
+        if len(records) < API_PAGE_SIZE:
+            return written
+        skip += API_PAGE_SIZE
+
+def run_backfill(
+    endpoints: List[str],
+    days_back: int,
+    output_dir: str,
+    loader=None,
+    end_date: Optional[datetime] = None,
+    max_rows_per_file: int = DEFAULT_MAX_ROWS_PER_FILE,
+) -> dict:
+    """
+    Writes partitioned NDJSON files for the requested window and, if a loader is
+    given, loads each (table, business_date) partition with it.
+    """
+    site_id, _ = get_api_credentials()
+    writer = PartitionedFileWriter(output_dir, max_rows_per_file)
+    rejects: List[dict] = []
+    results = {}
+    for endpoint_name in endpoints:
+        endpoint_config = ODATA_ENDPOINTS[endpoint_name]
+        sync_id = f"{endpoint_name}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}"
+        dates = _get_date_range_for_sync(endpoint_config, days_back)
+        if end_date is not None and dates != [None]:
+            dates = [end_date - timedelta(days=i) for i in range(days_back + 1)]
+        url = f"{API_BASE_URL}/{endpoint_name}"
+        written = 0
+        try:
+            for target_date in dates:
+                written += _backfill_date(url, endpoint_name, site_id, target_date, sync_id, writer, rejects)
+                # Keeps the number of open file handles bounded on year-long windows.
+                writer.close_open_files()
+            results[endpoint_name] = {'status': 'success', 'rows_written': written}
+        except Exception as e:
+            logger.error(f"[{sync_id}] Backfill failed for endpoint '{endpoint_name}': {e}", exc_info=True)
+            results[endpoint_name] = {'status': 'error', 'rows_written': written, 'message': str(e)}
+        logger.info(f"[{sync_id}] Wrote {written} rows for {endpoint_name}.")
+
+    files = writer.close()
+    loads = []
+    if loader is not None:
+        # A failed endpoint left partial partitions; they are loaded once a re-run has fetched them in full.
+        failed_tables = {ODATA_ENDPOINTS[name]['table_name'] for name, result in results.items() if result['status'] == 'error'}
+        for (table_name, business_date), paths in sorted(files.items()):
+            if table_name in failed_tables:
+                logger.warning(f"Skipping load of {table_name} {business_date}: its endpoint failed during fetch.")
+                continue
+            rows_loaded = loader.load(table_name, business_date, paths)
+            loads.append({'table_name': table_name, 'business_date': business_date,
+                          'files': len(paths), 'rows_loaded': rows_loaded})
+
+    if rejects:
+        rejects_path = os.path.join(output_dir, '_rejects.jsonl')
+        with open(rejects_path, 'w', encoding='utf-8') as handle:
+            for reject in rejects:
+                handle.write(json.dumps(reject) + '\n')
+        logger.warning(f"{len(rejects)} record(s) failed validation; details written to {rejects_path}")
+
+    return {
+        'results': results,
+        'rows_written': writer.rows_written,
+        'rejected': len(rejects),
+        'partitions': len(files),
+        'loads': loads,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Backfill POS data through BigQuery load jobs.")
+    parser.add_argument('--endpoints', default='all', help="'all' or a comma-separated list of endpoints.")
+    parser.add_argument('--days-back', type=int, required=True)
+    parser.add_argument('--end-date', help="Newest date (YYYY-MM-DD) of the window. Defaults to today.")
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--max-rows-per-file', type=int, default=DEFAULT_MAX_ROWS_PER_FILE)
+    load_mode = parser.add_mutually_exclusive_group()
+    load_mode.add_argument('--fake-load', action='store_true', help="Verify and count the files instead of loading them.")
+    load_mode.add_argument('--no-load', action='store_true', help="Only write the files.")
+    args = parser.parse_args(argv)
+
+    if args.endpoints == 'all':
+        endpoints = sorted(ODATA_ENDPOINTS.keys())
+    else:
+        endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+        invalid = [name for name in endpoints if name not in ODATA_ENDPOINTS]
+        if invalid:
+            parser.error(f"Unknown endpoints: {invalid}")
+
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d').replace(tzinfo=CHICAGO_TZ) if args.end_date else None
+    if args.no_load:
+        loader = None
+    elif args.fake_load:
+        loader = FakeLoader()
+    else:
+        loader = BigQueryLoader(os.environ.get("GCP_PROJECT_ID"))
+
+    summary = run_backfill(endpoints, args.days_back, args.output_dir, loader, end_date, args.max_rows_per_file)
+    print(json.dumps(summary, indent=2))
+    return 1 if any(result['status'] == 'error' for result in summary['results'].values()) else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -14,6 +14,21 @@ ODATA_ENDPOINTS = {
     "ItemSaleComponents":  {"table_name": "pos_item_sale_components",  "date_field": "BusinessDate",      "site_field": "Site_ObjectId"},
 }
 
+# Child collections fetched with their parent through $expand when EXPAND_CHILD_ENTITIES is on:
+# parent endpoint -> {child endpoint: navigation property}. The navigation property names must
+# match the service's $metadata.
+EXPANDED_CHILDREN = {
+    "ItemSales": {
+        "ItemSaleTaxes":       "ItemSaleTaxes",
+        "ItemSaleComponents":  "ItemSaleComponents",
+        "ItemSaleAdjustments": "ItemSaleAdjustments",
+    },
+}
+
+# Tables partitioned on business_date in BigQuery (see terraform/bigquery.tf).
+# Backfill load jobs replace these one partition at a time.
+BACKFILL_PARTITIONED_TABLES = {"pos_checks", "pos_item_sales", "pos_time_records", "pos_paidouts"}
+
 # This can be phased out by setting APPLY_FIELD_TRANSFORMATIONS to False
 APPLY_FIELD_TRANSFORMATIONS = False
 FIELD_TRANSFORMATIONS = {}
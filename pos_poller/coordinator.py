@@ -0,0 +1,432 @@
+"""
+Sharded sync coordinator for the POS Poller.
+
+Splits a sync request into (endpoint, date range, site) work units and hands
+them out through a work queue so many poller workers can share one backfill.
+Two queues are provided: a SQLite queue (a local file, for tests or workers
+sharing a volume) and a Pub/Sub queue. Each unit is run with sync_endpoint.
+
+Usage:
+    python -m pos_poller.coordinator plan  --queue sqlite:/tmp/work.db --days-back 365
+    python -m pos_poller.coordinator work  --queue sqlite:/tmp/work.db
+    python -m pos_poller.coordinator shard --days-back 365 --task-index 0 --task-count 10
+"""
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pos_poller.config import ODATA_ENDPOINTS
+from pos_poller.poller import TRACER, sync_endpoint, drop_expanded_children, _get_date_range_for_sync, CHICAGO_TZ
+from pos_poller.cursors import PageCursors
+from pos_poller.sites import multi_site_configured, get_site, get_sites
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_DAYS = 7
+DEFAULT_LEASE_SECONDS = 1800
+# Pub/Sub accepts ack deadlines of 10 to 600 seconds.
+DEFAULT_ACK_DEADLINE_SECONDS = 60
+# A pull can come back empty while messages are still outstanding, so one empty
+# pull is not proof the queue is drained.
+DEFAULT_EMPTY_PULLS = 3
+DEFAULT_MAX_ATTEMPTS = 3
+
+# --- Work Units ---
+
+def _unit_id(endpoint: str, start_date: Optional[str], end_date: Optional[str], site_id: Optional[str]) -> str:
+    key = f"{endpoint}|{start_date}|{end_date}|{site_id}"
+    return hashlib.md5(key.encode()).hexdigest()[:16]
+
+def plan_work_units(
+    endpoints: List[str],
+    days_back: int,
+    site_ids: Optional[List[Optional[str]]] = None,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
+    end_date: Optional[datetime] = None,
+) -> List[Dict]:
+    """
+    Splits a sync into work units of at most chunk_days contiguous dates per
+    (endpoint, site). Dates are 'YYYY-MM-DD' strings in America/Chicago, newest
+    range first. Endpoints without a date field become a single undated unit.
+    Pin end_date when several processes must compute the same plan.
+    """
+    units = []
+    for site_id in site_ids or [None]:
+        for endpoint in drop_expanded_children(endpoints):
+            dates = _get_date_range_for_sync(ODATA_ENDPOINTS[endpoint], days_back)
+            if end_date is not None and dates != [None]:
+                dates = [end_date - timedelta(days=i) for i in range(days_back + 1)]
+            if dates == [None]:
+                units.append({
+                    'unit_id': _unit_id(endpoint, None, None, site_id),
+                    'endpoint': endpoint, 'start_date': None, 'end_date': None, 'site_id': site_id,
+                })
+                continue
+            for i in range(0, len(dates), chunk_days):
+                chunk = dates[i:i + chunk_days]
+                # Dates are newest-first, so the chunk's last date is its start.
+                chunk_start, chunk_end = chunk[-1].strftime('%Y-%m-%d'), chunk[0].strftime('%Y-%m-%d')
+                units.append({
+                    'unit_id': _unit_id(endpoint, chunk_start, chunk_end, site_id),
+                    'endpoint': endpoint, 'start_date': chunk_start, 'end_date': chunk_end, 'site_id': site_id,
+                })
+    return units
+
+def _unit_dates(unit: Dict) -> List[Optional[datetime]]:
+    """Expands a unit's date range into the newest-first list sync_endpoint expects."""
+    if not unit.get('start_date'):
+        return [None]
+    start = datetime.strptime(unit['start_date'], '%Y-%m-%d').replace(tzinfo=CHICAGO_TZ)
+    end = datetime.strptime(unit['end_date'], '%Y-%m-%d').replace(tzinfo=CHICAGO_TZ)
+    return [end - timedelta(days=i) for i in range((end - start).days + 1)]
+
+def run_work_unit(unit: Dict) -> int:
+    """
+    Runs one work unit through the existing sync_endpoint machinery. A unit with
+    dates that did not finish raises, so the queue retries it; the retry
+    continues those dates from their page cursors when it lands on an instance
+    that shares the state database.
+    """
+    logger.info(f"Running work unit {unit['unit_id']}: {unit['endpoint']} {unit['start_date']}..{unit['end_date']} site={unit['site_id']}")
+    cursors = PageCursors(unit['unit_id'])
+    report = {}
+    # Sites from the multi-site configuration use their own access token.
+    site = get_site(unit['site_id']) if unit.get('site_id') and multi_site_configured() else None
+    with TRACER.span("sync", run_id=unit['unit_id']):
+        records = sync_endpoint(unit['endpoint'], 0, target_dates=_unit_dates(unit), site_id=unit.get('site_id'),
+                                report=report, cursors=cursors, access_token=site['access_token'] if site else None)
+    failed_units = report.get('failed_units') or []
+    if failed_units:
+        raise RuntimeError(f"{len(failed_units)} date(s) did not finish: "
+                           f"{[(failed['business_date'], failed['next_skip']) for failed in failed_units]}")
+    cursors.discard()
+    return records
+
+def shard_units(units: List[Dict], task_index: int, task_count: int) -> List[Dict]:
+    """Static sharding: task i of n takes every n-th unit of the deterministic plan."""
+    if not 0 <= task_index < task_count:
+        raise ValueError(f"task_index must be in [0, {task_count}), got {task_index}")
+    return [unit for i, unit in enumerate(units) if i % task_count == task_index]
+
+# --- Work Queues ---
+
+class SQLiteWorkQueue:
+    """
+    A work queue in a SQLite file. Units are claimed with a lease; a unit whose
+    lease expires (e.g. its worker died) becomes claimable again.
+    """
+
+    DDL = """
+    CREATE TABLE IF NOT EXISTS work_units (
+        unit_id TEXT PRIMARY KEY,
+        unit TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker_id TEXT,
+        lease_expires_at REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        records_published INTEGER,
+        error TEXT,
+        seq INTEGER
+    );
+    """
+
+    def __init__(self, path: str, lease_seconds: int = DEFAULT_LEASE_SECONDS, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.DDL)
+
+    def enqueue(self, units: List[Dict]) -> int:
+        """Adds units to the queue. Units already present (same unit_id) are left untouched."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            next_seq = self._conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM work_units").fetchone()[0]
+            added = 0
+            for offset, unit in enumerate(units):
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO work_units (unit_id, unit, seq) VALUES (?, ?, ?)",
+                    (unit['unit_id'], json.dumps(unit), next_seq + offset),
+                )
+                added += cursor.rowcount
+            self._conn.execute("COMMIT")
+        return added
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically leases the next pending (or lease-expired) unit to a worker."""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so concurrent processes cannot claim the same unit.
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT unit_id, unit FROM work_units "
+                "WHERE status = 'pending' OR (status = 'claimed' AND lease_expires_at < ?) "
+                "ORDER BY seq LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            self._conn.execute(
+                "UPDATE work_units SET status = 'claimed', worker_id = ?, lease_expires_at = ?, attempts = attempts + 1 "
+                "WHERE unit_id = ?",
+                (worker_id, now + self.lease_seconds, row['unit_id']),
+            )
+            self._conn.execute("COMMIT")
+        return json.loads(row['unit'])
+
+    def complete(self, unit: Dict, records_published: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE work_units SET status = 'done', records_published = ?, error = NULL WHERE unit_id = ?",
+                (records_published, unit['unit_id']),
+            )
+
+    def fail(self, unit: Dict, error: str) -> None:
+        """Returns a unit to the queue, or marks it failed once it has used all its attempts."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE work_units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_expires_at = NULL WHERE unit_id = ?",
+                (self.max_attempts, error, unit['unit_id']),
+            )
+
+    def summary(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS units, COALESCE(SUM(records_published), 0) AS records FROM work_units GROUP BY status"
+            ).fetchall()
+        return {
+            'units': {row['status']: row['units'] for row in rows},
+            'records_published': sum(row['records'] for row in rows),
+        }
+
+
+class PubSubWorkQueue:
+    """
+    A work queue on a Pub/Sub topic and pull subscription. The ack deadline
+    acts as the lease: while a unit runs, a background thread keeps pushing
+    its deadline out to ack_deadline_seconds, so a long unit is not
+    redelivered to another worker. Failed units are nacked for redelivery and
+    the subscription's dead-letter policy bounds the retries. The queue counts
+    as drained after empty_pulls consecutive pulls return nothing.
+    """
+
+    def __init__(self, project_id: str, topic_id: str, subscription_id: str,
+                 ack_deadline_seconds: int = DEFAULT_ACK_DEADLINE_SECONDS,
+                 extend_every_seconds: Optional[float] = None,
+                 empty_pulls: int = DEFAULT_EMPTY_PULLS):
+        from google.cloud import pubsub_v1
+        self.publisher = pubsub_v1.PublisherClient()
+        self.subscriber = pubsub_v1.SubscriberClient()
+        self.topic_path = self.publisher.topic_path(project_id, topic_id)
+        self.subscription_path = self.subscriber.subscription_path(project_id, subscription_id)
+        self.ack_deadline_seconds = ack_deadline_seconds
+        # Renew well before the deadline so one slow or failed call does not lose the lease.
+        self.extend_every_seconds = extend_every_seconds or ack_deadline_seconds / 3
+        self.empty_pulls = empty_pulls
+        self._ack_ids: Dict[str, str] = {}
+        self._leases: Dict[str, tuple] = {}
+
+    def _extend(self, ack_id: str) -> None:
+        self.subscriber.modify_ack_deadline(
+            request={"subscription": self.subscription_path, "ack_ids": [ack_id],
+                     "ack_deadline_seconds": self.ack_deadline_seconds}
+        )
+
+    def _keep_leased(self, unit_id: str, ack_id: str, released: threading.Event) -> None:
+        while not released.wait(self.extend_every_seconds):
+            try:
+                self._extend(ack_id)
+            except Exception as e:
+                logger.warning(f"Could not extend the ack deadline of work unit {unit_id}: {e}")
+
+    def _release(self, unit: Dict) -> str:
+        """Stops extending a unit's lease and returns its ack ID."""
+        released, keeper = self._leases.pop(unit['unit_id'])
+        released.set()
+        # An extension already in flight must not land after the ack or nack.
+        keeper.join()
+        return self._ack_ids.pop(unit['unit_id'])
+
+    def enqueue(self, units: List[Dict]) -> int:
+        futures = [
+            self.publisher.publish(self.topic_path, json.dumps(unit).encode('utf-8'), unit_id=unit['unit_id'])
+            for unit in units
+        ]
+        for future in futures:
+            future.result()
+        return len(futures)
+
+    def _pull_one(self) -> list:
+        from google.api_core import exceptions as gcp_exceptions
+        try:
+            response = self.subscriber.pull(
+                request={"subscription": self.subscription_path, "max_messages": 1}, timeout=30
+            )
+        except gcp_exceptions.DeadlineExceeded:
+            # An idle subscription can time out instead of returning no messages.
+            return []
+        return list(response.received_messages)
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        for _ in range(self.empty_pulls):
+            received_messages = self._pull_one()
+            if received_messages:
+                break
+        else:
+            return None
+        received = received_messages[0]
+        unit = json.loads(received.message.data.decode('utf-8'))
+        # The subscription's own deadline may be shorter than the renewal interval.
+        self._extend(received.ack_id)
+        released = threading.Event()
+        keeper = threading.Thread(target=self._keep_leased, args=(unit['unit_id'], received.ack_id, released),
+                                  name=f"lease-{unit['unit_id']}", daemon=True)
+        keeper.start()
+        self._ack_ids[unit['unit_id']] = received.ack_id
+        self._leases[unit['unit_id']] = (released, keeper)
+        return unit
+
+    def complete(self, unit: Dict, records_published: int) -> None:
+        ack_id = self._release(unit)
+        self.subscriber.acknowledge(request={"subscription": self.subscription_path, "ack_ids": [ack_id]})
+
+    def fail(self, unit: Dict, error: str) -> None:
+        ack_id = self._release(unit)
+        # An ack deadline of 0 makes the unit immediately available for redelivery.
+        self.subscriber.modify_ack_deadline(
+            request={"subscription": self.subscription_path, "ack_ids": [ack_id], "ack_deadline_seconds": 0}
+        )
+
+
+def get_work_queue(spec: str):
+    """
+    Builds a work queue from a spec string:
+      sqlite:<path>                    e.g. sqlite:/tmp/work.db
+      pubsub:<topic>/<subscription>    in the project from GCP_PROJECT_ID
+    """
+    kind, _, target = spec.partition(':')
+    if kind == 'sqlite' and target:
+        return SQLiteWorkQueue(target)
+    if kind == 'pubsub' and '/' in target:
+        topic_id, subscription_id = target.split('/', 1)
+        return PubSubWorkQueue(os.environ.get("GCP_PROJECT_ID"), topic_id, subscription_id)
+    raise ValueError(f"Unsupported work queue spec '{spec}'. Use 'sqlite:<path>' or 'pubsub:<topic>/<subscription>'.")
+
+# --- Workers ---
+
+def run_worker(queue, worker_id: Optional[str] = None, max_units: Optional[int] = None) -> Dict:
+    """Claims and runs units until the queue is empty (or max_units have been run)."""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    completed, failed, records = 0, 0, 0
+    while max_units is None or completed + failed < max_units:
+        unit = queue.claim(worker_id)
+        if unit is None:
+            break
+        try:
+            published = run_work_unit(unit)
+        except Exception as e:
+            logger.error(f"[{worker_id}] Work unit {unit['unit_id']} failed: {e}", exc_info=True)
+            queue.fail(unit, str(e))
+            failed += 1
+            continue
+        queue.complete(unit, published)
+        completed += 1
+        records += published
+    logger.info(f"[{worker_id}] Worker finished. Completed {completed} unit(s), failed {failed}, published {records} records.")
+    return {'worker_id': worker_id, 'completed': completed, 'failed': failed, 'records_published': records}
+
+def run_static_shard(units: List[Dict], task_index: int, task_count: int) -> Dict:
+    """Runs this task's share of the plan directly, without a queue (e.g. a Cloud Run job task)."""
+    shard = shard_units(units, task_index, task_count)
+    logger.info(f"Task {task_index}/{task_count} running {len(shard)} of {len(units)} work unit(s).")
+    completed, failed, records = 0, 0, 0
+    for unit in shard:
+        try:
+            records += run_work_unit(unit)
+            completed += 1
+        except Exception as e:
+            logger.error(f"Work unit {unit['unit_id']} failed: {e}", exc_info=True)
+            failed += 1
+    return {'task_index': task_index, 'task_count': task_count, 'completed': completed, 'failed': failed, 'records_published': records}
+
+# --- CLI ---
+
+def _parse_endpoints(value: str) -> List[str]:
+    if value == 'all':
+        return sorted(ODATA_ENDPOINTS.keys())
+    endpoints = [name.strip() for name in value.split(',') if name.strip()]
+    invalid = [name for name in endpoints if name not in ODATA_ENDPOINTS]
+    if invalid:
+        raise argparse.ArgumentTypeError(f"Unknown endpoints: {invalid}")
+    return endpoints
+
+def _parse_end_date(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=CHICAGO_TZ)
+
+def _parse_sites(value: Optional[str]) -> Optional[List[str]]:
+    if value:
+        return [site.strip() for site in value.split(',') if site.strip()]
+    if multi_site_configured():
+        return [site['site_id'] for site in get_sites()]
+    return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sharded POS sync coordinator.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_plan_arguments(sub):
+        sub.add_argument('--endpoints', type=_parse_endpoints, default=_parse_endpoints('all'),
+                         help="'all' or a comma-separated list of endpoints.")
+        sub.add_argument('--days-back', type=int, default=int(os.environ.get('DEFAULT_DAYS_BACK', '7')))
+        sub.add_argument('--sites', help="Comma-separated site IDs. Defaults to the configured site(s).")
+        sub.add_argument('--chunk-days', type=int, default=DEFAULT_CHUNK_DAYS)
+        sub.add_argument('--end-date', type=_parse_end_date,
+                         help="Newest date (YYYY-MM-DD) of the window. Pin it so every shard plans identically.")
+
+    plan = subparsers.add_parser('plan', help="Split a sync into work units and enqueue them.")
+    add_plan_arguments(plan)
+    plan.add_argument('--queue', required=True)
+
+    work = subparsers.add_parser('work', help="Claim and run units from a queue until it is empty.")
+    work.add_argument('--queue', required=True)
+    work.add_argument('--worker-id')
+    work.add_argument('--max-units', type=int)
+
+    shard = subparsers.add_parser('shard', help="Run a static shard of the plan (batch job task).")
+    add_plan_arguments(shard)
+    # Cloud Run jobs expose the task index and count through these variables.
+    shard.add_argument('--task-index', type=int, default=int(os.environ.get('CLOUD_RUN_TASK_INDEX', '0')))
+    shard.add_argument('--task-count', type=int, default=int(os.environ.get('CLOUD_RUN_TASK_COUNT', '1')))
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'plan':
+        units = plan_work_units(args.endpoints, args.days_back, _parse_sites(args.sites), args.chunk_days, args.end_date)
+        added = get_work_queue(args.queue).enqueue(units)
+        result = {'planned_units': len(units), 'enqueued': added}
+    elif args.command == 'work':
+        result = run_worker(get_work_queue(args.queue), args.worker_id, args.max_units)
+    else:
+        units = plan_work_units(args.endpoints, args.days_back, _parse_sites(args.sites), args.chunk_days, args.end_date)
+        result = run_static_shard(units, args.task_index, args.task_count)
+
+    print(json.dumps(result))
+    return 1 if result.get('failed') else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Resumable page cursors for the POS Poller.
+
+Each (endpoint, business_date, site) unit of a sync run stores the $skip of
+its next page and the last Id it published, updated after every published
+page. A failed unit keeps its cursor, so resuming the run fetches only the
+pages that were not published yet.
+"""
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pos_poller.store import state_db, ensure_tables
+from pos_poller.poller import CHICAGO_TZ
+
+logger = logging.getLogger(__name__)
+
+# Units for endpoints without a date field are stored with an empty date.
+UNDATED = ""
+
+CURSORS_DDL = """
+CREATE TABLE IF NOT EXISTS page_cursors (
+    run_id TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    business_date TEXT NOT NULL,
+    site_id TEXT NOT NULL,
+    next_skip INTEGER NOT NULL DEFAULT 0,
+    last_id TEXT,
+    records_published INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (run_id, endpoint, business_date, site_id)
+);
+"""
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+def parse_date_key(date_key: str) -> Optional[datetime]:
+    """Turns a stored business_date key back into a target date (None for an undated unit)."""
+    if date_key == UNDATED:
+        return None
+    return datetime.strptime(date_key, '%Y-%m-%d').replace(tzinfo=CHICAGO_TZ)
+
+class PageCursors:
+    """The page cursors of one sync run (a /sync call, an async job or a work unit)."""
+
+    def __init__(self, run_id: str):
+        ensure_tables(CURSORS_DDL)
+        self.run_id = run_id
+
+    def _key(self, endpoint: str, date_key: str, site_id: Optional[str]) -> tuple:
+        return (self.run_id, endpoint, date_key, site_id or '')
+
+    def start(self, endpoint: str, date_key: str, site_id: Optional[str]) -> dict:
+        """Returns the unit's cursor ({'status', 'next_skip', 'records_published'}), creating it if new."""
+        key = self._key(endpoint, date_key, site_id)
+        with state_db() as conn:
+            row = conn.execute(
+                "SELECT status, next_skip, records_published FROM page_cursors "
+                "WHERE run_id = ? AND endpoint = ? AND business_date = ? AND site_id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO page_cursors (run_id, endpoint, business_date, site_id, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'running', ?)",
+                    (*key, _now()),
+                )
+                return {'status': 'running', 'next_skip': 0, 'records_published': 0}
+            if row['status'] != 'done':
+                conn.execute(
+                    "UPDATE page_cursors SET status = 'running', error = NULL, updated_at = ? "
+                    "WHERE run_id = ? AND endpoint = ? AND business_date = ? AND site_id = ?",
+                    (_now(), *key),
+                )
+        return dict(row)
+
+    def advance(self, endpoint: str, date_key: str, site_id: Optional[str],
+                next_skip: int, last_id, records_published: int) -> None:
+        """Moves the cursor past a page that has been published."""
+        with state_db() as conn:
+            conn.execute(
+                "UPDATE page_cursors SET next_skip = ?, last_id = ?, records_published = ?, updated_at = ? "
+                "WHERE run_id = ? AND endpoint = ? AND business_date = ? AND site_id = ?",
+                (next_skip, None if last_id is None else str(last_id), records_published, _now(),
+                 *self._key(endpoint, date_key, site_id)),
+            )
+
+    def _finish(self, endpoint: str, date_key: str, site_id: Optional[str], status: str, error: Optional[str]) -> None:
+        with state_db() as conn:
+            conn.execute(
+                "UPDATE page_cursors SET status = ?, error = ?, updated_at = ? "
+                "WHERE run_id = ? AND endpoint = ? AND business_date = ? AND site_id = ?",
+                (status, error, _now(), *self._key(endpoint, date_key, site_id)),
+            )
+
+    def complete(self, endpoint: str, date_key: str, site_id: Optional[str]) -> None:
+        self._finish(endpoint, date_key, site_id, 'done', None)
+
+    def fail(self, endpoint: str, date_key: str, site_id: Optional[str], error: str) -> None:
+        self._finish(endpoint, date_key, site_id, 'failed', error)
+
+    def defer(self, endpoint: str, date_key: str, site_id: Optional[str]) -> None:
+        """Leaves the unit for a resume because a sync deadline ran out, creating its cursor if it never started."""
+        self.start(endpoint, date_key, site_id)
+        self._finish(endpoint, date_key, site_id, 'deferred', None)
+
+    def failed_units(self) -> List[dict]:
+        """Returns the units that did not finish, with the cursor they will resume from."""
+        with state_db() as conn:
+            rows = conn.execute(
+                "SELECT endpoint, business_date, site_id, next_skip, last_id, records_published, error "
+                "FROM page_cursors WHERE run_id = ? AND status != 'done' ORDER BY endpoint, business_date DESC",
+                (self.run_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def exists(self) -> bool:
+        with state_db() as conn:
+            return conn.execute("SELECT 1 FROM page_cursors WHERE run_id = ? LIMIT 1", (self.run_id,)).fetchone() is not None
+
+    def discard(self) -> None:
+        """Drops every cursor of the run once it no longer needs to be resumed."""
+        with state_db() as conn:
+            conn.execute("DELETE FROM page_cursors WHERE run_id = ?", (self.run_id,))
@@ -0,0 +1,195 @@
+"""
+Client-side concurrency governor for the upstream OData API.
+
+Every request to the API goes through ApiGovernor.send(). For each API host it
+keeps an AIMD concurrency limit: each successful response raises the limit by
+1/limit (roughly +1 per round trip at full concurrency). A throttling response
+(429 or 503) or a response slower than the latency target multiplies it by the
+decrease factor. A Retry-After header pauses every request to that host until
+the given time, and one token bucket shared across hosts and endpoints caps
+the overall request rate.
+
+Configuration (environment):
+    API_RATE_LIMIT               shared requests per second (unset: no rate cap)
+    API_INITIAL_CONCURRENCY      starting per-host limit (default 4)
+    API_MAX_CONCURRENCY          ceiling of the per-host limit (default 16)
+    API_LATENCY_TARGET_SECONDS   responses slower than this count as overload (unset: off)
+    API_MAX_THROTTLE_RETRIES     retries of a throttled request (default 5)
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from pos_common.metrics import REGISTRY
+from pos_common.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUS_CODES = (429, 503)
+DEFAULT_RETRY_AFTER_SECONDS = 1.0
+MAX_RETRY_AFTER_SECONDS = 120.0
+
+CONCURRENCY_LIMIT = REGISTRY.gauge("pos_poller_api_concurrency_limit", "Current AIMD concurrency limit per API host.", ["host"])
+IN_FLIGHT = REGISTRY.gauge("pos_poller_api_in_flight", "API requests currently in flight per host.", ["host"])
+THROTTLED = REGISTRY.counter("pos_poller_api_throttled_total", "Throttling responses (429/503) received per host.", ["host"])
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds to wait."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+class AimdLimiter:
+    """An additive-increase / multiplicative-decrease concurrency limit with a blocking acquire."""
+
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 16,
+                 decrease_factor: float = 0.5, on_change: Optional[Callable[[float, int], None]] = None):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._on_change = on_change
+        self._condition = threading.Condition()
+
+    def _changed(self) -> None:
+        if self._on_change:
+            self._on_change(self.limit, self.in_flight)
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self._changed()
+
+    def release(self, overloaded: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._changed()
+            self._condition.notify_all()
+
+
+class ApiGovernor:
+    """Applies the per-host AIMD limit, Retry-After pauses and the shared token bucket to API requests."""
+
+    def __init__(
+        self,
+        rate_limit: Optional[float] = None,
+        initial_concurrency: int = 4,
+        max_concurrency: int = 16,
+        latency_target: Optional[float] = None,
+        max_throttle_retries: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.bucket = TokenBucket(rate_limit, clock=clock, sleep=sleep) if rate_limit else None
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.max_throttle_retries = max_throttle_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._limiters: Dict[str, AimdLimiter] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, host: str) -> AimdLimiter:
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                def report(limit: float, in_flight: int) -> None:
+                    CONCURRENCY_LIMIT.set(limit, host=host)
+                    IN_FLIGHT.set(in_flight, host=host)
+                limiter = self._limiters[host] = AimdLimiter(
+                    self.initial_concurrency, max_limit=self.max_concurrency, on_change=report
+                )
+                CONCURRENCY_LIMIT.set(limiter.limit, host=host)
+            return limiter
+
+    def _pause(self, host: str, seconds: float) -> None:
+        with self._lock:
+            until = self._clock() + min(seconds, MAX_RETRY_AFTER_SECONDS)
+            self._paused_until[host] = max(until, self._paused_until.get(host, 0.0))
+
+    def _wait_for_pause(self, host: str) -> None:
+        while True:
+            with self._lock:
+                remaining = self._paused_until.get(host, 0.0) - self._clock()
+            if remaining <= 0:
+                return
+            self._sleep(remaining)
+
+    def send(self, session: requests.Session, prepared: requests.PreparedRequest, timeout: float) -> requests.Response:
+        """Sends a prepared request under the governor, retrying throttled responses after their Retry-After."""
+        host = urlsplit(prepared.url).netloc
+        limiter = self.limiter(host)
+        attempt = 0
+        while True:
+            self._wait_for_pause(host)
+            if self.bucket:
+                self.bucket.acquire()
+            limiter.acquire()
+            start = self._clock()
+            overloaded = True
+            try:
+                response = session.send(prepared, timeout=timeout)
+                latency = self._clock() - start
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                overloaded = throttled or (self.latency_target is not None and latency > self.latency_target)
+            finally:
+                limiter.release(overloaded)
+
+            if not throttled:
+                return response
+            THROTTLED.inc(host=host)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER_SECONDS * (2 ** attempt)
+            if attempt >= self.max_throttle_retries:
+                logger.error(f"Giving up on {prepared.url} after {attempt + 1} throttled attempts.")
+                return response
+            logger.warning(f"API host {host} throttled the request ({response.status_code}); "
+                           f"retrying in {retry_after:.1f}s with concurrency limit {limiter.limit:.1f}.")
+            self._pause(host, retry_after)
+            attempt += 1
+
+
+def _optional_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+@lru_cache(maxsize=1)
+def get_api_governor() -> ApiGovernor:
+    """Returns the process-wide governor shared by every endpoint and sync job."""
+    return ApiGovernor(
+        rate_limit=_optional_float("API_RATE_LIMIT"),
+        initial_concurrency=int(os.environ.get("API_INITIAL_CONCURRENCY", "4")),
+        max_concurrency=int(os.environ.get("API_MAX_CONCURRENCY", "16")),
+        latency_target=_optional_float("API_LATENCY_TARGET_SECONDS"),
+        max_throttle_retries=int(os.environ.get("API_MAX_THROTTLE_RETRIES", "5")),
+    )
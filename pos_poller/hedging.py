@@ -0,0 +1,174 @@
+"""
+Hedged OData requests for the POS Poller.
+
+Page latency is long-tailed: most pages return in under a second, but a few
+take tens of seconds. With hedging on, a request that has not answered after
+the API_HEDGE_PERCENTILE latency of its endpoint's recent requests gets a
+duplicate. Whichever attempt answers first is used. A loser that has not
+started yet is cancelled. An in-flight loser cannot be interrupted inside
+requests, so its response is discarded and its connection released when it
+arrives.
+
+Hedges go through the governor like any request, so they count against the
+concurrency limit and rate limit. They are also capped by a budget: each
+request earns API_HEDGE_MAX_RATIO of a hedge, up to a small burst. This keeps
+hedges to about that fraction of traffic even when the upstream is slow
+across the board.
+
+Configuration (environment):
+    API_HEDGING                   enable hedged requests (default false)
+    API_HEDGE_PERCENTILE          latency percentile that triggers a hedge (default 0.95)
+    API_HEDGE_MAX_RATIO           hedges per request, at most (default 0.05)
+    API_HEDGE_MIN_DELAY_SECONDS   never hedge sooner than this (default 0.5)
+    API_HEDGE_MIN_SAMPLES         latencies an endpoint needs before it is hedged (default 20)
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+from pos_common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LATENCY_WINDOW = 200
+HEDGE_BURST = 10.0
+
+HEDGES = REGISTRY.counter("pos_poller_api_hedges_total", "Hedged request outcomes: sent, won, lost or suppressed by the budget.", ["endpoint", "outcome"])
+HEDGE_DELAY = REGISTRY.gauge("pos_poller_api_hedge_delay_seconds", "Latency after which a request to the endpoint is hedged.", ["endpoint"])
+
+
+def hedging_enabled() -> bool:
+    return os.environ.get("API_HEDGING", "false").lower() == "true"
+
+
+class LatencyTracker:
+    """Recent request latencies per endpoint and the hedge delay they imply."""
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 20, min_delay: float = 0.5,
+                 window: int = LATENCY_WINDOW):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None while the endpoint has too few samples."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(endpoint, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        delay = max(self.min_delay, latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))])
+        HEDGE_DELAY.set(delay, endpoint=endpoint)
+        return delay
+
+
+class HedgeBudget:
+    """Each request earns ratio of a hedge token, up to burst; a hedge spends one."""
+
+    def __init__(self, ratio: float = 0.05, burst: float = HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class Hedger:
+    """Runs a request, and a duplicate of it once it is slower than the endpoint's usual tail."""
+
+    def __init__(self, tracker: Optional[LatencyTracker] = None, budget: Optional[HedgeBudget] = None,
+                 max_workers: int = 32, clock: Callable[[], float] = time.monotonic):
+        self.tracker = tracker or LatencyTracker()
+        self.budget = budget or HedgeBudget()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-hedge")
+        self._clock = clock
+
+    def _attempt(self, endpoint: str, send: Callable[[], T], discard: Callable[[T], None]) -> Future:
+        started = self._clock()
+        future = self._executor.submit(send)
+
+        def done(completed: Future) -> None:
+            if not completed.cancelled() and completed.exception() is None:
+                self.tracker.record(endpoint, self._clock() - started)
+                if getattr(completed, "lost", False):
+                    discard(completed.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def run(self, endpoint: str, send: Callable[[], T], discard: Callable[[T], None] = lambda result: None) -> T:
+        """
+        Returns the result of the first attempt of send() to succeed. discard
+        releases the result of an attempt that lost, for example by closing
+        its response.
+        """
+        self.budget.on_request()
+        delay = self.tracker.hedge_delay(endpoint)
+        primary = self._attempt(endpoint, send, discard)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self.budget.try_spend():
+            HEDGES.inc(endpoint=endpoint, outcome="suppressed")
+            return primary.result()
+
+        logger.info(f"Hedging a {endpoint} request after {delay:.2f}s.")
+        HEDGES.inc(endpoint=endpoint, outcome="sent")
+        hedge = self._attempt(endpoint, send, discard)
+        attempts = [primary, hedge]
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in attempts if future in done and future.exception() is None), None)
+            if winner is not None:
+                for loser in attempts:
+                    if loser is not winner:
+                        loser.lost = True
+                        # Not started yet: never sent. Already finished: release it now.
+                        if not loser.cancel() and loser.done() and loser.exception() is None:
+                            discard(loser.result())
+                HEDGES.inc(endpoint=endpoint, outcome="won" if winner is hedge else "lost")
+                return winner.result()
+        # Both attempts failed; report the original request's error.
+        return primary.result()
+
+
+@lru_cache(maxsize=1)
+def get_hedger() -> Hedger:
+    """Returns the process-wide hedger."""
+    from pos_poller.governor import get_api_governor
+    return Hedger(
+        LatencyTracker(
+            percentile=float(os.environ.get("API_HEDGE_PERCENTILE", "0.95")),
+            min_samples=int(os.environ.get("API_HEDGE_MIN_SAMPLES", "20")),
+            min_delay=float(os.environ.get("API_HEDGE_MIN_DELAY_SECONDS", "0.5")),
+        ),
+        HedgeBudget(ratio=float(os.environ.get("API_HEDGE_MAX_RATIO", "0.05"))),
+        # A primary and a hedge for every request the governor can have in flight.
+        max_workers=2 * get_api_governor().max_concurrency + 2,
+    )
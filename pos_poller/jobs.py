@@ -0,0 +1,342 @@
+"""
+Asynchronous sync jobs for the POS Poller service.
+
+A job is planned up front as a set of (endpoint, date) units that are persisted
+in the local state database. A background executor works through the pending
+units, so a job interrupted by a restart resumes where it stopped instead of
+starting the whole window again. Page cursors keyed by the job ID let a failed
+unit continue from its last published page.
+
+A job is owned by the process that created or resumed it. The owner holds a
+lease that it renews while the job is queued or running. Another instance can
+resume the job only after the lease has expired, and it claims the job with a
+single conditional UPDATE, so two instances never run the same units.
+
+Configuration (environment):
+    SYNC_JOB_WORKERS         jobs run concurrently by this instance (default 1)
+    SYNC_JOB_LEASE_SECONDS   how long a job stays owned without a renewal (default 120)
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from pos_poller.config import ODATA_ENDPOINTS
+from pos_poller.poller import TRACER, sync_endpoint, _get_date_range_for_sync
+from pos_poller.store import state_db, ensure_tables
+from pos_poller.cursors import PageCursors, UNDATED, parse_date_key
+
+logger = logging.getLogger(__name__)
+
+JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    run_started_at TEXT,
+    finished_at TEXT,
+    elapsed_seconds REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    lease_expires_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_job_units (
+    job_id TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    business_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    records_published INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (job_id, endpoint, business_date)
+);
+"""
+
+# Columns added after the first release; older state databases get them on open.
+LEASE_COLUMNS = {"owner": "TEXT", "lease_expires_at": "TEXT"}
+
+# Identifies this process as the owner of the jobs it claims.
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class JobLeaseHeldError(RuntimeError):
+    """Raised when a job is resumed while another instance still holds its lease."""
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _lease_seconds() -> float:
+    return float(os.environ.get("SYNC_JOB_LEASE_SECONDS", "120"))
+
+def _lease_expiry() -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=_lease_seconds())).isoformat()
+
+def _ensure_job_tables() -> None:
+    ensure_tables(JOBS_DDL)
+    with state_db() as conn:
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(sync_jobs)")}
+        for column, column_type in LEASE_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE sync_jobs ADD COLUMN {column} {column_type}")
+
+# --- Job Leases ---
+
+_lease_keeper: Optional[threading.Thread] = None
+_lease_keeper_lock = threading.Lock()
+
+def renew_leases() -> int:
+    """Extends the lease of every queued or running job this process owns. Returns how many."""
+    with state_db() as conn:
+        return conn.execute(
+            "UPDATE sync_jobs SET lease_expires_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+            (_lease_expiry(), OWNER_ID),
+        ).rowcount
+
+def _keep_leases() -> None:
+    while True:
+        time.sleep(_lease_seconds() / 3)
+        try:
+            renew_leases()
+        except Exception as e:
+            logger.error(f"Failed to renew sync job leases: {e}", exc_info=True)
+
+def _start_lease_keeper() -> None:
+    """Starts the daemon thread that renews this process's job leases, once."""
+    global _lease_keeper
+    with _lease_keeper_lock:
+        if _lease_keeper is None:
+            _lease_keeper = threading.Thread(target=_keep_leases, name="sync-job-lease", daemon=True)
+            _lease_keeper.start()
+
+def _claim_job(conn, job_id: str) -> bool:
+    """
+    Takes ownership of a job unless another instance holds a live lease on it.
+    The status and lease are checked in the same UPDATE, so only one claimant wins.
+    """
+    claimed = conn.execute(
+        "UPDATE sync_jobs SET status = 'queued', finished_at = NULL, owner = ?, lease_expires_at = ? "
+        "WHERE job_id = ? AND (status NOT IN ('queued', 'running') OR owner IS NULL "
+        "OR lease_expires_at IS NULL OR lease_expires_at < ?)",
+        (OWNER_ID, _lease_expiry(), job_id, _now()),
+    ).rowcount
+    return claimed == 1
+
+@lru_cache(maxsize=1)
+def get_job_executor() -> ThreadPoolExecutor:
+    """Returns the cached background executor that runs sync jobs."""
+    max_workers = int(os.environ.get("SYNC_JOB_WORKERS", "1"))
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync-job")
+
+def _date_key(target_date: Optional[datetime]) -> str:
+    return target_date.strftime('%Y-%m-%d') if target_date else UNDATED
+
+def create_job(endpoints: List[str], days_back: int) -> str:
+    """Plans the (endpoint, date) units of a sync and persists them as a queued job owned by this process."""
+    _ensure_job_tables()
+    job_id = uuid.uuid4().hex
+    request_json = json.dumps({'endpoints': endpoints, 'days_back': days_back})
+    with state_db() as conn:
+        conn.execute(
+            "INSERT INTO sync_jobs (job_id, status, request, created_at, owner, lease_expires_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, request_json, _now(), OWNER_ID, _lease_expiry()),
+        )
+        for endpoint in endpoints:
+            for target_date in _get_date_range_for_sync(ODATA_ENDPOINTS[endpoint], days_back):
+                conn.execute(
+                    "INSERT OR IGNORE INTO sync_job_units (job_id, endpoint, business_date, status) VALUES (?, ?, ?, 'pending')",
+                    (job_id, endpoint, _date_key(target_date)),
+                )
+    _start_lease_keeper()
+    logger.info(f"Created sync job {job_id} for endpoints {endpoints} with days_back={days_back}")
+    return job_id
+
+def _set_job_status(job_id: str, status: str, **fields) -> None:
+    assignments = ", ".join(["status = ?"] + [f"{name} = ?" for name in fields])
+    with state_db() as conn:
+        conn.execute(f"UPDATE sync_jobs SET {assignments} WHERE job_id = ?", (status, *fields.values(), job_id))
+
+def _set_units_status(job_id: str, endpoint: str, date_keys: List[str], status: str) -> None:
+    with state_db() as conn:
+        conn.executemany(
+            "UPDATE sync_job_units SET status = ?, updated_at = ? WHERE job_id = ? AND endpoint = ? AND business_date = ?",
+            [(status, _now(), job_id, endpoint, date_key) for date_key in date_keys],
+        )
+
+def _pending_units(job_id: str) -> Dict[str, List[str]]:
+    """Returns the dates still to be synced, grouped by endpoint, newest date first."""
+    with state_db() as conn:
+        rows = conn.execute(
+            "SELECT endpoint, business_date FROM sync_job_units WHERE job_id = ? AND status != 'done' "
+            "ORDER BY endpoint, business_date DESC",
+            (job_id,),
+        ).fetchall()
+    pending: Dict[str, List[str]] = {}
+    for row in rows:
+        pending.setdefault(row['endpoint'], []).append(row['business_date'])
+    return pending
+
+def run_job(job_id: str) -> None:
+    """Works through every unfinished unit of a job. Runs on the background executor."""
+    started = datetime.now(timezone.utc)
+    with state_db() as conn:
+        job = conn.execute("SELECT started_at, elapsed_seconds FROM sync_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if job is None:
+        logger.error(f"Sync job {job_id} not found; nothing to run.")
+        return
+    _set_job_status(
+        job_id, 'running', started_at=job['started_at'] or started.isoformat(), run_started_at=started.isoformat()
+    )
+    logger.info(f"[job {job_id}] Running sync job.")
+
+    failed_endpoints = []
+    cursors = PageCursors(job_id)
+    with TRACER.span("sync", run_id=job_id):
+        for endpoint, date_keys in _pending_units(job_id).items():
+            def record_progress(target_date: Optional[datetime], records: int, endpoint=endpoint) -> None:
+                with state_db() as conn:
+                    conn.execute(
+                        "UPDATE sync_job_units SET status = 'done', records_published = ?, updated_at = ? "
+                        "WHERE job_id = ? AND endpoint = ? AND business_date = ?",
+                        (records, _now(), job_id, endpoint, _date_key(target_date)),
+                    )
+
+            _set_units_status(job_id, endpoint, date_keys, 'running')
+            report = {}
+            try:
+                sync_endpoint(
+                    endpoint,
+                    days_back=0,
+                    target_dates=[parse_date_key(date_key) for date_key in date_keys],
+                    progress_callback=record_progress,
+                    report=report,
+                    cursors=cursors,
+                )
+            except Exception as e:
+                logger.error(f"[job {job_id}] Sync failed for endpoint '{endpoint}': {e}", exc_info=True)
+                report.setdefault('failed_units', []).append({'endpoint': endpoint, 'error': str(e)})
+            if report.get('failed_units'):
+                failed_endpoints.append(endpoint)
+                # Dates that never reported progress failed part-way; resume_job re-queues them.
+                with state_db() as conn:
+                    conn.execute(
+                        "UPDATE sync_job_units SET status = 'error', updated_at = ? WHERE job_id = ? AND endpoint = ? AND status = 'running'",
+                        (_now(), job_id, endpoint),
+                    )
+
+    elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+    status = 'completed' if not failed_endpoints else 'completed_with_errors'
+    if not failed_endpoints:
+        cursors.discard()
+    with state_db() as conn:
+        conn.execute(
+            "UPDATE sync_jobs SET status = ?, finished_at = ?, elapsed_seconds = elapsed_seconds + ?, error = ?, "
+            "owner = NULL, lease_expires_at = NULL WHERE job_id = ?",
+            (status, _now(), elapsed, json.dumps(failed_endpoints) if failed_endpoints else None, job_id),
+        )
+    logger.info(f"[job {job_id}] Sync job finished with status '{status}' after {elapsed:.1f}s.")
+
+def submit_job(job_id: str) -> None:
+    """Schedules a job on the background executor."""
+    get_job_executor().submit(run_job, job_id)
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Returns the status, per-endpoint/per-date progress and throughput of a job."""
+    _ensure_job_tables()
+    with state_db() as conn:
+        job = conn.execute("SELECT * FROM sync_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        units = conn.execute(
+            "SELECT endpoint, business_date, status, records_published FROM sync_job_units WHERE job_id = ? "
+            "ORDER BY endpoint, business_date DESC",
+            (job_id,),
+        ).fetchall()
+
+    endpoints: Dict[str, dict] = {}
+    total_records = 0
+    completed_units = 0
+    for unit in units:
+        summary = endpoints.setdefault(unit['endpoint'], {'records_published': 0, 'completed_units': 0, 'dates': {}})
+        summary['dates'][unit['business_date'] or 'all'] = {
+            'status': unit['status'],
+            'records_published': unit['records_published'],
+        }
+        summary['records_published'] += unit['records_published']
+        total_records += unit['records_published']
+        if unit['status'] == 'done':
+            summary['completed_units'] += 1
+            completed_units += 1
+    for summary in endpoints.values():
+        summary['total_units'] = len(summary['dates'])
+
+    elapsed = job['elapsed_seconds']
+    if job['status'] == 'running' and job['run_started_at']:
+        # elapsed_seconds only accumulates when a run finishes; add the current run.
+        run_started = datetime.fromisoformat(job['run_started_at'])
+        elapsed += (datetime.now(timezone.utc) - run_started).total_seconds()
+
+    return {
+        'job_id': job_id,
+        'status': job['status'],
+        'request': json.loads(job['request']),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'failed_endpoints': json.loads(job['error']) if job['error'] else [],
+        'progress': {'completed_units': completed_units, 'total_units': len(units)},
+        'records_published': total_records,
+        'elapsed_seconds': round(elapsed, 3),
+        'records_per_second': round(total_records / elapsed, 2) if elapsed > 0 else 0.0,
+        'endpoints': endpoints,
+    }
+
+def resume_job(job_id: str) -> bool:
+    """
+    Claims a job and re-queues its unfinished units. Returns False if the job
+    does not exist; raises JobLeaseHeldError if another instance still holds it.
+    """
+    _ensure_job_tables()
+    with state_db() as conn:
+        job = conn.execute("SELECT status FROM sync_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if job is None:
+            return False
+        if not _claim_job(conn, job_id):
+            raise JobLeaseHeldError(f"Sync job '{job_id}' is still owned by a live instance.")
+        # Only the claimant gets here, so no other instance is running these units.
+        conn.execute(
+            "UPDATE sync_job_units SET status = 'pending' WHERE job_id = ? AND status IN ('running', 'error')",
+            (job_id,),
+        )
+    _start_lease_keeper()
+    submit_job(job_id)
+    logger.info(f"Resumed sync job {job_id}.")
+    return True
+
+def resume_incomplete_jobs() -> List[str]:
+    """Re-submits queued or running jobs whose owner's lease has expired (e.g. after a restart)."""
+    _ensure_job_tables()
+    with state_db() as conn:
+        rows = conn.execute(
+            "SELECT job_id FROM sync_jobs WHERE status IN ('queued', 'running') "
+            "AND (owner IS NULL OR lease_expires_at IS NULL OR lease_expires_at < ?)",
+            (_now(),),
+        ).fetchall()
+    job_ids = []
+    for row in rows:
+        try:
+            resume_job(row['job_id'])
+        except JobLeaseHeldError:
+            # Another instance claimed it between the query and the claim.
+            continue
+        job_ids.append(row['job_id'])
+    if job_ids:
+        logger.info(f"Resumed {len(job_ids)} incomplete sync job(s) from the state store: {job_ids}")
+    return job_ids
@@ -6,16 +6,33 @@ import os
 import json
 import logging
 from datetime import datetime, timezone
+
+from pos_common.startup import StartupTracker, install_readiness
+STARTUP = StartupTracker("pos-poller")
+
 from flask import Flask, request, jsonify, Response
 
 # Import the core logic from our new poller module
-from pos_poller.poller import sync_endpoint
+from pos_poller import poller
+from pos_poller.poller import sync_endpoint, get_publisher_client, get_api_credentials, drop_expanded_children
 from pos_poller.config import ODATA_ENDPOINTS
+from pos_poller.jobs import create_job, submit_job, get_job, resume_job, resume_incomplete_jobs, JobLeaseHeldError
+from pos_common.metrics import REGISTRY, CONTENT_TYPE
+from pos_common.profiling import install_profiling, profile_call, store_profile
+from pos_poller.store import get_state_db
+from pos_poller.outbox import outbox_enabled
+from pos_poller.cursors import PageCursors, new_run_id, parse_date_key
+from pos_poller.sites import multi_site_configured, get_sites, get_site, run_multi_site_sync
+from pos_poller.scheduler import Deadline, run_scheduled_sync, default_deadline_seconds
+STARTUP.checkpoint("imports")
 
 # Initialize Flask app and logging
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+install_profiling(app)
+install_readiness(app, STARTUP)
+ENDPOINT_SYNCS = REGISTRY.counter("pos_poller_endpoint_syncs_total", "Endpoint syncs run, by outcome.", ["endpoint", "status"])
 # --- Configuration Validation on Startup ---
 # This will run once when the container starts to validate and log configuration.
 logger.info("--- VALIDATING CONFIGURATION ON STARTUP ---")
@@ -41,6 +58,16 @@ if all_vars_found:
     logger.info("--- CONFIGURATION VALIDATION SUCCESSFUL ---")
 else:
     logger.critical("--- CONFIGURATION VALIDATION FAILED: Missing one or more required environment variables. ---")
+STARTUP.checkpoint("validate_config")
+
+# --- Resume Interrupted Sync Jobs ---
+# Jobs left queued or running by an instance whose lease has expired continue from their persisted units.
+if os.environ.get("RESUME_SYNC_JOBS_ON_STARTUP", "true").lower() == "true":
+    try:
+        resume_incomplete_jobs()
+    except Exception as e:
+        logger.error(f"Failed to resume incomplete sync jobs: {e}", exc_info=True)
+STARTUP.checkpoint("resume_jobs")
 
 @app.route('/', methods=['GET'])
 def health_check() -> Response:
@@ -51,6 +78,11 @@ def health_check() -> Response:
         'timestamp': datetime.now(timezone.utc).isoformat()
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics() -> Response:
+    """Exposes the in-process metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 def _parse_and_validate_sync_request(request_data: dict) -> tuple[int, list, Response | None]:
     """
     Parses and validates the sync request payload.
@@ -90,10 +122,12 @@ def _parse_and_validate_sync_request(request_data: dict) -> tuple[int, list, Res
         logger.error(f"Invalid 'endpoints' format received: {type(endpoints_req)}")
         error_response = jsonify({'error': 'endpoints must be "all" or a list of strings'}), 400
         return 0, [], error_response
-    
-    return days_back, endpoints_to_sync, None
 
-def _build_sync_summary(results: dict, endpoints_to_sync: list, errors: list) -> tuple[dict, int]:
+    # With EXPAND_CHILD_ENTITIES, child endpoints ride along with their parent's pages.
+    return days_back, drop_expanded_children(endpoints_to_sync), None
+
+def _build_sync_summary(results: dict, endpoints_to_sync: list, errors: list,
+                        run_id: str | None = None, retry: list | None = None) -> tuple[dict, int]:
     """Builds the final summary response for the sync operation."""
     status_code = 200 if not errors else 207
     summary = {
@@ -106,32 +140,127 @@ def _build_sync_summary(results: dict, endpoints_to_sync: list, errors: list) ->
         },
         'completed_at': datetime.now(timezone.utc).isoformat()
     }
+    if retry:
+        # Units whose remaining pages were not published; POST /sync/resume with the run_id continues them.
+        summary['run_id'] = run_id
+        summary['retry'] = retry
     logger.info(f"Sync process finished. Summary: {json.dumps(summary)}")
     return summary, status_code
 
-def _execute_sync_for_endpoints(endpoints_to_sync: list, days_back: int) -> tuple[dict, list]:
-    """Iterates through endpoints, triggers sync, and collects results."""
+def _should_profile_endpoint(profile_req, endpoint: str) -> bool:
+    """The 'profile' payload field is either a boolean or a list of endpoint names."""
+    if isinstance(profile_req, list):
+        return endpoint in profile_req
+    return profile_req is True
+
+def _sync_one_endpoint(endpoint: str, results: dict, errors: list, retry: list,
+                       profile: bool = False, result_key: str | None = None, **sync_kwargs) -> None:
+    """
+    Runs sync_endpoint for one endpoint and records its result (under result_key,
+    default the endpoint name), failed units and metrics.
+    """
+    result_key = result_key or endpoint
+    try:
+        profile_id = None
+        report = {}
+        if profile:
+            record_count, collapsed = profile_call(sync_endpoint, endpoint, report=report, **sync_kwargs)
+            profile_id = store_profile(collapsed, prefix=endpoint)
+        else:
+            record_count = sync_endpoint(endpoint, report=report, **sync_kwargs)
+        # --- ADDED: Log the successful sync for this endpoint ---
+        logger.info(
+            f"Successfully processed endpoint '{endpoint}'. Published {record_count} records."
+        )
+        failed_units = report.get('failed_units', [])
+        status = 'success' if not failed_units else 'incomplete'
+        results[result_key] = {'status': status, 'records_published': record_count}
+        if failed_units:
+            results[result_key]['failed_units'] = len(failed_units)
+            retry.extend(failed_units)
+            errors.append(result_key)
+        if report.get('compression'):
+            # Per table: raw and encoded bytes and the raw/encoded compression_ratio.
+            results[result_key]['compression'] = report['compression']
+        if profile_id:
+            # Fetch with GET /debug/profile/results/<profile_id>
+            results[result_key]['profile_id'] = profile_id
+        ENDPOINT_SYNCS.inc(endpoint=endpoint, status=status)
+    except Exception as e:
+        logger.error(f"Sync failed for endpoint '{endpoint}': {e}", exc_info=True)
+        results[result_key] = {'status': 'error', 'message': str(e)}
+        errors.append(result_key)
+        ENDPOINT_SYNCS.inc(endpoint=endpoint, status='error')
+
+def _execute_sync_for_endpoints(endpoints_to_sync: list, days_back: int, profile_req=False,
+                                cursors: PageCursors | None = None,
+                                deadline: Deadline | None = None) -> tuple[dict, list, list]:
+    """
+    Runs the (endpoint, date) units in cost-aware order (pos_poller/scheduler.py)
+    and collects results and the units to retry, including those deferred by the
+    deadline. Profiled endpoints run whole, so each yields a single profile.
+    """
     results = {}
     errors = []
-    for endpoint in endpoints_to_sync:
-        try:
-            record_count = sync_endpoint(endpoint, days_back)
-            # --- ADDED: Log the successful sync for this endpoint ---
-            logger.info(
-                f"Successfully processed endpoint '{endpoint}'. Published {record_count} records."
-            )
-            results[endpoint] = {'status': 'success', 'records_published': record_count}
-        except Exception as e:
-            logger.error(f"Sync failed for endpoint '{endpoint}': {e}", exc_info=True)
-            results[endpoint] = {'status': 'error', 'message': str(e)}
-            errors.append(endpoint)
-    return results, errors
+    retry = []
+    profiled = [endpoint for endpoint in endpoints_to_sync if _should_profile_endpoint(profile_req, endpoint)]
+    for endpoint in profiled:
+        _sync_one_endpoint(endpoint, results, errors, retry, profile=True, days_back=days_back, cursors=cursors)
+
+    scheduled = [endpoint for endpoint in endpoints_to_sync if endpoint not in profiled]
+    if scheduled:
+        outcome = run_scheduled_sync(scheduled, days_back, cursors, deadline)
+        for endpoint, result in outcome['results'].items():
+            results[endpoint] = result
+            if result['status'] != 'success':
+                errors.append(endpoint)
+            ENDPOINT_SYNCS.inc(endpoint=endpoint, status=result['status'])
+        retry.extend(outcome['failed_units'])
+        retry.extend(outcome['deferred_units'])
+    return results, errors, retry
+
+def _execute_multi_site_sync(endpoints_to_sync: list, days_back: int, sites: list, cursors: PageCursors,
+                             deadline: Deadline | None = None) -> tuple[dict, list, list, dict]:
+    """Syncs every selected site on the shared scheduler; returns per-endpoint totals plus per-site results."""
+    site_results = run_multi_site_sync(sites, endpoints_to_sync, days_back, cursors, deadline=deadline)
+    results = {endpoint: {'status': 'success', 'records_published': 0} for endpoint in endpoints_to_sync}
+    retry = []
+    for name, site_result in site_results.items():
+        for endpoint, endpoint_result in site_result['endpoints'].items():
+            results[endpoint]['records_published'] += endpoint_result['records_published']
+            if endpoint_result.get('compression'):
+                poller.merge_compression_stats(results[endpoint].setdefault('compression', {}),
+                                               endpoint_result['compression'])
+            if 'error' in endpoint_result:
+                results[endpoint]['status'] = 'error'
+        for unit in site_result['failed_units']:
+            if results[unit['endpoint']]['status'] == 'success':
+                results[unit['endpoint']]['status'] = 'incomplete'
+        retry.extend(site_result['failed_units'])
+        site_result['failed_units'] = len(site_result['failed_units'])
+    errors = [endpoint for endpoint, result in results.items() if result['status'] != 'success']
+    for endpoint, result in results.items():
+        ENDPOINT_SYNCS.inc(endpoint=endpoint, status=result['status'])
+    return results, errors, retry, site_results
+
+def _select_sites(requested) -> tuple[list, Response | None]:
+    """Resolves the optional 'sites' payload field (a list of site names) against the configured sites."""
+    sites = get_sites()
+    if requested is None or requested == 'all':
+        return sites, None
+    if not isinstance(requested, list):
+        return [], (jsonify({'error': 'sites must be "all" or a list of site names'}), 400)
+    unknown = sorted(set(requested) - {site['name'] for site in sites})
+    if unknown:
+        return [], (jsonify({'error': f"Unknown sites: {unknown}"}), 400)
+    return [site for site in sites if site['name'] in requested], None
 
 @app.route('/sync', methods=['POST'])
 def sync() -> Response:
     """
     Main sync endpoint. Accepts a JSON payload to trigger a sync for
-    specific endpoints and a given number of days.
+    specific endpoints and a given number of days. With "async": true the
+    sync runs as a background job and a 202 with the job ID is returned.
     """
     try:
         request_data = request.get_json(silent=True) or {}
@@ -147,15 +276,129 @@ def sync() -> Response:
 
         logger.info(f"Validated endpoints to sync: {endpoints_to_sync}")
 
-        results, errors = _execute_sync_for_endpoints(endpoints_to_sync, days_back)
+        if request_data.get('async') is True:
+            if multi_site_configured():
+                return jsonify({'error': 'Async jobs sync a single site; use the coordinator for multi-site backfills.'}), 400
+            # A job runs in the background until it is done, and profiling reports inline.
+            if 'deadline_seconds' in request_data or request_data.get('profile'):
+                return jsonify({'error': 'deadline_seconds and profile apply to synchronous syncs only.'}), 400
+            job_id = create_job(endpoints_to_sync, days_back)
+            submit_job(job_id)
+            return jsonify({
+                'status': 'accepted',
+                'job_id': job_id,
+                'status_url': f"/sync/{job_id}"
+            }), 202
 
-        summary, status_code = _build_sync_summary(results, endpoints_to_sync, errors)
+        deadline_seconds = request_data.get('deadline_seconds', default_deadline_seconds())
+        if deadline_seconds is not None and (isinstance(deadline_seconds, bool) or not isinstance(deadline_seconds, (int, float))
+                                         or deadline_seconds <= 0):
+            return jsonify({'error': 'deadline_seconds must be a positive number'}), 400
+
+        if multi_site_configured() and request_data.get('profile'):
+            return jsonify({'error': 'profile is not supported with multiple sites; profile a single-site sync.'}), 400
+
+        cursors = PageCursors(new_run_id())
+        site_results = None
+        deadline = Deadline(deadline_seconds) if deadline_seconds else None
+        if multi_site_configured():
+            sites, error_response = _select_sites(request_data.get('sites'))
+            if error_response:
+                return error_response
+            with poller.TRACER.span("sync", run_id=cursors.run_id, days_back=days_back):
+                results, errors, retry, site_results = _execute_multi_site_sync(
+                    endpoints_to_sync, days_back, sites, cursors, deadline
+                )
+        else:
+            with poller.TRACER.span("sync", run_id=cursors.run_id, days_back=days_back):
+                results, errors, retry = _execute_sync_for_endpoints(
+                    endpoints_to_sync, days_back, request_data.get('profile', False), cursors, deadline,
+                )
+        if not retry:
+            cursors.discard()
+
+        summary, status_code = _build_sync_summary(results, endpoints_to_sync, errors, cursors.run_id, retry)
+        if site_results is not None:
+            summary['sites'] = site_results
+        if deadline_seconds:
+            summary['deadline'] = {
+                'seconds': deadline_seconds,
+                'deferred_units': sum(1 for unit in retry if unit.get('error') == poller.DEADLINE_DEFERRED),
+            }
         return jsonify(summary), status_code
 
     except Exception as e:
         logger.error("A critical error occurred in the sync endpoint.", exc_info=True)
         return jsonify({'error': 'An unexpected server error occurred.', 'message': str(e)}), 500
 
+@app.route('/sync/resume', methods=['POST'])
+def resume_sync() -> Response:
+    """
+    Continues the failed units of a synchronous /sync run from their page
+    cursors. Expects {"run_id": "..."} from the 'retry' section of the summary.
+    """
+    try:
+        request_data = request.get_json(silent=True) or {}
+        run_id = request_data.get('run_id')
+        if not isinstance(run_id, str) or not run_id:
+            return jsonify({'error': 'run_id is required'}), 400
+        cursors = PageCursors(run_id)
+        if not cursors.exists():
+            return jsonify({'error': f"Sync run '{run_id}' not found or already completed."}), 404
+
+        # Group the failed units by (endpoint, site) so each group is one sync_endpoint call.
+        groups: dict = {}
+        for unit in cursors.failed_units():
+            groups.setdefault((unit['endpoint'], unit['site_id'] or None), []).append(parse_date_key(unit['business_date']))
+        logger.info(f"Resuming sync run {run_id}: {len(groups)} endpoint/site group(s).")
+
+        results, errors, retry = {}, [], []
+        for (endpoint, site_id), target_dates in groups.items():
+            site = get_site(site_id) if multi_site_configured() else None
+            _sync_one_endpoint(endpoint, results, errors, retry, days_back=0, target_dates=target_dates,
+                               site_id=site_id, cursors=cursors, access_token=site['access_token'] if site else None,
+                               result_key=f"{endpoint}@{site['name']}" if site else None)
+        if not retry:
+            cursors.discard()
+
+        summary, status_code = _build_sync_summary(results, sorted(results), errors, run_id, retry)
+        return jsonify(summary), status_code
+    except Exception as e:
+        logger.error("A critical error occurred while resuming a sync run.", exc_info=True)
+        return jsonify({'error': 'An unexpected server error occurred.', 'message': str(e)}), 500
+
+@app.route('/sync/<job_id>', methods=['GET'])
+def get_sync_job(job_id: str) -> Response:
+    """Reports the per-endpoint, per-date progress and throughput of an asynchronous sync job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Sync job '{job_id}' not found."}), 404
+    return jsonify(job), 200
+
+@app.route('/sync/<job_id>/resume', methods=['POST'])
+def resume_sync_job(job_id: str) -> Response:
+    """Re-queues the unfinished units of an interrupted or failed sync job."""
+    try:
+        if not resume_job(job_id):
+            return jsonify({'error': f"Sync job '{job_id}' not found."}), 404
+    except JobLeaseHeldError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'status': 'accepted', 'job_id': job_id, 'status_url': f"/sync/{job_id}"}), 202
+
+# --- Warm-up ---
+# Creates the Pub/Sub client and prefetches the API credentials from Secret Manager
+# so the first scheduled /sync does not pay for them.
+STARTUP.add_warmup_step("publisher_client", get_publisher_client)
+STARTUP.add_warmup_step("api_credentials", get_api_credentials)
+STARTUP.add_warmup_step("state_db", get_state_db)
+if outbox_enabled():
+    # Resumes publishing whatever an earlier process left in the outbox.
+    STARTUP.add_warmup_step("publish_outbox", poller.get_outbox_drainer)
+if poller.PUBLISH_ENCODING == "binary":
+    STARTUP.add_warmup_step("row_codecs", poller.get_row_codecs)
+STARTUP.checkpoint("app_setup")
+STARTUP.start()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     is_debug = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
@@ -0,0 +1,324 @@
+"""
+Durable publish outbox for the POS Poller.
+
+With PUBLISH_OUTBOX=true, publish_records does not wait on Pub/Sub. Each page's
+encoded messages are appended to the publish_outbox table of the poller's
+SQLite state database in one transaction, and the next page is fetched
+straight away. Fetching then runs at the API's pace, however slow Pub/Sub is.
+
+A unit (endpoint, site, date) still finishes only once Pub/Sub has confirmed
+its messages. At the end of the date the sync waits, up to
+OUTBOX_CONFIRM_SECONDS, for the drainer to publish them. Only then do the page
+cursors advance and the change signature get saved. The default
+POLLER_STATE_DB is under /tmp, which is in memory on Cloud Run. An outbox there
+is lost with the instance, and the drainer gets no CPU once the request has
+responded. Waiting inside the request means /sync never reports records that
+only the outbox holds. A unit whose messages are not confirmed in time fails
+and resumes from its first unconfirmed page.
+
+A drainer thread publishes from the outbox in id order, OUTBOX_DRAIN_BATCH
+messages at a time, through the batching PublisherClient. A message is deleted
+once Pub/Sub confirms it. The outbox itself is the drainer's offset: after a
+restart it resumes from the lowest id still stored. A crash between publish
+and delete re-publishes that batch, so delivery is at least once, as it is for
+Pub/Sub itself.
+
+Messages that fail stay in the outbox and the batch is retried with backoff
+(PUBLISH_RETRY_INITIAL_SECONDS, doubled up to PUBLISH_RETRY_MAX_SECONDS). After
+OUTBOX_MAX_ATTEMPTS failures, a message moves to the publish dead-letter file so
+one bad message cannot hold up the rest. Appends block while
+OUTBOX_MAX_PENDING messages are waiting, which bounds disk use during a long
+outage.
+
+Configuration (environment):
+    PUBLISH_OUTBOX          publish through the outbox (default false)
+    OUTBOX_DRAIN_BATCH      messages per drain batch (default 500)
+    OUTBOX_MAX_ATTEMPTS     publish attempts before a message is dead-lettered (default 100)
+    OUTBOX_MAX_PENDING      messages the outbox holds before appends block (default 1000000)
+    OUTBOX_CONFIRM_SECONDS  how long a unit waits for its messages to be published (default 300)
+
+Inspect or drain the outbox by hand:
+    python -m pos_poller.outbox status
+    python -m pos_poller.outbox drain
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pos_common.metrics import REGISTRY
+from pos_poller.store import state_db, ensure_tables
+from pos_poller.publisher import (
+    PUBLISH_DEAD_LETTER_PATH, PUBLISH_RETRY_INITIAL_SECONDS, PUBLISH_RETRY_MAX_SECONDS, write_dead_letter,
+)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_DRAIN_BATCH = int(os.environ.get("OUTBOX_DRAIN_BATCH", "500"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "100"))
+OUTBOX_MAX_PENDING = int(os.environ.get("OUTBOX_MAX_PENDING", "1000000"))
+OUTBOX_CONFIRM_SECONDS = float(os.environ.get("OUTBOX_CONFIRM_SECONDS", "300"))
+# Dead-lettered ids remembered so waiting units learn their messages were not published.
+DEAD_LETTERED_IDS_KEPT = 100_000
+
+OUTBOX_APPENDED = REGISTRY.counter("pos_poller_outbox_appended_total", "Messages appended to the publish outbox.", ["table"])
+OUTBOX_PENDING = REGISTRY.gauge("pos_poller_outbox_pending_messages", "Messages waiting in the publish outbox.")
+OUTBOX_FAILURES = REGISTRY.counter("pos_poller_outbox_publish_failures_total", "Failed publishes of outbox messages.", ["table"])
+MESSAGES_PUBLISHED = REGISTRY.counter("pos_poller_messages_published_total", "Messages published to Pub/Sub.", ["table"])
+
+OUTBOX_DDL = """
+CREATE TABLE IF NOT EXISTS publish_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_path TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    attributes TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+"""
+
+# (topic_path, table_name, data, attributes)
+OutboxMessage = Tuple[str, str, bytes, Dict[str, str]]
+# The first and last outbox id of one append.
+OutboxRange = Tuple[int, int]
+
+
+def outbox_enabled() -> bool:
+    return os.environ.get("PUBLISH_OUTBOX", "false").lower() == "true"
+
+
+class Outbox:
+    """The publish_outbox table, with a running count of its rows."""
+
+    def __init__(self):
+        ensure_tables(OUTBOX_DDL)
+        with state_db() as conn:
+            self._count = conn.execute("SELECT COUNT(*) FROM publish_outbox").fetchone()[0]
+        self._count_lock = threading.Lock()
+        OUTBOX_PENDING.set(self._count)
+
+    def _adjust(self, delta: int) -> None:
+        with self._count_lock:
+            self._count += delta
+            OUTBOX_PENDING.set(self._count)
+
+    def append(self, messages: Iterable[OutboxMessage]) -> Optional[OutboxRange]:
+        """Stores messages in one transaction and returns their (first id, last id), or None if there were none."""
+        created_at = datetime.now(timezone.utc).isoformat()
+        rows = [(topic_path, table, data, json.dumps(attributes), created_at)
+                for topic_path, table, data, attributes in messages]
+        if not rows:
+            return None
+        with state_db() as conn:
+            conn.executemany(
+                "INSERT INTO publish_outbox (topic_path, table_name, data, attributes, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            # The state database lock is held for the whole transaction, so the ids are consecutive.
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        self._adjust(len(rows))
+        for table in {row[1] for row in rows}:
+            OUTBOX_APPENDED.inc(sum(1 for row in rows if row[1] == table), table=table)
+        return last_id - len(rows) + 1, last_id
+
+    def pending(self) -> int:
+        return self._count
+
+    def holds_any(self, ranges: List[OutboxRange]) -> bool:
+        """Whether any message of the given id ranges is still waiting."""
+        with state_db() as conn:
+            return any(conn.execute("SELECT 1 FROM publish_outbox WHERE id BETWEEN ? AND ? LIMIT 1", id_range).fetchone()
+                       for id_range in ranges)
+
+    def read_batch(self, limit: int) -> List[dict]:
+        with state_db() as conn:
+            rows = conn.execute(
+                "SELECT id, topic_path, table_name, data, attributes, attempts FROM publish_outbox ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [{**dict(row), 'attributes': json.loads(row['attributes'])} for row in rows]
+
+    def remove(self, ids: List[int]) -> None:
+        with state_db() as conn:
+            removed = conn.executemany("DELETE FROM publish_outbox WHERE id = ?", [(message_id,) for message_id in ids]).rowcount
+        self._adjust(-max(removed, 0))
+
+    def record_failures(self, ids: List[int]) -> None:
+        with state_db() as conn:
+            conn.executemany("UPDATE publish_outbox SET attempts = attempts + 1 WHERE id = ?",
+                             [(message_id,) for message_id in ids])
+
+
+class OutboxDrainer:
+    """Publishes outbox messages on a background thread and deletes them once Pub/Sub confirms them."""
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        client_factory: Callable[[], Any],
+        batch_size: int = OUTBOX_DRAIN_BATCH,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        max_pending: int = OUTBOX_MAX_PENDING,
+        initial_backoff: float = PUBLISH_RETRY_INITIAL_SECONDS,
+        max_backoff: float = PUBLISH_RETRY_MAX_SECONDS,
+        dead_letter_path: str = PUBLISH_DEAD_LETTER_PATH,
+        idle_seconds: float = 1.0,
+    ):
+        self.outbox = outbox
+        # The client is looked up on every batch so it is created lazily and can be replaced in tests.
+        self._client_factory = client_factory
+        self.batch_size = batch_size
+        self.max_attempts = max(1, max_attempts)
+        self.max_pending = max_pending
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.dead_letter_path = dead_letter_path
+        self.idle_seconds = idle_seconds
+        self._backoff = initial_backoff
+        self._wake = threading.Event()
+        self._drained = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._dead_lettered: Set[int] = set()
+
+    def enqueue(self, messages: List[OutboxMessage]) -> Optional[OutboxRange]:
+        """Appends messages, wakes the drainer and returns their id range. Blocks while the outbox is full."""
+        with self._drained:
+            while self.max_pending and self.outbox.pending() >= self.max_pending:
+                logger.warning(f"Publish outbox holds {self.max_pending} messages; waiting for the drainer.")
+                self._wake.set()
+                self._drained.wait(self.idle_seconds)
+        id_range = self.outbox.append(messages)
+        self._wake.set()
+        return id_range
+
+    def wait_published(self, ranges: List[OutboxRange], timeout: float = OUTBOX_CONFIRM_SECONDS) -> bool:
+        """
+        Waits until Pub/Sub has confirmed every message of the id ranges.
+        Returns False if one was dead-lettered or the timeout ran out first.
+        """
+        deadline = time.monotonic() + timeout
+        with self._drained:
+            while True:
+                if any(first <= message_id <= last for message_id in self._dead_lettered for first, last in ranges):
+                    return False
+                if not self.outbox.holds_any(ranges):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._wake.set()
+                self._drained.wait(min(remaining, self.idle_seconds))
+
+    def drain_once(self) -> Dict[str, int]:
+        """Publishes one batch. Returns the counts of published, failed and dead-lettered messages."""
+        batch = self.outbox.read_batch(self.batch_size)
+        result = {"published": 0, "failed": 0, "dead_lettered": 0}
+        if not batch:
+            return result
+        client = self._client_factory()
+        futures = []
+        for message in batch:
+            try:
+                futures.append((message, client.publish(message['topic_path'], message['data'], **message['attributes'])))
+            except Exception as e:
+                futures.append((message, e))
+        published, failed = [], []
+        for message, future in futures:
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                future.result()
+                published.append(message)
+            except Exception as e:
+                failed.append((message, e))
+
+        self.outbox.remove([message['id'] for message in published])
+        for message in published:
+            MESSAGES_PUBLISHED.inc(table=message['table_name'])
+        given_up = [(message, error) for message, error in failed if message['attempts'] + 1 >= self.max_attempts]
+        for message, error in given_up:
+            logger.error(f"Giving up on outbox message {message['id']} ({message['table_name']}) after "
+                         f"{message['attempts'] + 1} attempts: {error}")
+            write_dead_letter(self.dead_letter_path, message['topic_path'], message['table_name'], message['data'],
+                              message['attributes'], message['attempts'] + 1, error)
+        given_up_ids = {message['id'] for message, _ in given_up}
+        with self._drained:
+            self._dead_lettered |= given_up_ids
+            if len(self._dead_lettered) > DEAD_LETTERED_IDS_KEPT:
+                self._dead_lettered = set(sorted(self._dead_lettered)[-DEAD_LETTERED_IDS_KEPT // 2:])
+        self.outbox.remove(sorted(given_up_ids))
+        self.outbox.record_failures([message['id'] for message, _ in failed if message['id'] not in given_up_ids])
+        for message, _ in failed:
+            OUTBOX_FAILURES.inc(table=message['table_name'])
+
+        result.update(published=len(published), failed=len(failed) - len(given_up), dead_lettered=len(given_up))
+        with self._drained:
+            self._drained.notify_all()
+        return result
+
+    def drain(self, sleep: Callable[[float], None] = time.sleep) -> Dict[str, int]:
+        """Drains batches until the outbox is empty, backing off after failures."""
+        totals = {"published": 0, "failed": 0, "dead_lettered": 0}
+        while not self._stop_event.is_set():
+            result = self.drain_once()
+            for key, value in result.items():
+                totals[key] += value
+            if result["failed"]:
+                logger.warning(f"{result['failed']} outbox message(s) failed to publish; retrying in {self._backoff:.1f}s.")
+                sleep(self._backoff)
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+                continue
+            self._backoff = self.initial_backoff
+            if not any(result.values()):
+                break
+        return totals
+
+    def start(self) -> None:
+        """Drains on a daemon thread, resuming from whatever an earlier process left in the outbox."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    self.drain(sleep=self._stop_event.wait)
+                except Exception:
+                    logger.error("The publish outbox drainer failed; retrying.", exc_info=True)
+                self._wake.wait(self.idle_seconds)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name="publish-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect or drain the poller's publish outbox.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="Print the number of messages waiting.")
+    subparsers.add_parser("drain", help="Publish every waiting message, then exit.")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print(json.dumps({"pending": Outbox().pending()}))
+        return 0
+    from pos_poller.poller import get_publisher_client
+    drainer = OutboxDrainer(Outbox(), lambda: get_publisher_client())
+    result = drainer.drain()
+    print(json.dumps({**result, "pending": drainer.outbox.pending()}))
+    return 1 if result["dead_lettered"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -3,28 +3,46 @@ import json
 import logging
 import hashlib
 import re
+import time
+import uuid
+import threading
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable, TYPE_CHECKING
 
-from google.cloud import pubsub_v1, secretmanager
 import requests
 from requests.adapters import HTTPAdapter, Retry
-from pos_poller.config import ODATA_ENDPOINTS, NUMERIC_FIELDS, STRING_FIELDS
+from pos_poller.config import ODATA_ENDPOINTS, NUMERIC_FIELDS, STRING_FIELDS, EXPANDED_CHILDREN
 from pos_poller.utils import parse_microsoft_date, to_snake_case
+from pos_poller.governor import get_api_governor
+from pos_poller.hedging import get_hedger, hedging_enabled
+from pos_poller.publisher import StreamingPublisher, PublishTracker, DeadLetteredError, publisher_client_options
+from pos_poller.outbox import Outbox, OutboxDrainer, OUTBOX_CONFIRM_SECONDS, outbox_enabled
+from pos_poller import probes
+from pos_common.metrics import REGISTRY
+from pos_common import tracing
+from pos_common.compression import compress, resolve_codec
+from pos_common.rowcodec import get_row_codecs
 
 from functools import lru_cache
+
+if TYPE_CHECKING:
+    from google.cloud import pubsub_v1, secretmanager
+    from pos_poller.cursors import PageCursors
 logger = logging.getLogger(__name__)
 
 # --- Constants & Global Clients ---
 API_PAGE_SIZE = 1000
 API_TIMEOUT_SECONDS = 60
 MAX_RETRIES = 3
+# The error recorded for a unit whose remaining pages were deferred by a sync deadline.
+DEADLINE_DEFERRED = "deferred: sync deadline reached"
 BACKOFF_FACTOR = 1
 
 http_session = requests.Session()
-retries = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=[500, 502, 503, 504])
-http_session.mount('https://', HTTPAdapter(max_retries=retries))
+# 429 and 503 are left to the governor, which honors Retry-After and backs off concurrency.
+retries = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=[500, 502, 504])
+http_session.mount('https://', HTTPAdapter(max_retries=retries, pool_maxsize=get_api_governor().max_concurrency))
 
 # --- Configuration ---
 PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
@@ -32,19 +50,68 @@ TOPIC_ID = os.environ.get("TOPIC_ID")
 API_BASE_URL = os.environ.get("API_BASE_URL")
 
 IS_LOCAL_ENVIRONMENT = os.environ.get("PUBSUB_EMULATOR_HOST") is not None
+CHICAGO_TZ = ZoneInfo("America/Chicago")
+# Message body codec: identity (default), gzip or zstd. See pos_common/compression.py.
+PUBLISH_COMPRESSION = resolve_codec(os.environ.get("PUBLISH_COMPRESSION"))
+# Message body format: json (default) or binary, the schema-derived row encoding in pos_common/rowcodec.py.
+PUBLISH_ENCODING = os.environ.get("PUBLISH_ENCODING", "json").lower()
+# Fetch the child collections in EXPANDED_CHILDREN with their parent page instead of in separate passes.
+EXPAND_CHILD_ENTITIES = os.environ.get("EXPAND_CHILD_ENTITIES", "false").lower() == "true"
+
+# Sync, endpoint, date and page spans; see pos_common/tracing.py.
+TRACER = tracing.Tracer("pos-poller")
+
+# --- Metrics ---
+PAGES_FETCHED = REGISTRY.counter("pos_poller_pages_fetched_total", "OData pages fetched.", ["endpoint"])
+PAGE_BYTES = REGISTRY.counter("pos_poller_page_bytes_total", "Response bytes received from the OData API.", ["endpoint"])
+FETCH_LATENCY = REGISTRY.histogram("pos_poller_fetch_latency_seconds", "OData page fetch latency.", ["endpoint"])
+RECORDS_TRANSFORMED = REGISTRY.counter("pos_poller_records_transformed_total", "Records transformed for publishing.", ["table"])
+MESSAGES_PUBLISHED = REGISTRY.counter("pos_poller_messages_published_total", "Messages published to Pub/Sub.", ["table"])
+PUBLISH_BYTES = REGISTRY.counter("pos_poller_publish_bytes_total", "Message bytes published to Pub/Sub.", ["table"])
+PUBLISH_RAW_BYTES = REGISTRY.counter("pos_poller_publish_raw_bytes_total", "Message bytes before compression.", ["table"])
+PUBLISH_LATENCY = REGISTRY.histogram("pos_poller_publish_latency_seconds", "Time to publish and confirm one page of records.", ["table"])
 
 # --- Core Functions ---
 
 @lru_cache(maxsize=1)
-def get_publisher_client() -> pubsub_v1.PublisherClient:
+def get_publisher_client() -> "pubsub_v1.PublisherClient":
     """Returns a cached instance of the Pub/Sub PublisherClient."""
-    return pubsub_v1.PublisherClient()
+    # The google.cloud clients are imported on first use so they load during warm-up.
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient(**publisher_client_options())
+
+@lru_cache(maxsize=1)
+def get_streaming_publisher() -> StreamingPublisher:
+    """Returns the shared publisher that retries and dead-letters individual messages."""
+    # The client is looked up on every send so it is created lazily and can be replaced in tests.
+    return StreamingPublisher(lambda: get_publisher_client())
+
+@lru_cache(maxsize=1)
+def get_outbox_drainer() -> OutboxDrainer:
+    """Returns the running drainer of the durable publish outbox (PUBLISH_OUTBOX=true)."""
+    drainer = OutboxDrainer(Outbox(), lambda: get_publisher_client())
+    drainer.start()
+    return drainer
 
 @lru_cache(maxsize=1)
-def get_secret_manager_client() -> secretmanager.SecretManagerServiceClient:
+def get_secret_manager_client() -> "secretmanager.SecretManagerServiceClient":
     """Returns a cached instance of the SecretManagerServiceClient."""
+    from google.cloud import secretmanager
     return secretmanager.SecretManagerServiceClient()
 
+def get_secret(secret_id: Optional[str], version: str = "latest") -> Optional[str]:
+    """Reads a secret from Secret Manager, returning None if it is unset or cannot be read."""
+    if not secret_id:
+        return None
+    secret_client = get_secret_manager_client()
+    try:
+        name = f"projects/{PROJECT_ID}/secrets/{secret_id}/versions/{version}"
+        response = secret_client.access_secret_version(request={"name": name})
+        return response.payload.data.decode("UTF-8")
+    except Exception as e:
+        logger.error(f"Failed to access secret '{secret_id}': {e}")
+        return None
+
 @lru_cache(maxsize=1)
 def get_api_credentials() -> Tuple[Optional[str], Optional[str]]:
     """
@@ -58,19 +125,6 @@ def get_api_credentials() -> Tuple[Optional[str], Optional[str]]:
         api_access_token = os.environ.get("API_ACCESS_TOKEN")
     else:
         logger.info("Running in CLOUD environment, fetching secrets from Secret Manager.")
-        
-        def get_secret(secret_id: str, version: str = "latest") -> Optional[str]:
-            if not secret_id:
-                return None
-            secret_client = get_secret_manager_client()
-            try:
-                name = f"projects/{PROJECT_ID}/secrets/{secret_id}/versions/{version}"
-                response = secret_client.access_secret_version(request={"name": name})
-                return response.payload.data.decode("UTF-8")
-            except Exception as e:
-                logger.error(f"Failed to access secret '{secret_id}': {e}")
-                return None
-
         site_id = get_secret(os.environ.get("SITE_ID_SECRET_ID"))
         api_access_token = get_secret(os.environ.get("API_ACCESS_TOKEN_SECRET_ID"))
 
@@ -151,12 +205,71 @@ def _create_pubsub_message_payload(record: dict, table_name: str, event_type: st
         'processed_at': datetime.now(timezone.utc).isoformat()
     }
 
-def publish_records(records: List[Dict[str, Any]], endpoint_name: str, sync_id: str):
-    publisher = get_publisher_client()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+# Raw and encoded byte totals per table for each running sync_endpoint call, keyed by
+# its stats key. sync_id has one-second resolution, so concurrent calls could share it.
+_compression_stats: Dict[str, Dict[str, Dict[str, int]]] = {}
+_compression_stats_lock = threading.Lock()
+
+def _record_compression_stats(stats_key: str, table_name: str, raw_bytes: int, encoded_bytes: int) -> None:
+    with _compression_stats_lock:
+        table_stats = _compression_stats.setdefault(stats_key, {}).setdefault(
+            table_name, {'raw_bytes': 0, 'encoded_bytes': 0}
+        )
+        table_stats['raw_bytes'] += raw_bytes
+        table_stats['encoded_bytes'] += encoded_bytes
+
+def pop_compression_stats(stats_key: str) -> Dict[str, Dict[str, Any]]:
+    """Returns and forgets the per-table byte totals of a sync, including the compression ratio."""
+    with _compression_stats_lock:
+        stats = _compression_stats.pop(stats_key, {})
+    return {
+        table_name: {
+            'codec': PUBLISH_COMPRESSION,
+            **table_stats,
+            'compression_ratio': round(table_stats['raw_bytes'] / table_stats['encoded_bytes'], 2)
+            if table_stats['encoded_bytes'] else None,
+        }
+        for table_name, table_stats in stats.items()
+    }
+
+def merge_compression_stats(into: dict, stats: dict) -> None:
+    """Adds the per-table byte totals of one report to another and recomputes the ratios."""
+    for table_name, table_stats in stats.items():
+        merged = into.setdefault(table_name, {'codec': table_stats['codec'], 'raw_bytes': 0, 'encoded_bytes': 0})
+        merged['raw_bytes'] += table_stats['raw_bytes']
+        merged['encoded_bytes'] += table_stats['encoded_bytes']
+        merged['compression_ratio'] = (round(merged['raw_bytes'] / merged['encoded_bytes'], 2)
+                                       if merged['encoded_bytes'] else None)
+
+def _encode_message(message_payload: dict) -> Tuple[bytes, Dict[str, str]]:
+    """Serializes a payload as JSON or, when configured, as a binary row. Returns (body, attributes)."""
+    if PUBLISH_ENCODING == "binary":
+        row_codecs = get_row_codecs()
+        if row_codecs.get(message_payload['table_name']) is not None:
+            return row_codecs.encode(message_payload)
+        logger.warning(f"No schema for table {message_payload['table_name']}; publishing JSON instead.")
+    return json.dumps(message_payload).encode('utf-8'), {}
+
+def publish_records(records: List[Dict[str, Any]], endpoint_name: str, sync_id: str, stats_key: Optional[str] = None):
+    """
+    Publishes one page of records and returns once every message is
+    confirmed. Raises DeadLetteredError if any message was written to the
+    local dead-letter file after its retries, so the caller fails the unit at
+    this page instead of advancing past it.
+    With PUBLISH_OUTBOX=true it returns once the page is stored in the
+    outbox, with the page's outbox id range; the caller confirms it with
+    get_outbox_drainer().wait_published before advancing past the page.
+    The page's byte totals are counted under stats_key (default: sync_id).
+    """
+    topic_path = get_publisher_client().topic_path(PROJECT_ID, TOPIC_ID)
     table_name = ODATA_ENDPOINTS[endpoint_name]['table_name']
     event_type = f"pos.{table_name.replace('pos_', '')}"
-    publish_futures = []
+    publisher = get_streaming_publisher()
+    tracker = PublishTracker()
+    outboxed = [] if outbox_enabled() else None
+    raw_bytes = 0
+    published_bytes = 0
+    start_time = time.perf_counter()
     for record in records:
         transformed_record = transform_odata_record(record, endpoint_name)
         message_payload = _create_pubsub_message_payload(
@@ -164,14 +277,38 @@ def publish_records(records: List[Dict[str, Any]], endpoint_name: str, sync_id:
         )
         # --- DEBUG: Log the exact payload being sent ---
         logger.info(f"PUBLISHING_PAYLOAD: {json.dumps(message_payload)}")
-        message_bytes = json.dumps(message_payload).encode('utf-8')
-        future = get_publisher_client().publish(topic_path, message_bytes)
-        publish_futures.append(future)
-    for future in publish_futures:
-        future.result()
-
-def fetch_odata_page(url: str, params: dict) -> List[Dict[str, Any]]:
-    _, api_access_token = get_api_credentials()
+        message_bytes, attributes = _encode_message(message_payload)
+        raw_bytes += len(message_bytes)
+        # The table name selects a trained zstd dictionary when one is configured.
+        message_bytes, compression_attributes = compress(message_bytes, PUBLISH_COMPRESSION, dict_name=table_name)
+        attributes.update(compression_attributes)
+        # Links the processor's spans for this record to the current page span.
+        tracing.inject(attributes)
+        published_bytes += len(message_bytes)
+        if outboxed is not None:
+            outboxed.append((topic_path, table_name, message_bytes, attributes))
+        else:
+            publisher.publish(topic_path, message_bytes, attributes, table_name, tracker)
+    RECORDS_TRANSFORMED.inc(len(records), table=table_name)
+    outbox_range = None
+    if outboxed is not None:
+        # The drainer counts messages as published once Pub/Sub confirms them.
+        outbox_range = get_outbox_drainer().enqueue(outboxed)
+    tracker.wait()
+    PUBLISH_LATENCY.observe(time.perf_counter() - start_time, table=table_name)
+    MESSAGES_PUBLISHED.inc(tracker.published, table=table_name)
+    PUBLISH_BYTES.inc(published_bytes, table=table_name)
+    PUBLISH_RAW_BYTES.inc(raw_bytes, table=table_name)
+    _record_compression_stats(stats_key or sync_id, table_name, raw_bytes, published_bytes)
+    if tracker.dead_lettered:
+        logger.error(f"{tracker.dead_lettered} of {len(records)} {table_name} messages were dead-lettered "
+                     f"to {publisher.dead_letter_path}; the page will be fetched again on resume.")
+        raise DeadLetteredError(f"{tracker.dead_lettered} of {len(records)} {table_name} messages could not be published")
+    return outbox_range
+
+def _odata_get(url: str, params: dict, access_token: Optional[str] = None) -> requests.Response:
+    """Sends one OData request through the governor. access_token overrides the configured credentials."""
+    api_access_token = access_token or get_api_credentials()[1]
     if not api_access_token:
         raise ValueError("API Access Token is not available to make requests.")
         
@@ -179,9 +316,59 @@ def fetch_odata_page(url: str, params: dict) -> List[Dict[str, Any]]:
     req = requests.Request('GET', url, params=params, headers=headers)
     prepared = http_session.prepare_request(req)
     logger.info(f"Requesting URL: {prepared.url}")
-    response = http_session.send(prepared, timeout=API_TIMEOUT_SECONDS)
+    endpoint_label = url.rstrip('/').rsplit('/', 1)[-1]
+    start_time = time.perf_counter()
+    if hedging_enabled():
+        response = get_hedger().run(
+            endpoint_label,
+            lambda: get_api_governor().send(http_session, prepared, timeout=API_TIMEOUT_SECONDS),
+            discard=lambda loser: loser.close(),
+        )
+    else:
+        response = get_api_governor().send(http_session, prepared, timeout=API_TIMEOUT_SECONDS)
+    FETCH_LATENCY.observe(time.perf_counter() - start_time, endpoint=endpoint_label)
     response.raise_for_status()
-    return response.json().get('d', [])
+    PAGES_FETCHED.inc(endpoint=endpoint_label)
+    PAGE_BYTES.inc(len(response.content), endpoint=endpoint_label)
+    return response
+
+def fetch_odata_page(url: str, params: dict, access_token: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Fetches one page. access_token overrides the configured credentials (multi-site syncs)."""
+    return _odata_get(url, params, access_token).json().get('d', [])
+
+def fetch_odata_probe(url: str, params: dict, endpoint_config: dict, access_token: Optional[str] = None) -> dict:
+    """Fetches a date's change signature (record count and latest modification); see pos_poller/probes.py."""
+    probe_params = probes.build_probe_params(params, endpoint_config)
+    return probes.parse_probe_response(_odata_get(url, probe_params, access_token).json(), endpoint_config)
+
+def expanded_children(endpoint_name: str) -> Dict[str, str]:
+    """The {child endpoint: navigation property} collections fetched with this endpoint's pages."""
+    return EXPANDED_CHILDREN.get(endpoint_name, {}) if EXPAND_CHILD_ENTITIES else {}
+
+def drop_expanded_children(endpoints: List[str]) -> List[str]:
+    """Removes the child endpoints whose parent is in the list and fetches them through $expand."""
+    covered = {child: parent for parent in endpoints for child in expanded_children(parent)}
+    if covered.keys() & set(endpoints):
+        logger.info(f"Fetching {sorted(covered.keys() & set(endpoints))} through $expand on their parent.")
+    return [endpoint for endpoint in endpoints if endpoint not in covered]
+
+def split_expanded_records(records: List[Dict[str, Any]], children: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Removes the expanded child collections from a page of parent records and
+    returns them per child endpoint. OData v2 wraps a collection as
+    {'results': [...]}; a navigation property left {'__deferred': ...} was not
+    expanded and is dropped by the transform as before.
+    """
+    child_records = {child: [] for child in children}
+    for record in records:
+        for child, navigation in children.items():
+            value = record.get(navigation)
+            if isinstance(value, dict) and '__deferred' not in value:
+                value = value.get('results', [])
+            if isinstance(value, list):
+                del record[navigation]
+                child_records[child].extend(value)
+    return child_records
 
 def _build_odata_params(endpoint_config: dict, site_id: str, target_date: Optional[datetime], skip: int) -> dict:
     """Builds the OData query parameters for a given request."""
@@ -202,6 +389,20 @@ def _build_odata_params(endpoint_config: dict, site_id: str, target_date: Option
         
     return params
 
+def _confirm_outboxed_pages(pages: Optional[List[dict]], cursors: Optional["PageCursors"],
+                            endpoint_name: str, date_key: str, site_id: str) -> Optional[dict]:
+    """
+    Waits for the outboxed pages in order and advances the cursor past each one
+    Pub/Sub confirms. Returns the first page that was not confirmed, or None.
+    """
+    deadline = time.monotonic() + OUTBOX_CONFIRM_SECONDS
+    for page in pages or []:
+        if page['ranges'] and not get_outbox_drainer().wait_published(page['ranges'], max(0.0, deadline - time.monotonic())):
+            return page
+        if cursors is not None:
+            cursors.advance(endpoint_name, date_key, site_id, page['next_skip'], page['last_id'], page['records_after'])
+    return None
+
 def _sync_for_single_date(
     url: str,
     endpoint_name: str,
@@ -209,32 +410,142 @@ def _sync_for_single_date(
     site_id: str,
     target_date: Optional[datetime],
     sync_id: str,
-) -> int:
-    """Handles the pagination loop to fetch and publish records for a single date."""
+    cursors: Optional["PageCursors"] = None,
+    access_token: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    probe: bool = False,
+    stats_key: Optional[str] = None,
+    counts: Optional[dict] = None,
+) -> Tuple[int, Optional[dict]]:
+    """
+    Handles the pagination loop to fetch and publish records for a single date.
+    Returns (records_published, failure). failure is None when every page was
+    published; otherwise it describes the unit and the $skip to resume from.
+    With cursors, the loop starts from the stored cursor and advances it after
+    every published page. should_stop is checked before each page after the
+    first; when it returns True the unit is deferred at its cursor. With probe,
+    a date whose change signature matches the last full sync is skipped, unless
+    the endpoint's children are fetched through $expand. If a counts dict is
+    given, its pages_fetched, probe_skipped and resumed totals are incremented.
+    """
+    counts = counts if counts is not None else {}
+    date_key = target_date.strftime('%Y-%m-%d') if target_date else ''
     if target_date:
-        logger.info(f"[{sync_id}] Processing date: {target_date.strftime('%Y-%m-%d')} (America/Chicago)")
+        logger.info(f"[{sync_id}] Processing date: {date_key} (America/Chicago)")
 
-    records_for_date = 0
     skip = 0
+    records_for_date = 0
+    if cursors is not None:
+        cursor = cursors.start(endpoint_name, date_key, site_id)
+        if cursor['status'] == 'done':
+            logger.info(f"[{sync_id}] {endpoint_name} {date_key or '(undated)'} already completed in this run; skipping.")
+            counts['resumed'] = counts.get('resumed', 0) + 1
+            return cursor['records_published'], None
+        skip, records_for_date = cursor['next_skip'], cursor['records_published']
+        if skip:
+            counts['resumed'] = counts.get('resumed', 0) + 1
+            logger.info(f"[{sync_id}] Resuming {endpoint_name} {date_key or '(undated)'} at $skip={skip}.")
+
+    children = expanded_children(endpoint_name)
+    # A probe sees only the parent's count and latest ModifiedOn; a child row can change
+    # without moving either, so dates of an endpoint with expanded children are always paged.
+    probe = probe and not children
+
+    signature = None
+    if probe and target_date and skip == 0:
+        age_days = (datetime.now(CHICAGO_TZ).date() - target_date.date()).days
+        try:
+            outcome, signature = probes.check_date(
+                endpoint_name, site_id, date_key, age_days,
+                lambda: fetch_odata_probe(url, _build_odata_params(endpoint_config, site_id, target_date, 0),
+                                          endpoint_config, access_token=access_token),
+            )
+        except Exception as e:
+            logger.warning(f"[{sync_id}] Change probe for {endpoint_name} {date_key} failed ({e}); syncing in full.")
+            outcome = probes.SYNC
+        if outcome != probes.SYNC:
+            logger.info(f"[{sync_id}] {endpoint_name} {date_key} is {outcome}; skipping.")
+            counts['probe_skipped'] = counts.get('probe_skipped', 0) + 1
+            if cursors is not None:
+                cursors.complete(endpoint_name, date_key, site_id)
+            return 0, None
+
+    child_counts = dict.fromkeys(children, 0)
+    # With the outbox, pages whose messages Pub/Sub has not confirmed yet; the cursor waits for them.
+    outboxed_pages: Optional[List[dict]] = [] if outbox_enabled() else None
     has_more = True
+    first_page = True
     while has_more:
+        if should_stop is not None and not first_page and should_stop():
+            unconfirmed = _confirm_outboxed_pages(outboxed_pages, cursors, endpoint_name, date_key, site_id)
+            if unconfirmed is not None:
+                skip, records_for_date = unconfirmed['skip'], unconfirmed['records_published']
+            logger.info(f"[{sync_id}] Deferring {endpoint_name} {date_key or '(undated)'} at $skip={skip}: sync deadline reached.")
+            if cursors is not None:
+                cursors.defer(endpoint_name, date_key, site_id)
+            return records_for_date, {
+                'endpoint': endpoint_name, 'business_date': date_key, 'site_id': site_id,
+                'next_skip': skip, 'records_published': records_for_date, 'error': DEADLINE_DEFERRED,
+            }
+        first_page = False
         params = _build_odata_params(endpoint_config, site_id, target_date, skip)
+        if children:
+            params['$expand'] = ",".join(children.values())
         try:
-            records = fetch_odata_page(url, params)
-            if records:
-                publish_records(records, endpoint_name, sync_id)
-                records_for_date += len(records)
-                skip += API_PAGE_SIZE
-                has_more = len(records) == API_PAGE_SIZE
-            else:
-                has_more = False
+            with TRACER.span("page", endpoint=endpoint_name, skip=skip) as page_span:
+                records = fetch_odata_page(url, params, access_token=access_token)
+                counts['pages_fetched'] = counts.get('pages_fetched', 0) + 1
+                page_span.set_attribute("records", len(records))
+                if records:
+                    child_records = split_expanded_records(records, children) if children else {}
+                    outbox_ranges = [publish_records(records, endpoint_name, sync_id, stats_key=stats_key)]
+                    for child, rows in child_records.items():
+                        if rows:
+                            outbox_ranges.append(publish_records(rows, child, sync_id, stats_key=stats_key))
+                            child_counts[child] += len(rows)
+                    page = {'skip': skip, 'records_published': records_for_date}
+                    records_for_date += len(records)
+                    skip += API_PAGE_SIZE
+                    has_more = len(records) == API_PAGE_SIZE
+                    if outboxed_pages is not None:
+                        outboxed_pages.append({**page, 'ranges': [r for r in outbox_ranges if r], 'next_skip': skip,
+                                               'last_id': records[-1].get('Id'), 'records_after': records_for_date})
+                    elif cursors is not None:
+                        cursors.advance(endpoint_name, date_key, site_id, skip, records[-1].get('Id'), records_for_date)
+                else:
+                    has_more = False
         except Exception as e:
-            logger.error(f"[{sync_id}] Failed to process page for {endpoint_name}. Error: {e}")
-            break  # Stop processing this date if a page fails
-            
+            logger.error(f"[{sync_id}] Failed to process page for {endpoint_name} at $skip={skip}. Error: {e}")
+            unconfirmed = _confirm_outboxed_pages(outboxed_pages, cursors, endpoint_name, date_key, site_id)
+            if unconfirmed is not None:
+                skip, records_for_date = unconfirmed['skip'], unconfirmed['records_published']
+            if cursors is not None:
+                cursors.fail(endpoint_name, date_key, site_id, str(e))
+            # The remaining pages of this date are left for a resume instead of being skipped silently.
+            return records_for_date, {
+                'endpoint': endpoint_name, 'business_date': date_key, 'site_id': site_id,
+                'next_skip': skip, 'records_published': records_for_date, 'error': str(e),
+            }
+
+    unconfirmed = _confirm_outboxed_pages(outboxed_pages, cursors, endpoint_name, date_key, site_id)
+    if unconfirmed is not None:
+        error = "outbox: messages not confirmed by Pub/Sub in time"
+        logger.error(f"[{sync_id}] {endpoint_name} {date_key or '(undated)'}: {error}; resuming at $skip={unconfirmed['skip']}.")
+        if cursors is not None:
+            cursors.fail(endpoint_name, date_key, site_id, error)
+        return unconfirmed['records_published'], {
+            'endpoint': endpoint_name, 'business_date': date_key, 'site_id': site_id,
+            'next_skip': unconfirmed['skip'], 'records_published': unconfirmed['records_published'], 'error': error,
+        }
+    if cursors is not None:
+        cursors.complete(endpoint_name, date_key, site_id)
+    if signature is not None:
+        probes.SignatureStore().save(endpoint_name, site_id, date_key, signature)
+    if children:
+        logger.info(f"[{sync_id}] Expanded child records for {endpoint_name} {date_key or '(undated)'}: {child_counts}")
     if records_for_date == 0 and target_date:
-        logger.info(f"[{sync_id}] Endpoint '{endpoint_name}' returned 0 records for date {target_date.strftime('%Y-%m-%d')}.")
-    return records_for_date
+        logger.info(f"[{sync_id}] Endpoint '{endpoint_name}' returned 0 records for date {date_key}.")
+    return records_for_date, None
 
 def _get_date_range_for_sync(endpoint_config: dict, days_back: int) -> List[Optional[datetime]]:
     """
@@ -243,15 +554,40 @@ def _get_date_range_for_sync(endpoint_config: dict, days_back: int) -> List[Opti
     """
     date_field = endpoint_config.get('date_field')
     if date_field:
-        CHICAGO_TZ = ZoneInfo("America/Chicago")
         end_date = datetime.now(CHICAGO_TZ)
         return [end_date - timedelta(days=i) for i in range(days_back + 1)]
     else:
         return [None]
 
-def sync_endpoint(endpoint_name: str, days_back: int) -> int:
-    """Syncs an endpoint using the detailed configuration to build the correct filter."""
+def sync_endpoint(
+    endpoint_name: str,
+    days_back: int,
+    target_dates: Optional[List[Optional[datetime]]] = None,
+    progress_callback: Optional[Callable[[Optional[datetime], int], None]] = None,
+    site_id: Optional[str] = None,
+    report: Optional[dict] = None,
+    cursors: Optional["PageCursors"] = None,
+    access_token: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    probe: Optional[bool] = None,
+) -> int:
+    """
+    Syncs an endpoint using the detailed configuration to build the correct filter.
+    If target_dates is given it replaces the days_back window, and progress_callback
+    is invoked with (target_date, records_published) after each date completes.
+    site_id overrides the site from the configured API credentials. If a report
+    dict is given it is filled with the sync_id, per-table compression stats,
+    the failed_units whose remaining pages were not published, and the number
+    of pages_fetched and of dates that were probe_skipped or resumed from a
+    cursor. With cursors,
+    each date continues from its stored page cursor. access_token pairs with
+    site_id when syncing a site that has its own credentials. should_stop lets
+    a deadline defer the remaining pages (see pos_poller/scheduler.py). probe
+    enables change probes (default: CHANGE_PROBES; see pos_poller/probes.py).
+    """
     sync_id = f"{endpoint_name}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}"
+    # Unique per call: units of the same endpoint started in the same second share a sync_id.
+    stats_key = uuid.uuid4().hex
     logger.info(f"[{sync_id}] Starting sync for {endpoint_name}")
     
     # Use .get() on the main dict to handle cases where an endpoint might be requested
@@ -261,15 +597,44 @@ def sync_endpoint(endpoint_name: str, days_back: int) -> int:
         logger.error(f"No configuration found for endpoint '{endpoint_name}'. Skipping.")
         return 0
 
-    site_id, _ = get_api_credentials()
+    if site_id is None:
+        site_id, _ = get_api_credentials()
+    if probe is None:
+        probe = probes.probes_enabled()
     url = f"{API_BASE_URL}/{endpoint_name}"
     total_records = 0
-    date_range_to_process = _get_date_range_for_sync(endpoint_config, days_back)
+    failed_units = []
+    counts = {'pages_fetched': 0, 'probe_skipped': 0, 'resumed': 0}
+    if target_dates is not None:
+        date_range_to_process = target_dates
+    else:
+        date_range_to_process = _get_date_range_for_sync(endpoint_config, days_back)
 
-    for target_date in date_range_to_process:
-        total_records += _sync_for_single_date(
-            url, endpoint_name, endpoint_config, site_id, target_date, sync_id
-        )
-    
+    try:
+        with TRACER.span("endpoint", endpoint=endpoint_name, sync_id=sync_id) as endpoint_span:
+            for target_date in date_range_to_process:
+                date_key = target_date.strftime('%Y-%m-%d') if target_date else None
+                with TRACER.span("date", endpoint=endpoint_name, business_date=date_key) as date_span:
+                    records_for_date, failure = _sync_for_single_date(
+                        url, endpoint_name, endpoint_config, site_id, target_date, sync_id, cursors, access_token, should_stop, probe,
+                        stats_key, counts,
+                    )
+                    date_span.set_attribute("records", records_for_date)
+                total_records += records_for_date
+                if failure:
+                    failed_units.append(failure)
+                elif progress_callback:
+                    progress_callback(target_date, records_for_date)
+            endpoint_span.set_attribute("records", total_records)
+    finally:
+        compression_stats = pop_compression_stats(stats_key)
+    if report is not None:
+        report['sync_id'] = sync_id
+        report['compression'] = compression_stats
+        report['failed_units'] = failed_units
+        report.update(counts)
+
+    if failed_units:
+        logger.warning(f"[{sync_id}] {len(failed_units)} date(s) of {endpoint_name} did not finish and can be resumed.")
     logger.info(f"[{sync_id}] Completed sync for {endpoint_name}. Total records: {total_records}")
     return total_records
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Change probes: skip re-downloading dates that have not changed since the last sync.
+
+Before paginating a date, one request asks the OData service for the date's
+record count ($inlinecount=allpages) and its most recently modified record
+($top=1 ordered by ModifiedOn, then Id, descending). Together these form the
+date's signature. If it matches the signature stored when the date was last
+synced in full, pagination is skipped. The stored signature is the one probed
+before that full sync, so changes made while it ran show up next time.
+
+Dates older than PROBE_CLOSE_OUT_DAYS that have been synced once are
+finalized and skipped without a probe.
+
+Configuration (environment):
+    CHANGE_PROBES          enable probes for /sync, jobs and work units (default false)
+    PROBE_CLOSE_OUT_DAYS   age in days after which a synced date is finalized (default 30)
+"""
+import os
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+
+from pos_common.metrics import REGISTRY
+from pos_poller.store import state_db, ensure_tables
+
+logger = logging.getLogger(__name__)
+
+CLOSE_OUT_DAYS = int(os.environ.get("PROBE_CLOSE_OUT_DAYS", "30"))
+DEFAULT_MODIFIED_FIELD = "ModifiedOn"
+
+PROBES = REGISTRY.counter("pos_poller_change_probes_total", "Date change probes by outcome.", ["endpoint", "outcome"])
+
+SIGNATURES_DDL = """
+CREATE TABLE IF NOT EXISTS date_signatures (
+    endpoint TEXT NOT NULL,
+    site_id TEXT NOT NULL,
+    business_date TEXT NOT NULL,
+    record_count INTEGER,
+    max_modified TEXT,
+    last_id TEXT,
+    finalized INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (endpoint, site_id, business_date)
+);
+"""
+
+# Outcomes of check_date
+SYNC, UNCHANGED, FINALIZED = "sync", "unchanged", "finalized"
+
+
+def probes_enabled() -> bool:
+    return os.environ.get("CHANGE_PROBES", "false").lower() == "true"
+
+
+def build_probe_params(params: dict, endpoint_config: dict) -> dict:
+    """Turns a date's page query into its probe query: count plus the most recently modified record."""
+    modified_field = endpoint_config.get('modified_field', DEFAULT_MODIFIED_FIELD)
+    probe = {key: value for key, value in params.items() if key != '$skip'}
+    probe.update({
+        '$top': 1,
+        '$orderby': f"{modified_field} desc,Id desc",
+        '$inlinecount': 'allpages',
+        '$select': f"Id,{modified_field}",
+    })
+    return probe
+
+
+def parse_probe_response(body: dict, endpoint_config: dict) -> dict:
+    """Reads the signature from an OData v2 ({'d': {'results', '__count'}}) or v4 (@odata.count) response."""
+    modified_field = endpoint_config.get('modified_field', DEFAULT_MODIFIED_FIELD)
+    if '@odata.count' in body:
+        count, results = body['@odata.count'], body.get('value', [])
+    else:
+        d = body.get('d', {})
+        if isinstance(d, list):
+            raise ValueError("The OData service ignored $inlinecount; change probes need a count.")
+        count, results = d.get('__count'), d.get('results', [])
+    if count is None:
+        raise ValueError("The OData service returned no record count.")
+    latest = results[0] if results else {}
+    return {
+        'record_count': int(count),
+        'max_modified': latest.get(modified_field),
+        'last_id': None if latest.get('Id') is None else str(latest.get('Id')),
+    }
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SignatureStore:
+    """Per (endpoint, site, business_date) signatures from the last full sync."""
+
+    def __init__(self):
+        ensure_tables(SIGNATURES_DDL)
+
+    def get(self, endpoint: str, site_id: Optional[str], date_key: str) -> Optional[dict]:
+        with state_db() as conn:
+            row = conn.execute(
+                "SELECT record_count, max_modified, last_id, finalized FROM date_signatures "
+                "WHERE endpoint = ? AND site_id = ? AND business_date = ?",
+                (endpoint, site_id or '', date_key),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save(self, endpoint: str, site_id: Optional[str], date_key: str, signature: dict, finalized: bool = False) -> None:
+        with state_db() as conn:
+            conn.execute(
+                "INSERT INTO date_signatures (endpoint, site_id, business_date, record_count, max_modified, last_id, finalized, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(endpoint, site_id, business_date) DO UPDATE SET "
+                "record_count = excluded.record_count, max_modified = excluded.max_modified, last_id = excluded.last_id, "
+                "finalized = excluded.finalized, updated_at = excluded.updated_at",
+                (endpoint, site_id or '', date_key, signature.get('record_count'), signature.get('max_modified'),
+                 signature.get('last_id'), int(finalized), _now()),
+            )
+
+    def finalize(self, endpoint: str, site_id: Optional[str], date_key: str) -> None:
+        with state_db() as conn:
+            conn.execute(
+                "UPDATE date_signatures SET finalized = 1, updated_at = ? WHERE endpoint = ? AND site_id = ? AND business_date = ?",
+                (_now(), endpoint, site_id or '', date_key),
+            )
+
+
+def check_date(endpoint: str, site_id: Optional[str], date_key: str, age_days: int,
+               probe: Callable[[], dict], store: Optional[SignatureStore] = None) -> Tuple[str, Optional[dict]]:
+    """
+    Decides whether a date needs a full sync. Returns (outcome, signature):
+    FINALIZED or UNCHANGED to skip it, or SYNC with the freshly probed
+    signature to store once the full sync has finished.
+    """
+    store = store or SignatureStore()
+    stored = store.get(endpoint, site_id, date_key)
+    if stored and stored['finalized']:
+        PROBES.inc(endpoint=endpoint, outcome=FINALIZED)
+        return FINALIZED, None
+    if stored and age_days > CLOSE_OUT_DAYS:
+        # Synced at least once and past the close-out age: no further probes.
+        store.finalize(endpoint, site_id, date_key)
+        PROBES.inc(endpoint=endpoint, outcome=FINALIZED)
+        return FINALIZED, None
+
+    signature = probe()
+    if stored and all(stored[key] == signature[key] for key in ('record_count', 'max_modified', 'last_id')):
+        PROBES.inc(endpoint=endpoint, outcome=UNCHANGED)
+        return UNCHANGED, signature
+    PROBES.inc(endpoint=endpoint, outcome="new" if stored is None else "changed")
+    return SYNC, signature
@@ -0,0 +1,248 @@
+"""
+Streaming Pub/Sub publisher for the POS Poller.
+
+Messages are handed to the PublisherClient without waiting on each one. The
+client batches them (PUBLISH_BATCH_MAX_MESSAGES / _MAX_BYTES / _MAX_LATENCY)
+and its flow control blocks the caller once PUBLISH_MAX_IN_FLIGHT_MESSAGES or
+PUBLISH_MAX_IN_FLIGHT_BYTES are outstanding, so memory stays bounded however
+large a page or a backfill is. Completions arrive on callbacks. A failed
+message is retried on its own, with exponential backoff, up to
+PUBLISH_MAX_ATTEMPTS times; after that it is appended to a local JSONL
+dead-letter file (PUBLISH_DEAD_LETTER_PATH) instead of failing the page.
+
+Replay the dead-letter file once the cause is fixed:
+    python -m pos_poller.publisher replay [--path /tmp/pos_poller_dead_letters.jsonl]
+"""
+import os
+import sys
+import json
+import heapq
+import base64
+import logging
+import argparse
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pos_common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_BATCH_MAX_MESSAGES = int(os.environ.get("PUBLISH_BATCH_MAX_MESSAGES", "500"))
+PUBLISH_BATCH_MAX_BYTES = int(os.environ.get("PUBLISH_BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+PUBLISH_BATCH_MAX_LATENCY = float(os.environ.get("PUBLISH_BATCH_MAX_LATENCY", "0.05"))
+PUBLISH_MAX_IN_FLIGHT_MESSAGES = int(os.environ.get("PUBLISH_MAX_IN_FLIGHT_MESSAGES", "5000"))
+PUBLISH_MAX_IN_FLIGHT_BYTES = int(os.environ.get("PUBLISH_MAX_IN_FLIGHT_BYTES", str(50 * 1024 * 1024)))
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get("PUBLISH_MAX_ATTEMPTS", "5"))
+PUBLISH_RETRY_INITIAL_SECONDS = float(os.environ.get("PUBLISH_RETRY_INITIAL_SECONDS", "1.0"))
+PUBLISH_RETRY_MAX_SECONDS = float(os.environ.get("PUBLISH_RETRY_MAX_SECONDS", "30.0"))
+PUBLISH_DEAD_LETTER_PATH = os.environ.get("PUBLISH_DEAD_LETTER_PATH", "/tmp/pos_poller_dead_letters.jsonl")
+
+PUBLISH_RETRIES = REGISTRY.counter("pos_poller_publish_retries_total", "Messages re-published after a failed publish.", ["table"])
+DEAD_LETTERED = REGISTRY.counter("pos_poller_publish_dead_lettered_total", "Messages written to the local dead-letter file.", ["table"])
+
+
+def publisher_client_options() -> dict:
+    """Keyword arguments for PublisherClient: throughput-oriented batching and blocking flow control."""
+    from google.cloud.pubsub_v1 import types
+    return {
+        "batch_settings": types.BatchSettings(
+            max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+            max_bytes=PUBLISH_BATCH_MAX_BYTES,
+            max_latency=PUBLISH_BATCH_MAX_LATENCY,
+        ),
+        "publisher_options": types.PublisherOptions(
+            flow_control=types.PublishFlowControl(
+                message_limit=PUBLISH_MAX_IN_FLIGHT_MESSAGES,
+                byte_limit=PUBLISH_MAX_IN_FLIGHT_BYTES,
+                limit_exceeded_behavior=types.LimitExceededBehavior.BLOCK,
+            ),
+        ),
+    }
+
+
+class DeadLetteredError(RuntimeError):
+    """Some messages of a page were dead-lettered; the page must be fetched again rather than counted as synced."""
+
+
+class PublishTracker:
+    """Counts the outstanding messages of one batch of publishes (one page) so the caller can wait for them."""
+
+    def __init__(self):
+        self.pending = 0
+        self.published = 0
+        self.dead_lettered = 0
+        self._condition = threading.Condition()
+
+    def _add(self) -> None:
+        with self._condition:
+            self.pending += 1
+
+    def _finish(self, published: bool) -> None:
+        with self._condition:
+            self.pending -= 1
+            if published:
+                self.published += 1
+            else:
+                self.dead_lettered += 1
+            if self.pending == 0:
+                self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every message is either published or dead-lettered."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.pending == 0, timeout)
+
+
+class _Message:
+    __slots__ = ("topic_path", "data", "attributes", "table", "tracker", "attempt")
+
+    def __init__(self, topic_path: str, data: bytes, attributes: Dict[str, str], table: str, tracker: PublishTracker):
+        self.topic_path = topic_path
+        self.data = data
+        self.attributes = attributes
+        self.table = table
+        self.tracker = tracker
+        self.attempt = 0
+
+
+class StreamingPublisher:
+    """Publishes without blocking on each message, retrying failed messages individually and dead-lettering the rest."""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        max_attempts: int = PUBLISH_MAX_ATTEMPTS,
+        initial_backoff: float = PUBLISH_RETRY_INITIAL_SECONDS,
+        max_backoff: float = PUBLISH_RETRY_MAX_SECONDS,
+        dead_letter_path: str = PUBLISH_DEAD_LETTER_PATH,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._client_factory = client_factory
+        self.max_attempts = max(1, max_attempts)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.dead_letter_path = dead_letter_path
+        self._clock = clock
+        self._retries: List[tuple] = []
+        self._sequence = itertools.count()
+        self._retry_condition = threading.Condition()
+        self._retry_thread: Optional[threading.Thread] = None
+
+    def publish(self, topic_path: str, data: bytes, attributes: Dict[str, str], table: str, tracker: PublishTracker) -> None:
+        """Queues one message; the outcome is recorded on the tracker. Blocks only while flow control is full."""
+        tracker._add()
+        self._send(_Message(topic_path, data, attributes, table, tracker))
+
+    def _send(self, message: _Message) -> None:
+        message.attempt += 1
+        try:
+            future = self._client_factory().publish(message.topic_path, message.data, **message.attributes)
+        except Exception as e:
+            self._failed(message, e)
+            return
+        future.add_done_callback(lambda done: self._on_done(message, done))
+
+    def _on_done(self, message: _Message, future) -> None:
+        error = future.exception()
+        if error is None:
+            message.tracker._finish(published=True)
+        else:
+            self._failed(message, error)
+
+    def _failed(self, message: _Message, error: BaseException) -> None:
+        if message.attempt >= self.max_attempts:
+            logger.error(f"Giving up on a {message.table} message after {message.attempt} attempts: {error}")
+            self._dead_letter(message, error)
+            message.tracker._finish(published=False)
+            return
+        delay = min(self.max_backoff, self.initial_backoff * (2 ** (message.attempt - 1)))
+        logger.warning(f"Publishing a {message.table} message failed (attempt {message.attempt}): {error}; "
+                       f"retrying in {delay:.1f}s.")
+        PUBLISH_RETRIES.inc(table=message.table)
+        with self._retry_condition:
+            heapq.heappush(self._retries, (self._clock() + delay, next(self._sequence), message))
+            if self._retry_thread is None:
+                self._retry_thread = threading.Thread(target=self._retry_loop, name="publish-retry", daemon=True)
+                self._retry_thread.start()
+            self._retry_condition.notify()
+
+    def _retry_loop(self) -> None:
+        # Sends are made outside the lock: with flow control full they block until capacity frees up.
+        while True:
+            with self._retry_condition:
+                while not self._retries or self._retries[0][0] > self._clock():
+                    timeout = self._retries[0][0] - self._clock() if self._retries else None
+                    self._retry_condition.wait(timeout)
+                _, _, message = heapq.heappop(self._retries)
+            self._send(message)
+
+    def _dead_letter(self, message: _Message, error: BaseException) -> None:
+        write_dead_letter(self.dead_letter_path, message.topic_path, message.table, message.data,
+                          message.attributes, message.attempt, error)
+
+
+_dead_letter_lock = threading.Lock()
+
+
+def write_dead_letter(path: str, topic_path: str, table: str, data: bytes, attributes: Dict[str, str],
+                      attempts: int, error: BaseException) -> None:
+    """Appends one message to a dead-letter file in the format replay_dead_letters reads."""
+    entry = {
+        "topic_path": topic_path,
+        "table": table,
+        "data": base64.b64encode(data).decode("ascii"),
+        "attributes": attributes,
+        "attempts": attempts,
+        "error": str(error),
+        "failed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with _dead_letter_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    DEAD_LETTERED.inc(table=table)
+
+
+def replay_dead_letters(publisher: StreamingPublisher, path: str) -> dict:
+    """
+    Re-publishes every message in a dead-letter file. Messages that fail again
+    are appended to the publisher's dead-letter file, so the replayed file is
+    moved aside first rather than edited in place.
+    """
+    if not os.path.exists(path):
+        return {"replayed": 0, "published": 0, "dead_lettered": 0}
+    replaying = f"{path}.replaying"
+    os.replace(path, replaying)
+    tracker = PublishTracker()
+    replayed = 0
+    with open(replaying, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            publisher.publish(entry["topic_path"], base64.b64decode(entry["data"]), entry.get("attributes") or {},
+                              entry.get("table", "unknown"), tracker)
+            replayed += 1
+    tracker.wait()
+    os.remove(replaying)
+    return {"replayed": replayed, "published": tracker.published, "dead_lettered": tracker.dead_lettered}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the poller's local publish dead-letter file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay = subparsers.add_parser("replay", help="Re-publish every dead-lettered message.")
+    replay.add_argument("--path", default=PUBLISH_DEAD_LETTER_PATH)
+    args = parser.parse_args(argv)
+
+    from pos_poller.poller import get_streaming_publisher
+    result = replay_dead_letters(get_streaming_publisher(), args.path)
+    print(json.dumps(result))
+    return 1 if result["dead_lettered"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
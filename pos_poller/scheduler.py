@@ -0,0 +1,187 @@
+"""
+Cost-aware ordering of a synchronous /sync run under a wall-clock deadline.
+
+Each (endpoint, date) unit is costed from history: an exponentially weighted
+average of the pages each endpoint returns per date and of its seconds per
+page, kept in the poller's state DB and updated after every completed unit.
+Units are ordered by value per estimated second. A unit's value halves every
+SYNC_FRESHNESS_HALF_LIFE_DAYS of age, so today's dates and cheap dimension
+endpoints come before old dates of heavy endpoints such as ItemSales.
+
+With a deadline, a unit is started only if its estimate fits in the time
+left; a unit that is already running stops between pages when the deadline
+is near. Both kinds are checkpointed as deferred page cursors, so POST
+/sync/resume continues them.
+
+Configuration (environment):
+    SYNC_DEADLINE_SECONDS              default deadline for /sync (unset: none)
+    SYNC_DEADLINE_MARGIN_SECONDS       time kept in reserve for the response (default 5)
+    SYNC_FRESHNESS_HALF_LIFE_DAYS      age at which a date is worth half of today's (default 2)
+    SYNC_DEFAULT_SECONDS_PER_PAGE      cost of a page for endpoints without history (default 2)
+"""
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from pos_poller.config import ODATA_ENDPOINTS
+from pos_poller.poller import (
+    CHICAGO_TZ, DEADLINE_DEFERRED, sync_endpoint, merge_compression_stats, _get_date_range_for_sync,
+)
+from pos_poller.store import state_db, ensure_tables
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_MARGIN_SECONDS = float(os.environ.get("SYNC_DEADLINE_MARGIN_SECONDS", "5"))
+FRESHNESS_HALF_LIFE_DAYS = float(os.environ.get("SYNC_FRESHNESS_HALF_LIFE_DAYS", "2"))
+DEFAULT_SECONDS_PER_PAGE = float(os.environ.get("SYNC_DEFAULT_SECONDS_PER_PAGE", "2"))
+DEFAULT_PAGES_PER_DATE = 1.0
+EWMA_ALPHA = 0.3
+
+COSTS_DDL = """
+CREATE TABLE IF NOT EXISTS endpoint_costs (
+    endpoint TEXT PRIMARY KEY,
+    pages_per_date REAL NOT NULL,
+    seconds_per_page REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    updated_at TEXT
+);
+"""
+
+def default_deadline_seconds() -> Optional[float]:
+    value = os.environ.get("SYNC_DEADLINE_SECONDS")
+    return float(value) if value else None
+
+# --- Cost Model ---
+
+class CostModel:
+    """Historical pages per date and seconds per page for each endpoint."""
+
+    def __init__(self):
+        ensure_tables(COSTS_DDL)
+        with state_db() as conn:
+            rows = conn.execute("SELECT endpoint, pages_per_date, seconds_per_page, samples FROM endpoint_costs").fetchall()
+        self.costs: Dict[str, dict] = {row['endpoint']: dict(row) for row in rows}
+
+    def seconds_per_page(self, endpoint: str) -> float:
+        cost = self.costs.get(endpoint)
+        return cost['seconds_per_page'] if cost else DEFAULT_SECONDS_PER_PAGE
+
+    def estimate(self, endpoint: str) -> float:
+        """Estimated seconds to sync one date of the endpoint."""
+        cost = self.costs.get(endpoint)
+        pages = cost['pages_per_date'] if cost else DEFAULT_PAGES_PER_DATE
+        return pages * self.seconds_per_page(endpoint)
+
+    def record(self, endpoint: str, pages: int, seconds: float) -> None:
+        """Folds one completed unit into the endpoint's averages."""
+        seconds_per_page = seconds / max(pages, 1)
+        cost = self.costs.get(endpoint)
+        if cost is None:
+            cost = {'endpoint': endpoint, 'pages_per_date': float(pages), 'seconds_per_page': seconds_per_page, 'samples': 1}
+        else:
+            cost['pages_per_date'] += EWMA_ALPHA * (pages - cost['pages_per_date'])
+            cost['seconds_per_page'] += EWMA_ALPHA * (seconds_per_page - cost['seconds_per_page'])
+            cost['samples'] += 1
+        self.costs[endpoint] = cost
+        with state_db() as conn:
+            conn.execute(
+                "INSERT INTO endpoint_costs (endpoint, pages_per_date, seconds_per_page, samples, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(endpoint) DO UPDATE SET pages_per_date = excluded.pages_per_date, "
+                "seconds_per_page = excluded.seconds_per_page, samples = excluded.samples, updated_at = excluded.updated_at",
+                (endpoint, cost['pages_per_date'], cost['seconds_per_page'], cost['samples'],
+                 datetime.now(timezone.utc).isoformat()),
+            )
+
+# --- Planning ---
+
+def plan_units(endpoints: List[str], days_back: int, model: CostModel, now: Optional[datetime] = None) -> List[dict]:
+    """Every (endpoint, date) unit of the request, most value per estimated second first."""
+    today = (now or datetime.now(CHICAGO_TZ)).date()
+    units = []
+    for endpoint in endpoints:
+        estimate = model.estimate(endpoint)
+        for target_date in _get_date_range_for_sync(ODATA_ENDPOINTS[endpoint], days_back):
+            age_days = (today - target_date.date()).days if target_date else 0
+            value = 0.5 ** (age_days / FRESHNESS_HALF_LIFE_DAYS)
+            units.append({
+                'endpoint': endpoint,
+                'target_date': target_date,
+                'age_days': age_days,
+                'estimated_seconds': estimate,
+                'score': value / max(estimate, 0.01),
+            })
+    return sorted(units, key=lambda unit: (-unit['score'], unit['age_days'], unit['endpoint']))
+
+class Deadline:
+    """A wall-clock budget measured from construction, less a reserve for building the response."""
+
+    def __init__(self, seconds: float, margin: float = DEADLINE_MARGIN_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.ends_at = clock() + max(0.0, seconds - margin)
+
+    def remaining(self) -> float:
+        return self.ends_at - self._clock()
+
+    def allows(self, estimated_seconds: float) -> bool:
+        return estimated_seconds <= self.remaining()
+
+# --- Execution ---
+
+def run_scheduled_sync(endpoints: List[str], days_back: int, cursors=None, deadline: Optional[Deadline] = None,
+                       model: Optional[CostModel] = None) -> dict:
+    """
+    Runs the planned units in order. Returns per-endpoint results plus the
+    failed units and the units deferred by the deadline.
+    """
+    model = model or CostModel()
+    plan = plan_units(endpoints, days_back, model)
+    results = {endpoint: {'status': 'success', 'records_published': 0} for endpoint in endpoints}
+    compression: Dict[str, dict] = {}
+    failed_units, deferred_units = [], []
+
+    for unit in plan:
+        endpoint, target_date = unit['endpoint'], unit['target_date']
+        date_key = target_date.strftime('%Y-%m-%d') if target_date else ''
+        if deadline is not None and not deadline.allows(unit['estimated_seconds']):
+            if cursors is not None:
+                cursors.defer(endpoint, date_key, None)
+            deferred_units.append({'endpoint': endpoint, 'business_date': date_key, 'site_id': None,
+                                   'next_skip': 0, 'records_published': 0, 'error': DEADLINE_DEFERRED})
+            continue
+
+        should_stop = None
+        if deadline is not None:
+            seconds_per_page = model.seconds_per_page(endpoint)
+            should_stop = lambda: not deadline.allows(seconds_per_page)
+        report = {}
+        started = time.monotonic()
+        try:
+            records = sync_endpoint(endpoint, 0, target_dates=[target_date], report=report, cursors=cursors,
+                                    should_stop=should_stop)
+        except Exception as e:
+            logger.error(f"Scheduled sync of {endpoint} {date_key or '(undated)'} failed: {e}", exc_info=True)
+            results[endpoint]['status'] = 'error'
+            results[endpoint]['message'] = str(e)
+            continue
+        results[endpoint]['records_published'] += records
+        merge_compression_stats(compression.setdefault(endpoint, {}), report.get('compression', {}))
+        unit_failures = report.get('failed_units', [])
+        for failure in unit_failures:
+            (deferred_units if failure.get('error') == DEADLINE_DEFERRED else failed_units).append(failure)
+        # Only a date paged from the start shows what the endpoint costs; probe skips and
+        # cursor resumes finish early and would drag the averages down.
+        if not unit_failures and report.get('pages_fetched') and not report.get('probe_skipped') \
+                and not report.get('resumed'):
+            model.record(endpoint, report['pages_fetched'], time.monotonic() - started)
+
+    for unit in failed_units + deferred_units:
+        if results[unit['endpoint']]['status'] == 'success':
+            results[unit['endpoint']]['status'] = 'incomplete'
+    for endpoint, stats in compression.items():
+        if stats:
+            results[endpoint]['compression'] = stats
+    if deferred_units:
+        logger.warning(f"Sync deadline reached; {len(deferred_units)} unit(s) were deferred for a resume.")
+    return {'results': results, 'failed_units': failed_units, 'deferred_units': deferred_units}
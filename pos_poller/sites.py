@@ -0,0 +1,181 @@
+"""
+Multi-site polling for the POS Poller.
+
+Sites are configured as a JSON list, read from the SITES environment variable
+(local) or from the secret named by SITES_SECRET_ID (cloud):
+
+    [{"name": "downtown", "site_id": "<guid>", "api_access_token": "<token>", "max_concurrency": 2},
+     {"name": "airport", "site_id": "<guid>", "api_access_token_secret_id": "airport-api-token"}]
+
+Without a sites list the single SITE_ID / API_ACCESS_TOKEN pair is used as one
+site named 'default'. A multi-site sync schedules every (site, endpoint, date)
+unit on one shared worker pool. The HTTP connection pool, governor and Pub/Sub
+publisher are shared too. Sites are served round-robin so a large site cannot
+starve the others, and each site has its own cap on in-flight units. With a
+deadline, running units stop between pages once it has passed and units not
+started yet are deferred, so a resume picks them up.
+"""
+import os
+import json
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from pos_poller.config import ODATA_ENDPOINTS
+from pos_poller import poller
+from pos_poller.poller import IS_LOCAL_ENVIRONMENT, sync_endpoint, get_secret, _get_date_range_for_sync
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SITE_MAX_CONCURRENCY = int(os.environ.get("SITE_MAX_CONCURRENCY", "2"))
+DEFAULT_SYNC_MAX_WORKERS = int(os.environ.get("SYNC_MAX_WORKERS", "8"))
+
+def _load_site(entry: dict) -> dict:
+    token = entry.get("api_access_token") or get_secret(entry.get("api_access_token_secret_id"))
+    site = {
+        "name": entry.get("name") or entry["site_id"],
+        "site_id": entry["site_id"],
+        "access_token": token,
+        "max_concurrency": max(1, int(entry.get("max_concurrency", DEFAULT_SITE_MAX_CONCURRENCY))),
+    }
+    if not token:
+        logger.critical(f"No API access token could be loaded for site '{site['name']}'.")
+    return site
+
+def multi_site_configured() -> bool:
+    return bool(os.environ.get("SITES") or os.environ.get("SITES_SECRET_ID"))
+
+@lru_cache(maxsize=1)
+def get_sites() -> List[dict]:
+    """Returns the configured sites; a single 'default' site when no list is configured."""
+    raw = os.environ.get("SITES")
+    if not raw and not IS_LOCAL_ENVIRONMENT:
+        raw = get_secret(os.environ.get("SITES_SECRET_ID"))
+    if raw:
+        sites = [_load_site(entry) for entry in json.loads(raw)]
+        names = [site["name"] for site in sites]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Site names must be unique, got {names}")
+        logger.info(f"Loaded {len(sites)} site(s): {names}")
+        return sites
+    site_id, access_token = poller.get_api_credentials()
+    return [{"name": "default", "site_id": site_id, "access_token": access_token,
+             "max_concurrency": DEFAULT_SITE_MAX_CONCURRENCY}]
+
+def get_site(site_id: Optional[str]) -> Optional[dict]:
+    return next((site for site in get_sites() if site["site_id"] == site_id), None)
+
+# --- Scheduling ---
+
+def _site_units(endpoints: List[str], days_back: int) -> deque:
+    """The (endpoint, date) units of one site, interleaved across endpoints, newest date first."""
+    per_endpoint = [
+        [(endpoint, target_date) for target_date in _get_date_range_for_sync(ODATA_ENDPOINTS[endpoint], days_back)]
+        for endpoint in endpoints
+    ]
+    units = deque()
+    for i in range(max((len(dates) for dates in per_endpoint), default=0)):
+        for dates in per_endpoint:
+            if i < len(dates):
+                units.append(dates[i])
+    return units
+
+def _run_unit(site: dict, endpoint: str, target_date: Optional[datetime], cursors,
+              should_stop: Optional[Callable[[], bool]] = None) -> dict:
+    report = {}
+    records = sync_endpoint(endpoint, 0, target_dates=[target_date], site_id=site["site_id"],
+                            access_token=site["access_token"], report=report, cursors=cursors,
+                            should_stop=should_stop)
+    return {"records_published": records, "failed_units": report.get("failed_units", []),
+            "compression": report.get("compression", {})}
+
+def _defer_unit(site: dict, endpoint: str, target_date: Optional[datetime], cursors) -> dict:
+    """Leaves a unit that never started for a resume because the deadline passed."""
+    date_key = target_date.strftime('%Y-%m-%d') if target_date else ''
+    if cursors is not None:
+        cursors.defer(endpoint, date_key, site["site_id"])
+    return {'endpoint': endpoint, 'business_date': date_key, 'site_id': site["site_id"],
+            'next_skip': 0, 'records_published': 0, 'error': poller.DEADLINE_DEFERRED}
+
+def run_multi_site_sync(sites: List[dict], endpoints: List[str], days_back: int, cursors=None,
+                        max_workers: int = DEFAULT_SYNC_MAX_WORKERS, deadline=None) -> Dict[str, dict]:
+    """
+    Runs every (site, endpoint, date) unit on one pool of max_workers threads.
+    The dispatcher takes sites in rotation, skipping a site while it has
+    max_concurrency units in flight. deadline is a scheduler.Deadline; once it
+    has passed no unit is started. Returns per-site results.
+    """
+    queues = {site["name"]: _site_units(endpoints, days_back) for site in sites}
+    by_name = {site["name"]: site for site in sites}
+    in_flight = {name: 0 for name in queues}
+    results = {
+        name: {"site_id": by_name[name]["site_id"], "status": "success", "records_published": 0,
+               "endpoints": {endpoint: {"records_published": 0} for endpoint in endpoints}, "failed_units": []}
+        for name in queues
+    }
+    rotation = deque(queues)
+    futures = {}
+    expired = (lambda: deadline.remaining() <= 0) if deadline is not None else None
+
+    def defer_queued() -> None:
+        for name, queue in queues.items():
+            while queue:
+                endpoint, target_date = queue.popleft()
+                results[name]["failed_units"].append(_defer_unit(by_name[name], endpoint, target_date, cursors))
+                if results[name]["status"] == "success":
+                    results[name]["status"] = "incomplete"
+
+    def dispatch_one() -> bool:
+        if expired is not None and expired():
+            defer_queued()
+            return False
+        for _ in range(len(rotation)):
+            name = rotation[0]
+            rotation.rotate(-1)
+            if queues[name] and in_flight[name] < by_name[name]["max_concurrency"]:
+                endpoint, target_date = queues[name].popleft()
+                in_flight[name] += 1
+                # Pool threads do not inherit context variables; the copy carries the caller's trace span.
+                future = executor.submit(contextvars.copy_context().run,
+                                         _run_unit, by_name[name], endpoint, target_date, cursors, expired)
+                futures[future] = (name, endpoint)
+                return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="site-sync") as executor:
+        while futures or any(queues.values()):
+            while len(futures) < max_workers and dispatch_one():
+                pass
+            if not futures:
+                break
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, endpoint = futures.pop(future)
+                in_flight[name] -= 1
+                site_result = results[name]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    logger.error(f"Site '{name}' sync of {endpoint} failed: {e}", exc_info=True)
+                    site_result["status"] = "error"
+                    site_result["endpoints"][endpoint]["error"] = str(e)
+                    continue
+                site_result["records_published"] += outcome["records_published"]
+                site_result["endpoints"][endpoint]["records_published"] += outcome["records_published"]
+                if outcome["compression"]:
+                    poller.merge_compression_stats(
+                        site_result["endpoints"][endpoint].setdefault("compression", {}), outcome["compression"]
+                    )
+                if outcome["failed_units"]:
+                    site_result["failed_units"].extend(outcome["failed_units"])
+                    if site_result["status"] == "success":
+                        site_result["status"] = "incomplete"
+
+    for name, site_result in results.items():
+        logger.info(f"Site '{name}' finished with status '{site_result['status']}': "
+                    f"{site_result['records_published']} records published.")
+    return results
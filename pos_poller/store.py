@@ -0,0 +1,51 @@
+"""
+Local persistent state for the POS Poller service.
+A single SQLite database holds job progress and other state that must survive restarts.
+"""
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DB_PATH = "/tmp/pos_poller_state.db"
+
+# SQLite connections are shared across the request and background threads;
+# this lock serialises access so a single connection can be used safely.
+_db_lock = threading.RLock()
+_applied_ddl: set = set()
+
+@lru_cache(maxsize=1)
+def get_state_db() -> sqlite3.Connection:
+    """Returns a cached connection to the poller's state database."""
+    path = os.environ.get("POLLER_STATE_DB", DEFAULT_STATE_DB_PATH)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    logger.info(f"Opening poller state database at {path}")
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@contextmanager
+def state_db() -> Iterator[sqlite3.Connection]:
+    """Yields the state database inside a transaction that commits on success."""
+    with _db_lock:
+        conn = get_state_db()
+        with conn:
+            yield conn
+
+def ensure_tables(ddl: str) -> None:
+    """Creates the tables described by the given DDL script if they do not exist."""
+    with _db_lock:
+        conn = get_state_db()
+        key = (conn, ddl)
+        if key not in _applied_ddl:
+            conn.executescript(ddl)
+            _applied_ddl.add(key)
@@ -0,0 +1,16 @@
+import os
+import pytest
+
+from pos_poller.store import get_state_db
+
+# Importing the Flask app must not pick up jobs from a developer's real state store.
+os.environ.setdefault("RESUME_SYNC_JOBS_ON_STARTUP", "false")
+
+@pytest.fixture(autouse=True)
+def isolated_state_db(tmp_path, monkeypatch):
+    """Points the poller's SQLite state store at a fresh per-test database."""
+    monkeypatch.setenv("POLLER_STATE_DB", str(tmp_path / "state.db"))
+    get_state_db.cache_clear()
+    yield
+    get_state_db().close()
+    get_state_db.cache_clear()
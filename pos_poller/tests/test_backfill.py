@@ -0,0 +1,78 @@
+import gzip
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+from pos_poller.poller import CHICAGO_TZ
+from pos_poller.backfill import run_backfill, FakeLoader, PartitionedFileWriter, _merge_sql
+
+SITE_ID = "36b492b3-d80e-4b5f-9ac6-35125a19fa0e"
+
+def _check(record_id: int, business_date_ms: int) -> dict:
+    return {
+        "Id": str(record_id),
+        "ObjectId": f"00000000-0000-0000-0000-{record_id:012d}",
+        "Site_ObjectId": SITE_ID,
+        "BusinessDate": f"/Date({business_date_ms})/",
+        "NetSales": "10.50",
+    }
+
+JUNE_29_MS = 1751155200000
+JUNE_30_MS = 1751241600000
+
+def test_backfill_writes_partitioned_files_and_loads_them(tmp_path):
+    """Valid rows land in one gzip NDJSON partition per business_date; invalid rows are rejected."""
+    pages = {
+        "2025-06-30": [_check(1, JUNE_30_MS), _check(2, JUNE_30_MS)],
+        "2025-06-29": [_check(3, JUNE_29_MS), {**_check(4, JUNE_29_MS), "ObjectId": 12345}],
+    }
+
+    def fake_fetch(url, params):
+        return pages[params['$filter'].split("'")[1][:10]]
+
+    loader = FakeLoader()
+    with patch('pos_poller.backfill.get_api_credentials', return_value=(SITE_ID, 'token')), \
+         patch('pos_poller.backfill.fetch_odata_page', side_effect=fake_fetch):
+        summary = run_backfill(['Checks'], days_back=1, output_dir=str(tmp_path), loader=loader,
+                               end_date=datetime(2025, 6, 30, tzinfo=CHICAGO_TZ))
+
+    assert summary['results']['Checks'] == {'status': 'success', 'rows_written': 3}
+    assert summary['rejected'] == 1
+    assert [(load['business_date'], load['rows']) for load in loader.loads] == [('2025-06-29', 1), ('2025-06-30', 2)]
+
+    path = tmp_path / "pos_checks" / "business_date=2025-06-30" / "part-00000.json.gz"
+    with gzip.open(path, 'rt') as handle:
+        rows = [json.loads(line) for line in handle]
+    assert rows[0]['business_date'] == '2025-06-30'
+    assert rows[0]['net_sales'] == 10.5
+    assert (tmp_path / "_rejects.jsonl").exists()
+
+def test_failed_endpoint_is_not_loaded(tmp_path):
+    """Partitions of an endpoint that failed mid-fetch are never loaded."""
+    loader = FakeLoader()
+    with patch('pos_poller.backfill.get_api_credentials', return_value=(SITE_ID, 'token')), \
+         patch('pos_poller.backfill.fetch_odata_page', side_effect=[[_check(1, JUNE_30_MS)], RuntimeError("API is down")]):
+        summary = run_backfill(['Checks'], days_back=1, output_dir=str(tmp_path), loader=loader)
+
+    assert summary['results']['Checks']['status'] == 'error'
+    assert loader.loads == []
+
+def test_writer_rolls_over_parts(tmp_path):
+    """A partition is split into several parts once max_rows_per_file is reached."""
+    writer = PartitionedFileWriter(str(tmp_path), max_rows_per_file=2)
+    for i in range(5):
+        writer.write('pos_checks', {'id': i, 'business_date': '2025-06-30'})
+    files = writer.close()
+
+    assert len(files[('pos_checks', '2025-06-30')]) == 3
+    assert writer.rows_written == {'pos_checks': 5}
+
+def test_merge_matches_on_site_and_id_within_the_date():
+    """The load MERGEs on (site_object_id, id) and never replaces the other sites' rows."""
+    sql = _merge_sql("p.d.pos_checks", "p.d._staging", ["id", "site_object_id", "business_date", "net_sales"], "2025-06-30")
+
+    assert "IFNULL(CAST(T.site_object_id AS STRING), '') = IFNULL(CAST(S.site_object_id AS STRING), '')" in sql
+    assert "IFNULL(CAST(T.id AS STRING), '') = IFNULL(CAST(S.id AS STRING), '')" in sql
+    assert "DATE(T.business_date) = DATE '2025-06-30'" in sql
+    assert "UPDATE SET business_date = S.business_date, net_sales = S.net_sales" in sql
+    assert "DELETE" not in sql
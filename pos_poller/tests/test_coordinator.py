@@ -0,0 +1,129 @@
+import json
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from pos_poller.poller import CHICAGO_TZ
+from pos_poller.coordinator import (
+    plan_work_units, shard_units, run_worker, SQLiteWorkQueue, PubSubWorkQueue, main
+)
+
+END_DATE = datetime(2025, 6, 30, tzinfo=CHICAGO_TZ)
+
+def test_plan_splits_dates_into_chunks_per_site():
+    """Each (endpoint, site) window is cut into contiguous chunks, newest first."""
+    units = plan_work_units(['Checks'], days_back=9, site_ids=['site-a', 'site-b'], chunk_days=4, end_date=END_DATE)
+
+    assert len(units) == 6
+    assert [(u['start_date'], u['end_date']) for u in units[:3]] == [
+        ('2025-06-27', '2025-06-30'), ('2025-06-23', '2025-06-26'), ('2025-06-21', '2025-06-22')
+    ]
+    assert {u['site_id'] for u in units} == {'site-a', 'site-b'}
+    assert len({u['unit_id'] for u in units}) == 6
+
+def test_static_shards_cover_plan_exactly_once():
+    """Static shards are disjoint and together cover every unit."""
+    units = plan_work_units(['Checks', 'ItemSales', 'Payments'], days_back=30, end_date=END_DATE)
+    shards = [shard_units(units, i, 4) for i in range(4)]
+
+    seen = [u['unit_id'] for shard in shards for u in shard]
+    assert sorted(seen) == sorted(u['unit_id'] for u in units)
+
+def test_sqlite_queue_workers_share_units(tmp_path):
+    """Two workers drain one queue; a failing unit is retried and then marked failed."""
+    queue = SQLiteWorkQueue(str(tmp_path / "work.db"), max_attempts=2)
+    units = plan_work_units(['Checks'], days_back=13, chunk_days=7, end_date=END_DATE)
+    assert queue.enqueue(units) == 2
+    assert queue.enqueue(units) == 0  # Re-planning the same window does not duplicate units.
+
+    def fake_sync(endpoint, days_back, target_dates=None, site_id=None, **kwargs):
+        if target_dates[0].strftime('%Y-%m-%d') == '2025-06-23':
+            raise RuntimeError("API is down")
+        return len(target_dates) * 10
+
+    with patch('pos_poller.coordinator.sync_endpoint', side_effect=fake_sync) as mock_sync:
+        first = run_worker(queue, worker_id='worker-1', max_units=1)
+        second = run_worker(queue, worker_id='worker-2')
+
+    assert first == {'worker_id': 'worker-1', 'completed': 1, 'failed': 0, 'records_published': 70}
+    assert second['failed'] == 2
+    assert mock_sync.call_count == 3
+    assert queue.summary() == {'units': {'done': 1, 'failed': 1}, 'records_published': 70}
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    """A unit whose worker died becomes claimable once its lease expires."""
+    queue = SQLiteWorkQueue(str(tmp_path / "work.db"), lease_seconds=-1)
+    queue.enqueue(plan_work_units(['Customers'], days_back=0))
+
+    assert queue.claim('dead-worker') is not None
+    assert queue.claim('live-worker') is not None
+
+def test_pubsub_queue_extends_the_ack_deadline_while_a_unit_runs():
+    """A claimed unit's ack deadline is renewed until it completes, so Pub/Sub does not redeliver it mid-run."""
+    # --- Arrange ---
+    [unit] = plan_work_units(['Customers'], days_back=0)
+    subscriber = MagicMock()
+    subscriber.pull.side_effect = [
+        SimpleNamespace(received_messages=[SimpleNamespace(ack_id='ack-1', message=SimpleNamespace(data=json.dumps(unit).encode()))]),
+    ] + [SimpleNamespace(received_messages=[])] * 3
+    with patch('google.cloud.pubsub_v1.PublisherClient'), \
+         patch('google.cloud.pubsub_v1.SubscriberClient', return_value=subscriber):
+        queue = PubSubWorkQueue('project', 'work', 'work-sub', ack_deadline_seconds=120, extend_every_seconds=0.01)
+
+    def slow_unit(*args, **kwargs):
+        time.sleep(0.1)
+        return 5
+
+    # --- Act ---
+    with patch('pos_poller.coordinator.sync_endpoint', side_effect=slow_unit):
+        result = run_worker(queue, worker_id='worker-1')
+    extensions = subscriber.modify_ack_deadline.call_count
+    time.sleep(0.05)
+
+    # --- Assert ---
+    assert result['completed'] == 1
+    assert extensions >= 3
+    assert all(call.kwargs['request']['ack_deadline_seconds'] == 120 for call in subscriber.modify_ack_deadline.call_args_list)
+    subscriber.acknowledge.assert_called_once()
+    # Renewal stops once the unit is acked.
+    assert subscriber.modify_ack_deadline.call_count == extensions
+
+def test_pubsub_queue_retries_empty_and_timed_out_pulls():
+    """Empty and timed-out pulls are retried before the worker treats the queue as drained."""
+    # --- Arrange ---
+    from google.api_core import exceptions as gcp_exceptions
+    [unit] = plan_work_units(['Customers'], days_back=0)
+    subscriber = MagicMock()
+    subscriber.pull.side_effect = [
+        gcp_exceptions.DeadlineExceeded("no messages"),
+        SimpleNamespace(received_messages=[]),
+        SimpleNamespace(received_messages=[SimpleNamespace(ack_id='ack-1', message=SimpleNamespace(data=json.dumps(unit).encode()))]),
+        gcp_exceptions.DeadlineExceeded("no messages"),
+        SimpleNamespace(received_messages=[]),
+        SimpleNamespace(received_messages=[]),
+    ]
+    with patch('google.cloud.pubsub_v1.PublisherClient'), \
+         patch('google.cloud.pubsub_v1.SubscriberClient', return_value=subscriber):
+        queue = PubSubWorkQueue('project', 'work', 'work-sub')
+
+    # --- Act ---
+    with patch('pos_poller.coordinator.sync_endpoint', return_value=5):
+        result = run_worker(queue, worker_id='worker-1')
+
+    # --- Assert ---
+    assert result['completed'] == 1
+    assert subscriber.pull.call_count == 6
+    subscriber.acknowledge.assert_called_once()
+
+def test_shard_cli_runs_its_share(capsys):
+    """The batch-job entry point runs only the units of its task index."""
+    with patch('pos_poller.coordinator.sync_endpoint', return_value=5) as mock_sync:
+        exit_code = main(['shard', '--endpoints', 'Checks', '--days-back', '20', '--chunk-days', '7',
+                          '--end-date', '2025-06-30', '--task-index', '1', '--task-count', '2'])
+
+    assert exit_code == 0
+    assert mock_sync.call_count == 1
+    dates = mock_sync.call_args.kwargs['target_dates']
+    assert dates[0].strftime('%Y-%m-%d') == '2025-06-23'
+    assert '"records_published": 5' in capsys.readouterr().out
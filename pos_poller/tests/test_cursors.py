@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from pos_poller.cursors import PageCursors
+from pos_poller.poller import sync_endpoint
+
+def _page(start: int, size: int) -> list:
+    return [{"Id": i} for i in range(start, start + size)]
+
+@pytest.fixture
+def mock_api():
+    with patch('pos_poller.poller.get_api_credentials', return_value=('site-1', 'token')), \
+         patch('pos_poller.poller.publish_records') as mock_publish, \
+         patch('pos_poller.poller.fetch_odata_page') as mock_fetch:
+        yield mock_fetch, mock_publish
+
+def test_failed_page_is_reported_with_its_cursor(mock_api):
+    """A page failure leaves the unit in failed_units with the $skip it stopped at."""
+    # --- Arrange ---
+    mock_fetch, _ = mock_api
+    mock_fetch.side_effect = [_page(0, 1000), _page(1000, 1000), requests.exceptions.RequestException("timeout")]
+    cursors = PageCursors("run-1")
+    report = {}
+
+    # --- Act ---
+    total = sync_endpoint('Customers', days_back=0, report=report, cursors=cursors)
+
+    # --- Assert ---
+    assert total == 2000
+    [failed] = report['failed_units']
+    assert failed['next_skip'] == 2000
+    assert failed['error'] == 'timeout'
+    [stored] = cursors.failed_units()
+    assert stored['next_skip'] == 2000
+    assert stored['last_id'] == '1999'
+    assert stored['records_published'] == 2000
+
+def test_resume_fetches_only_the_remaining_pages(mock_api):
+    """Resuming a failed unit starts at its cursor instead of re-fetching published pages."""
+    # --- Arrange ---
+    mock_fetch, mock_publish = mock_api
+    cursors = PageCursors("run-2")
+    mock_fetch.side_effect = [_page(0, 1000), requests.exceptions.RequestException("503")]
+    sync_endpoint('Customers', days_back=0, cursors=cursors)
+    mock_fetch.reset_mock(side_effect=True)
+    mock_publish.reset_mock()
+    mock_fetch.side_effect = [_page(1000, 1000), _page(2000, 10)]
+
+    # --- Act ---
+    report = {}
+    total = sync_endpoint('Customers', days_back=0, report=report, cursors=cursors)
+
+    # --- Assert ---
+    assert [call.args[1]['$skip'] for call in mock_fetch.call_args_list] == [1000, 2000]
+    assert mock_publish.call_count == 2
+    assert report['failed_units'] == []
+    assert total == 2010
+    assert cursors.failed_units() == []
+
+def test_completed_dates_are_skipped_on_resume(mock_api):
+    """Dates that already finished in the run are not fetched again."""
+    mock_fetch, _ = mock_api
+    cursors = PageCursors("run-3")
+    mock_fetch.side_effect = [_page(0, 5)]
+    sync_endpoint('Customers', days_back=0, cursors=cursors)
+
+    assert sync_endpoint('Customers', days_back=0, cursors=cursors) == 5
+    assert mock_fetch.call_count == 1
+
+def test_sync_summary_lists_retry_units_and_resume_continues_them(mock_api):
+    """/sync reports failed units with a run_id and POST /sync/resume finishes them from their cursors."""
+    from pos_poller.main import app
+    mock_fetch, _ = mock_api
+    mock_fetch.side_effect = [_page(0, 1000), requests.exceptions.RequestException("429")]
+
+    with app.test_client() as client:
+        response = client.post('/sync', json={'endpoints': ['Customers'], 'days_back': 0})
+        assert response.status_code == 207
+        body = response.get_json()
+        assert body['results']['Customers']['status'] == 'incomplete'
+        assert [(unit['endpoint'], unit['next_skip']) for unit in body['retry']] == [('Customers', 1000)]
+
+        mock_fetch.side_effect = [_page(1000, 3)]
+        resumed = client.post('/sync/resume', json={'run_id': body['run_id']})
+        assert resumed.status_code == 200
+        assert resumed.get_json()['results']['Customers'] == {'status': 'success', 'records_published': 1003}
+        assert mock_fetch.call_args.args[1]['$skip'] == 1000
+
+        # The run's cursors are discarded once nothing is left to resume.
+        assert client.post('/sync/resume', json={'run_id': body['run_id']}).status_code == 404
+        assert client.post('/sync/resume', json={}).status_code == 400
+
+def test_dead_lettered_page_fails_the_unit_at_that_page(mock_api):
+    """A page whose messages were dead-lettered is not counted as synced; resume fetches it again."""
+    # --- Arrange ---
+    from pos_poller.publisher import DeadLetteredError
+    mock_fetch, mock_publish = mock_api
+    mock_fetch.side_effect = [_page(0, 1000), _page(1000, 1000)]
+    mock_publish.side_effect = [None, DeadLetteredError("3 of 1000 pos_customers messages could not be published")]
+    cursors = PageCursors("run-3")
+    report = {}
+
+    # --- Act ---
+    total = sync_endpoint('Customers', days_back=0, report=report, cursors=cursors)
+
+    # --- Assert ---
+    assert total == 1000
+    [failed] = report['failed_units']
+    assert failed['next_skip'] == 1000
+    assert 'could not be published' in failed['error']
+    [stored] = cursors.failed_units()
+    assert stored['next_skip'] == 1000
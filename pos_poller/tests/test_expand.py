@@ -0,0 +1,67 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from pos_poller.coordinator import plan_work_units
+from pos_poller.poller import CHICAGO_TZ, drop_expanded_children, sync_endpoint
+
+@pytest.fixture
+def expand_on():
+    with patch('pos_poller.poller.EXPAND_CHILD_ENTITIES', True), \
+         patch('pos_poller.poller.get_api_credentials', return_value=('site-1', 'token')), \
+         patch('pos_poller.poller.publish_records') as mock_publish, \
+         patch('pos_poller.poller.fetch_odata_page') as mock_fetch:
+        yield mock_fetch, mock_publish
+
+def test_expanded_page_is_split_into_child_streams(expand_on):
+    """One ItemSales request carries its children; each collection is published to its own table stream."""
+    # --- Arrange ---
+    mock_fetch, mock_publish = expand_on
+    mock_fetch.return_value = [
+        {"Id": 1, "ItemSaleTaxes": {"results": [{"Id": 10, "ItemSaleId": 1}]},
+         "ItemSaleComponents": {"results": []}, "ItemSaleAdjustments": [{"Id": 30, "ItemSaleId": 1}]},
+        {"Id": 2, "ItemSaleTaxes": {"results": [{"Id": 11, "ItemSaleId": 2}, {"Id": 12, "ItemSaleId": 2}]},
+         "ItemSaleComponents": {"__deferred": {"uri": "ItemSales(2)/ItemSaleComponents"}}},
+    ]
+
+    # --- Act ---
+    records = sync_endpoint('ItemSales', 0, target_dates=[datetime.now(CHICAGO_TZ)])
+
+    # --- Assert ---
+    assert records == 2
+    params = mock_fetch.call_args[0][1]
+    assert params['$expand'] == "ItemSaleTaxes,ItemSaleComponents,ItemSaleAdjustments"
+    published = {call.args[1]: call.args[0] for call in mock_publish.call_args_list}
+    assert set(published) == {'ItemSales', 'ItemSaleTaxes', 'ItemSaleAdjustments'}
+    assert [record['Id'] for record in published['ItemSaleTaxes']] == [10, 11, 12]
+    assert published['ItemSaleAdjustments'] == [{"Id": 30, "ItemSaleId": 1}]
+    # Expanded collections are removed from the parents; a deferred link is left for the transform to drop.
+    assert "ItemSaleTaxes" not in published['ItemSales'][0]
+    assert "__deferred" in published['ItemSales'][1]["ItemSaleComponents"]
+
+def test_child_passes_are_skipped_only_with_their_parent(expand_on):
+    """Child endpoints are dropped when their parent is synced; on their own they still run."""
+    # --- Act & Assert ---
+    assert drop_expanded_children(['Checks', 'ItemSaleTaxes', 'ItemSales']) == ['Checks', 'ItemSales']
+    assert drop_expanded_children(['ItemSaleTaxes']) == ['ItemSaleTaxes']
+    units = plan_work_units(['ItemSales', 'ItemSaleComponents'], days_back=0)
+    assert {unit['endpoint'] for unit in units} == {'ItemSales'}
+    with patch('pos_poller.poller.EXPAND_CHILD_ENTITIES', False):
+        assert drop_expanded_children(['ItemSales', 'ItemSaleTaxes']) == ['ItemSales', 'ItemSaleTaxes']
+
+def test_endpoint_with_expanded_children_is_never_probed(expand_on):
+    """The parent's signature says nothing about its children, so every run pages the date."""
+    # --- Arrange ---
+    mock_fetch, _ = expand_on
+    mock_fetch.return_value = [{"Id": 1, "ItemSaleTaxes": {"results": [{"Id": 10, "ItemSaleId": 1}]}}]
+    today = datetime.now(CHICAGO_TZ)
+
+    # --- Act ---
+    with patch('pos_poller.poller.fetch_odata_probe', return_value={'record_count': 1}) as mock_probe:
+        sync_endpoint('ItemSales', 0, target_dates=[today], probe=True)
+        sync_endpoint('ItemSales', 0, target_dates=[today], probe=True)
+
+    # --- Assert ---
+    mock_probe.assert_not_called()
+    assert mock_fetch.call_count == 2
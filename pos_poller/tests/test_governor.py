@@ -0,0 +1,170 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from pos_poller.governor import AimdLimiter, ApiGovernor, parse_retry_after
+
+class SimulatedApi:
+    """
+    A local OData stand-in with a fixed capacity: requests beyond `capacity`
+    concurrent ones get a 429, optionally with a Retry-After header.
+    """
+
+    def __init__(self, capacity: int, service_time: float = 0.01, retry_after: str = "0"):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.served = 0
+        self.throttled = 0
+        lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    api.in_flight += 1
+                    over = api.in_flight > api.capacity
+                    api.max_in_flight = max(api.max_in_flight, api.in_flight)
+                try:
+                    if over:
+                        with lock:
+                            api.throttled += 1
+                        self.send_response(429)
+                        if retry_after is not None:
+                            self.send_header("Retry-After", retry_after)
+                        self.end_headers()
+                        return
+                    threading.Event().wait(service_time)
+                    body = b'{"d": []}'
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    with lock:
+                        api.served += 1
+                finally:
+                    with lock:
+                        api.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/Checks"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def simulated_api():
+    apis = []
+
+    def start(**kwargs):
+        api = SimulatedApi(**kwargs)
+        apis.append(api)
+        return api
+
+    yield start
+    for api in apis:
+        api.close()
+
+def _get(governor: ApiGovernor, session: requests.Session, url: str) -> requests.Response:
+    return governor.send(session, session.prepare_request(requests.Request('GET', url)), timeout=5)
+
+def test_aimd_limiter_increases_additively_and_halves_on_overload():
+    limiter = AimdLimiter(initial_limit=4, max_limit=8)
+
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(overloaded=False)
+    assert limiter.limit == pytest.approx(4.93, abs=0.01)
+
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == pytest.approx(2.46, abs=0.01)
+
+def test_parse_retry_after_accepts_seconds_and_http_dates():
+    from datetime import datetime, timezone
+    now = datetime(2025, 6, 30, 12, 0, 0, tzinfo=timezone.utc)
+
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Mon, 30 Jun 2025 12:00:30 GMT", now=now) == 30.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+def test_retry_after_pauses_the_host_before_retrying(simulated_api):
+    """A 429 with Retry-After: 3 makes the governor wait 3 seconds before the retry succeeds."""
+    # --- Arrange ---
+    api = simulated_api(capacity=0, retry_after="3")
+    slept = []
+    clock = [0.0]
+
+    def fake_sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+        api.capacity = 1  # The upstream recovers while we wait.
+
+    governor = ApiGovernor(clock=lambda: clock[0], sleep=fake_sleep)
+
+    # --- Act ---
+    with requests.Session() as session:
+        response = _get(governor, session, api.url)
+
+    # --- Assert ---
+    assert response.status_code == 200
+    assert slept == [3.0]
+    assert governor.limiter(f"127.0.0.1:{api.server.server_port}").limit == pytest.approx(2.5)
+
+def test_governor_converges_below_upstream_capacity(simulated_api):
+    """
+    With many concurrent workers against a server that accepts only 3 requests
+    at a time, every request eventually succeeds and the limit backs off from its ceiling.
+    """
+    # --- Arrange ---
+    api = simulated_api(capacity=3, service_time=0.02, retry_after="0")
+    governor = ApiGovernor(initial_concurrency=8, max_concurrency=8, max_throttle_retries=50)
+    statuses = []
+    lock = threading.Lock()
+
+    def worker():
+        with requests.Session() as session:
+            for _ in range(10):
+                status = _get(governor, session, api.url).status_code
+                with lock:
+                    statuses.append(status)
+
+    # --- Act ---
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    # --- Assert ---
+    limiter = governor.limiter(f"127.0.0.1:{api.server.server_port}")
+    assert statuses == [200] * 80
+    assert api.throttled > 0
+    assert limiter.limit < 8
+    assert limiter.in_flight == 0
+
+def test_shared_token_bucket_spaces_requests(simulated_api):
+    api = simulated_api(capacity=10)
+    slept = []
+    clock = [0.0]
+
+    def fake_sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+
+    governor = ApiGovernor(rate_limit=2, clock=lambda: clock[0], sleep=fake_sleep)
+
+    with requests.Session() as session:
+        for _ in range(4):
+            assert _get(governor, session, api.url).status_code == 200
+
+    # Two requests fit the initial burst; the next two each wait half a second.
+    assert slept == [0.5, 0.5]
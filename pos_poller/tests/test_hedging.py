@@ -0,0 +1,78 @@
+import threading
+import time
+
+from pos_poller.hedging import HedgeBudget, Hedger, LatencyTracker
+
+
+def make_hedger(ratio: float = 1.0, burst: float = 10.0) -> Hedger:
+    tracker = LatencyTracker(percentile=0.95, min_samples=5, min_delay=0.05)
+    for _ in range(20):
+        tracker.record("Checks", 0.01)
+    return Hedger(tracker, HedgeBudget(ratio=ratio, burst=burst), max_workers=4)
+
+
+class StallingSend:
+    """The first call stalls until released; later calls answer at once."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            attempt = self.calls
+        if attempt == 1:
+            self.release.wait(5)
+        return f"attempt-{attempt}"
+
+
+def test_slow_request_is_hedged_and_the_first_response_wins():
+    # --- Arrange ---
+    hedger = make_hedger()
+    send = StallingSend()
+    discarded = []
+
+    # --- Act ---
+    started = time.perf_counter()
+    result = hedger.run("Checks", send, discard=discarded.append)
+    elapsed = time.perf_counter() - started
+    send.release.set()
+    hedger._executor.shutdown(wait=True)
+
+    # --- Assert ---
+    assert result == "attempt-2"
+    assert elapsed < 2
+    assert send.calls == 2
+    # The stalled primary's response is released once it finally arrives.
+    assert discarded == ["attempt-1"]
+
+
+def test_hedges_are_capped_by_the_budget():
+    # --- Arrange ---
+    hedger = make_hedger(ratio=0.0, burst=0.0)
+    send = StallingSend()
+    threading.Timer(0.3, send.release.set).start()
+
+    # --- Act ---
+    result = hedger.run("Checks", send)
+
+    # --- Assert ---
+    assert result == "attempt-1"
+    assert send.calls == 1
+
+
+def test_endpoint_without_enough_samples_is_not_hedged():
+    # --- Arrange ---
+    hedger = Hedger(LatencyTracker(min_samples=5, min_delay=0.01), HedgeBudget(ratio=1.0), max_workers=4)
+    send = StallingSend()
+    threading.Timer(0.2, send.release.set).start()
+
+    # --- Act ---
+    result = hedger.run("Payments", send)
+
+    # --- Assert ---
+    assert result == "attempt-1"
+    assert send.calls == 1
+    assert hedger.tracker.hedge_delay("Payments") is None
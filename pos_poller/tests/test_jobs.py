@@ -0,0 +1,145 @@
+from unittest.mock import patch
+
+import pytest
+
+from pos_poller import jobs
+from pos_poller.store import state_db
+
+def _fake_sync(records_per_date: int, fail_after: int = None):
+    """Builds a sync_endpoint stand-in that reports progress for each requested date."""
+    calls = []
+
+    def fake_sync_endpoint(endpoint, days_back, target_dates=None, progress_callback=None, **kwargs):
+        calls.append((endpoint, list(target_dates)))
+        for i, target_date in enumerate(target_dates):
+            if fail_after is not None and i == fail_after:
+                raise RuntimeError("instance restarted")
+            progress_callback(target_date, records_per_date)
+        return records_per_date * len(target_dates)
+
+    return fake_sync_endpoint, calls
+
+def test_job_reports_per_date_progress():
+    """A completed job reports every (endpoint, date) unit with its record count."""
+    fake_sync, calls = _fake_sync(records_per_date=10)
+    job_id = jobs.create_job(['Checks', 'Payments'], days_back=2)
+
+    with patch('pos_poller.jobs.sync_endpoint', side_effect=fake_sync):
+        jobs.run_job(job_id)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'completed'
+    assert job['progress'] == {'completed_units': 6, 'total_units': 6}
+    assert job['records_published'] == 60
+    assert job['endpoints']['Checks']['records_published'] == 30
+    assert len(job['endpoints']['Payments']['dates']) == 3
+    assert all(d['status'] == 'done' for d in job['endpoints']['Checks']['dates'].values())
+
+def test_interrupted_job_resumes_only_remaining_dates():
+    """Resuming a job re-runs only the units that did not finish."""
+    job_id = jobs.create_job(['ItemSales'], days_back=4)
+    failing_sync, _ = _fake_sync(records_per_date=5, fail_after=2)
+    with patch('pos_poller.jobs.sync_endpoint', side_effect=failing_sync):
+        jobs.run_job(job_id)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'completed_with_errors'
+    assert job['progress'] == {'completed_units': 2, 'total_units': 5}
+
+    resumed_sync, calls = _fake_sync(records_per_date=5)
+    with patch('pos_poller.jobs.sync_endpoint', side_effect=resumed_sync), \
+         patch('pos_poller.jobs.submit_job', side_effect=jobs.run_job):
+        assert jobs.resume_job(job_id)
+
+    assert len(calls) == 1
+    assert len(calls[0][1]) == 3
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'completed'
+    assert job['records_published'] == 25
+
+def test_job_runs_inside_a_sync_span():
+    """A background job opens a sync span, so its endpoint spans join one trace."""
+    # --- Arrange ---
+    from pos_common import tracing
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+    job_id = jobs.create_job(['Customers'], days_back=0)
+
+    # --- Act ---
+    try:
+        with patch('pos_poller.poller.publish_records'), \
+             patch('pos_poller.poller.fetch_odata_page', return_value=[{"Id": 1}]):
+            jobs.run_job(job_id)
+    finally:
+        tracing.set_exporter(None)
+
+    # --- Assert ---
+    spans = {span['name']: span for span in exporter.spans}
+    assert spans['sync']['attributes'] == {'run_id': job_id}
+    assert spans['endpoint']['parent_id'] == spans['sync']['span_id']
+
+def _hand_to_other_instance(job_id: str, lease_expires_at: str) -> None:
+    """Makes a job look as if another instance owns it, with the given lease expiry."""
+    with state_db() as conn:
+        conn.execute(
+            "UPDATE sync_jobs SET status = 'running', owner = 'other-instance', lease_expires_at = ? WHERE job_id = ?",
+            (lease_expires_at, job_id),
+        )
+        conn.execute("UPDATE sync_job_units SET status = 'running' WHERE job_id = ?", (job_id,))
+
+def test_resume_incomplete_jobs_picks_up_queued_jobs():
+    """Jobs left by a previous instance whose lease expired are re-submitted on startup."""
+    job_id = jobs.create_job(['Customers'], days_back=0)
+    _hand_to_other_instance(job_id, lease_expires_at='2000-01-01T00:00:00+00:00')
+
+    with patch('pos_poller.jobs.submit_job') as mock_submit:
+        assert jobs.resume_incomplete_jobs() == [job_id]
+    mock_submit.assert_called_once_with(job_id)
+
+    with state_db() as conn:
+        owner = conn.execute("SELECT owner FROM sync_jobs WHERE job_id = ?", (job_id,)).fetchone()['owner']
+    assert owner == jobs.OWNER_ID
+
+def test_job_with_a_live_lease_is_not_resumed():
+    """A job another instance is still running is neither re-submitted nor reset."""
+    # --- Arrange ---
+    job_id = jobs.create_job(['Checks'], days_back=1)
+    _hand_to_other_instance(job_id, lease_expires_at='2999-01-01T00:00:00+00:00')
+
+    # --- Act ---
+    with patch('pos_poller.jobs.submit_job') as mock_submit:
+        assert jobs.resume_incomplete_jobs() == []
+        with pytest.raises(jobs.JobLeaseHeldError):
+            jobs.resume_job(job_id)
+
+    # --- Assert ---
+    mock_submit.assert_not_called()
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'running'
+    assert all(d['status'] == 'running' for d in job['endpoints']['Checks']['dates'].values())
+
+def test_resume_route_rejects_a_job_owned_elsewhere():
+    """POST /sync/<job_id>/resume answers 409 while another instance holds the job."""
+    from pos_poller.main import app
+
+    job_id = jobs.create_job(['Checks'], days_back=0)
+    _hand_to_other_instance(job_id, lease_expires_at='2999-01-01T00:00:00+00:00')
+
+    with app.test_client() as client, patch('pos_poller.jobs.submit_job') as mock_submit:
+        assert client.post(f'/sync/{job_id}/resume').status_code == 409
+    mock_submit.assert_not_called()
+
+def test_async_sync_request_returns_job_id():
+    """POST /sync with async=true returns 202 and the job becomes pollable."""
+    from pos_poller.main import app
+
+    with app.test_client() as client, patch('pos_poller.main.submit_job') as mock_submit:
+        response = client.post('/sync', json={'async': True, 'days_back': 1, 'endpoints': ['Checks']})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        mock_submit.assert_called_once_with(job_id)
+
+        status = client.get(f'/sync/{job_id}')
+        assert status.status_code == 200
+        assert status.get_json()['progress'] == {'completed_units': 0, 'total_units': 2}
+        assert client.get('/sync/does-not-exist').status_code == 404
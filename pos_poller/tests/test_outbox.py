@@ -0,0 +1,123 @@
+import json
+from concurrent.futures import Future
+
+from pos_poller.store import get_state_db
+from pos_poller.outbox import Outbox, OutboxDrainer
+
+
+class OutageClient:
+    """A PublisherClient stand-in that fails every publish while `down` is set."""
+
+    def __init__(self, down: bool = False):
+        self.down = down
+        self.published = []
+
+    def publish(self, topic_path, data, **attributes):
+        future = Future()
+        if self.down:
+            future.set_exception(RuntimeError("503 service unavailable"))
+        else:
+            self.published.append((data, attributes))
+            future.set_result("id")
+        return future
+
+
+def test_outbox_keeps_messages_through_an_outage_and_resumes_after_restart():
+    """Messages stay stored while Pub/Sub is down and a new drainer publishes them in order."""
+    # --- Arrange ---
+    client = OutageClient(down=True)
+    drainer = OutboxDrainer(Outbox(), lambda: client, batch_size=2)
+    drainer.enqueue([("topic", "pos_checks", f"m{i}".encode(), {"content_encoding": "identity"}) for i in range(3)])
+
+    # --- Act ---
+    during_outage = drainer.drain_once()
+    # The process restarts: a fresh connection and drainer, the same database file.
+    get_state_db().close()
+    get_state_db.cache_clear()
+    client.down = False
+    restarted = OutboxDrainer(Outbox(), lambda: client, batch_size=2)
+    totals = restarted.drain(sleep=lambda seconds: None)
+
+    # --- Assert ---
+    assert during_outage == {"published": 0, "failed": 2, "dead_lettered": 0}
+    assert totals == {"published": 3, "failed": 0, "dead_lettered": 0}
+    assert [data for data, _ in client.published] == [b"m0", b"m1", b"m2"]
+    assert client.published[0][1] == {"content_encoding": "identity"}
+    assert restarted.outbox.pending() == 0
+
+
+def test_messages_that_keep_failing_are_dead_lettered(tmp_path):
+    # --- Arrange ---
+    path = tmp_path / "dlq.jsonl"
+    drainer = OutboxDrainer(Outbox(), lambda: OutageClient(down=True), max_attempts=2, dead_letter_path=str(path))
+    drainer.enqueue([("topic", "pos_checks", b"bad", {})])
+
+    # --- Act ---
+    totals = drainer.drain(sleep=lambda seconds: None)
+
+    # --- Assert ---
+    assert totals == {"published": 0, "failed": 1, "dead_lettered": 1}
+    assert drainer.outbox.pending() == 0
+    entry = json.loads(path.read_text().splitlines()[0])
+    assert (entry["table"], entry["attempts"]) == ("pos_checks", 2)
+
+
+def test_publish_records_returns_once_the_page_is_in_the_outbox(monkeypatch):
+    """With the outbox on, a page is stored without touching Pub/Sub; the drainer publishes it later."""
+    # --- Arrange ---
+    from unittest.mock import patch
+    from pos_poller.poller import publish_records
+    monkeypatch.setenv("PUBLISH_OUTBOX", "true")
+    client = OutageClient(down=True)
+    drainer = OutboxDrainer(Outbox(), lambda: client)
+    records = [{"Id": 1, "ObjectId": "obj-1", "Amount": "10.50", "BusinessDate": "/Date(1719705600000)/"}]
+
+    with patch('pos_poller.poller.get_outbox_drainer', return_value=drainer), \
+         patch('pos_poller.poller.get_publisher_client') as mock_get_publisher:
+        mock_get_publisher.return_value.topic_path.return_value = "projects/p/topics/pos"
+        # --- Act ---
+        publish_records(records, 'Paidouts', 'Paidouts_20250630_120000')
+
+    # --- Assert ---
+    mock_get_publisher.return_value.publish.assert_not_called()
+    batch = drainer.outbox.read_batch(10)
+    assert len(batch) == 1
+    assert batch[0]['table_name'] == 'pos_paidouts'
+    assert json.loads(batch[0]['data'])['data']['object_id'] == 'obj-1'
+
+
+def test_unit_completes_only_once_its_outboxed_pages_are_published(monkeypatch):
+    """The cursor stays at the first unconfirmed page until the drainer has published it."""
+    # --- Arrange ---
+    from unittest.mock import patch
+    from pos_poller.cursors import PageCursors
+    from pos_poller.poller import sync_endpoint
+    monkeypatch.setenv("PUBLISH_OUTBOX", "true")
+    client = OutageClient(down=True)
+    drainer = OutboxDrainer(Outbox(), lambda: client, idle_seconds=0.01, initial_backoff=0.01, max_backoff=0.01)
+    drainer.start()
+    cursors = PageCursors("run-outbox")
+    pages = [[{"Id": i} for i in range(1000)], [{"Id": 1000}]]
+
+    with patch('pos_poller.poller.get_api_credentials', return_value=('site-1', 'token')), \
+         patch('pos_poller.poller.get_outbox_drainer', return_value=drainer), \
+         patch('pos_poller.poller.get_publisher_client') as mock_get_publisher, \
+         patch('pos_poller.poller.OUTBOX_CONFIRM_SECONDS', 0.2), \
+         patch('pos_poller.poller.fetch_odata_page', side_effect=pages + pages):
+        mock_get_publisher.return_value.topic_path.return_value = "projects/p/topics/pos"
+
+        # --- Act ---
+        during_outage = {}
+        sync_endpoint('Customers', days_back=0, report=during_outage, cursors=cursors)
+        client.down = False
+        after_recovery = {}
+        sync_endpoint('Customers', days_back=0, report=after_recovery, cursors=cursors)
+    drainer.stop()
+
+    # --- Assert ---
+    [failed] = during_outage['failed_units']
+    assert (failed['next_skip'], failed['records_published']) == (0, 0)
+    assert 'not confirmed' in failed['error']
+    assert after_recovery['failed_units'] == []
+    assert cursors.failed_units() == []
+    assert drainer.outbox.pending() == 0
@@ -2,10 +2,13 @@ import pytest
 from unittest.mock import patch, MagicMock
 from datetime import datetime, timezone
 import requests
+import gzip
+import json
 
 # Import the functions we want to test
-from pos_poller.poller import transform_odata_record, sync_endpoint
+from pos_poller.poller import transform_odata_record, sync_endpoint, publish_records
 from pos_poller.utils import to_snake_case, parse_microsoft_date
+from concurrent.futures import Future
 
 # --- Unit Tests for Utility Functions ---
 
@@ -122,7 +125,9 @@ def test_sync_endpoint_single_page(mock_sync_dependencies):
     mock_fetch.assert_called_once()
     
     # Check that our mock publish function was called exactly once with the correct data.
-    mock_publish.assert_called_once_with(sample_records, 'Checks', mock_publish.call_args[0][2]) # Arg 2 is the dynamic sync_id
+    # Arg 2 is the dynamic sync_id; stats_key is unique to the call.
+    mock_publish.assert_called_once_with(sample_records, 'Checks', mock_publish.call_args[0][2],
+                                         stats_key=mock_publish.call_args.kwargs['stats_key'])
 
 def test_sync_endpoint_with_pagination(mock_sync_dependencies):
     """
@@ -173,4 +178,63 @@ def test_sync_endpoint_api_error(mock_sync_dependencies):
     mock_fetch.assert_called_once()
     
     # CRUCIALLY, the publish function should never have been called.
-    mock_publish.assert_not_called()
\ No newline at end of file
+    mock_publish.assert_not_called()
+def _published(*args, **kwargs) -> Future:
+    """A Pub/Sub publish future that has already succeeded."""
+    future = Future()
+    future.set_result("message-id")
+    return future
+
+def test_publish_records_compresses_and_reports_ratio():
+    """
+    Tests that with a codec configured, message bodies are compressed, the codec
+    is sent as an attribute, and the per-table ratio lands in the sync report.
+    """
+    # --- Arrange ---
+    records = [{"Id": i, "ObjectId": f"obj-{i}", "NetSales": "10.50", "BusinessDate": "/Date(1719705600000)/"} for i in range(20)]
+
+    with patch('pos_poller.poller.PUBLISH_COMPRESSION', 'gzip'), \
+         patch('pos_poller.poller.get_publisher_client') as mock_get_publisher, \
+         patch('pos_poller.poller.get_api_credentials', return_value=('dummy_site_id', 'dummy_token')), \
+         patch('pos_poller.poller.fetch_odata_page', return_value=records):
+        mock_publisher = mock_get_publisher.return_value
+        mock_publisher.publish.side_effect = _published
+
+        # --- Act ---
+        report = {}
+        sync_endpoint('Paidouts', days_back=0, report=report)
+
+    # --- Assert ---
+    assert mock_publisher.publish.call_count == 20
+    body = mock_publisher.publish.call_args.args[1]
+    assert mock_publisher.publish.call_args.kwargs == {'content_encoding': 'gzip'}
+    assert json.loads(gzip.decompress(body))['table_name'] == 'pos_paidouts'
+    stats = report['compression']['pos_paidouts']
+    assert stats['codec'] == 'gzip'
+    assert stats['raw_bytes'] > stats['encoded_bytes']
+    assert stats['compression_ratio'] == round(stats['raw_bytes'] / stats['encoded_bytes'], 2)
+
+def test_publish_records_binary_encoding():
+    """
+    Tests that with PUBLISH_ENCODING=binary the poller publishes schema-derived
+    row bodies with the content_type and fingerprint attributes.
+    """
+    # --- Arrange ---
+    from pos_processor.decoding import decode_message_data
+    records = [{"Id": 1, "ObjectId": "obj-1", "Amount": "10.50", "BusinessDate": "/Date(1719705600000)/"}]
+
+    with patch('pos_poller.poller.PUBLISH_ENCODING', 'binary'), \
+         patch('pos_poller.poller.get_publisher_client') as mock_get_publisher:
+        mock_publisher = mock_get_publisher.return_value
+        mock_publisher.publish.side_effect = _published
+
+        # --- Act ---
+        publish_records(records, 'Paidouts', 'Paidouts_20250630_120000')
+
+    # --- Assert ---
+    body = mock_publisher.publish.call_args.args[1]
+    attributes = mock_publisher.publish.call_args.kwargs
+    assert attributes['content_type'] == 'application/x-pos-row'
+    message = decode_message_data(body, attributes)
+    assert message['sync_id'] == 'Paidouts_20250630_120000'
+    assert message['data']['amount'] == 10.5
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from pos_poller.poller import CHICAGO_TZ, sync_endpoint
+from pos_poller.probes import SignatureStore, build_probe_params, parse_probe_response
+
+@pytest.fixture
+def mock_api():
+    with patch('pos_poller.poller.get_api_credentials', return_value=('site-1', 'token')), \
+         patch('pos_poller.poller.publish_records'), \
+         patch('pos_poller.poller.fetch_odata_probe') as mock_probe, \
+         patch('pos_poller.poller.fetch_odata_page') as mock_fetch:
+        mock_fetch.return_value = [{"Id": 1}, {"Id": 2}]
+        yield mock_probe, mock_fetch
+
+def test_probe_query_and_response():
+    """The probe asks for the count and the latest record; v2 and v4 count formats are both read."""
+    # --- Act ---
+    params = build_probe_params({'$filter': "BusinessDate eq datetime'2024-07-01'", '$skip': 2000, '$top': 1000}, {})
+
+    # --- Assert ---
+    assert params == {
+        '$filter': "BusinessDate eq datetime'2024-07-01'",
+        '$top': 1,
+        '$orderby': "ModifiedOn desc,Id desc",
+        '$inlinecount': 'allpages',
+        '$select': "Id,ModifiedOn",
+    }
+    v2 = {'d': {'__count': '42', 'results': [{'Id': 7, 'ModifiedOn': '/Date(1)/'}]}}
+    assert parse_probe_response(v2, {}) == {'record_count': 42, 'max_modified': '/Date(1)/', 'last_id': '7'}
+    assert parse_probe_response({'@odata.count': 0, 'value': []}, {})['record_count'] == 0
+    with pytest.raises(ValueError):
+        parse_probe_response({'d': []}, {})
+
+def test_unchanged_date_is_skipped_and_changed_date_refetched(mock_api):
+    """A date is paged once; it is skipped while its signature holds and re-fetched when it moves."""
+    # --- Arrange ---
+    mock_probe, mock_fetch = mock_api
+    today = datetime.now(CHICAGO_TZ)
+    signature = {'record_count': 2, 'max_modified': '/Date(1)/', 'last_id': '2'}
+    mock_probe.return_value = signature
+
+    # --- Act & Assert ---
+    assert sync_endpoint('Checks', 0, target_dates=[today], probe=True) == 2
+    report = {}
+    assert sync_endpoint('Checks', 0, target_dates=[today], probe=True, report=report) == 0
+    assert mock_fetch.call_count == 1
+    assert (report['pages_fetched'], report['probe_skipped']) == (0, 1)
+
+    mock_probe.return_value = dict(signature, max_modified='/Date(2)/')
+    assert sync_endpoint('Checks', 0, target_dates=[today], probe=True) == 2
+    assert mock_fetch.call_count == 2
+    assert mock_probe.call_count == 3
+
+def test_old_synced_date_is_finalized_without_a_probe(mock_api):
+    """Past the close-out age a synced date is finalized; a failed probe falls back to a full sync."""
+    # --- Arrange ---
+    mock_probe, mock_fetch = mock_api
+    old_date = datetime.now(CHICAGO_TZ) - timedelta(days=45)
+    mock_probe.side_effect = ValueError("no count")
+
+    # --- Act ---
+    first = sync_endpoint('Checks', 0, target_dates=[old_date], probe=True)
+    SignatureStore().save('Checks', 'site-1', old_date.strftime('%Y-%m-%d'), {'record_count': 2})
+    second = sync_endpoint('Checks', 0, target_dates=[old_date], probe=True)
+
+    # --- Assert ---
+    assert (first, second) == (2, 0)
+    assert mock_probe.call_count == 1
+    assert mock_fetch.call_count == 1
+    assert SignatureStore().get('Checks', 'site-1', old_date.strftime('%Y-%m-%d'))['finalized'] == 1
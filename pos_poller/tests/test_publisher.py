@@ -0,0 +1,69 @@
+import json
+import threading
+from concurrent.futures import Future
+
+from pos_poller.publisher import StreamingPublisher, PublishTracker, replay_dead_letters
+
+class FlakyClient:
+    """A PublisherClient stand-in that fails the first attempts of chosen messages, completing on another thread."""
+
+    def __init__(self, failures: dict):
+        self.failures = dict(failures)
+        self.attempts = []
+        self.lock = threading.Lock()
+
+    def publish(self, topic_path, data, **attributes):
+        with self.lock:
+            self.attempts.append(data)
+            fail = self.failures.get(data, 0) > 0
+            if fail:
+                self.failures[data] -= 1
+        future = Future()
+        if fail:
+            threading.Timer(0.001, future.set_exception, [RuntimeError("deadline exceeded")]).start()
+        else:
+            threading.Timer(0.001, future.set_result, ["id"]).start()
+        return future
+
+def test_failed_messages_are_retried_individually(tmp_path):
+    """One failing message is re-sent on its own; the others are published once and the page still completes."""
+    # --- Arrange ---
+    client = FlakyClient({b"m2": 2})
+    publisher = StreamingPublisher(lambda: client, initial_backoff=0.001, dead_letter_path=str(tmp_path / "dlq.jsonl"))
+    tracker = PublishTracker()
+
+    # --- Act ---
+    for body in (b"m1", b"m2", b"m3"):
+        publisher.publish("topic", body, {}, "pos_checks", tracker)
+    assert tracker.wait(timeout=5)
+
+    # --- Assert ---
+    assert tracker.published == 3
+    assert tracker.dead_lettered == 0
+    assert sorted(client.attempts) == [b"m1", b"m2", b"m2", b"m2", b"m3"]
+    assert not (tmp_path / "dlq.jsonl").exists()
+
+def test_exhausted_messages_are_dead_lettered_and_replayable(tmp_path):
+    """A message that keeps failing goes to the dead-letter file with its attributes and can be replayed."""
+    # --- Arrange ---
+    path = tmp_path / "dlq.jsonl"
+    client = FlakyClient({b"bad": 3})
+    publisher = StreamingPublisher(lambda: client, max_attempts=3, initial_backoff=0.001, dead_letter_path=str(path))
+    tracker = PublishTracker()
+
+    # --- Act ---
+    publisher.publish("topic", b"ok", {}, "pos_checks", tracker)
+    publisher.publish("topic", b"bad", {"content_encoding": "gzip"}, "pos_checks", tracker)
+    assert tracker.wait(timeout=5)
+
+    # --- Assert ---
+    assert (tracker.published, tracker.dead_lettered) == (1, 1)
+    [entry] = [json.loads(line) for line in path.read_text().splitlines()]
+    assert entry["attempts"] == 3
+    assert entry["attributes"] == {"content_encoding": "gzip"}
+    assert entry["error"] == "deadline exceeded"
+
+    result = replay_dead_letters(publisher, str(path))
+    assert result == {"replayed": 1, "published": 1, "dead_lettered": 0}
+    assert client.attempts[-1] == b"bad"
+    assert not path.exists()
@@ -0,0 +1,102 @@
+from unittest.mock import patch
+
+import pytest
+
+from pos_poller.cursors import PageCursors
+from pos_poller.poller import DEADLINE_DEFERRED
+from pos_poller.scheduler import CostModel, Deadline, plan_units, run_scheduled_sync
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def mock_api():
+    with patch('pos_poller.poller.get_api_credentials', return_value=('site-1', 'token')), \
+         patch('pos_poller.poller.publish_records'), \
+         patch('pos_poller.poller.fetch_odata_page') as mock_fetch:
+        yield mock_fetch
+
+def test_plan_puts_fresh_and_cheap_units_first():
+    """Recorded costs push old dates of a heavy endpoint behind today's cheap ones."""
+    # --- Arrange ---
+    model = CostModel()
+    model.record('ItemSales', pages=20, seconds=40.0)
+    model.record('Paidouts', pages=1, seconds=0.5)
+
+    # --- Act ---
+    plan = plan_units(['ItemSales', 'Paidouts'], days_back=2, model=model)
+
+    # --- Assert ---
+    order = [(unit['endpoint'], unit['age_days']) for unit in plan]
+    assert order[:3] == [('Paidouts', 0), ('Paidouts', 1), ('Paidouts', 2)]
+    assert order[3:] == [('ItemSales', 0), ('ItemSales', 1), ('ItemSales', 2)]
+    # Costs persist in the state DB for the next request.
+    assert CostModel().estimate('ItemSales') == pytest.approx(40.0)
+
+def test_deadline_defers_the_remaining_units_at_their_cursors(mock_api):
+    """Units that do not fit are deferred, and a running unit stops between pages when time runs out."""
+    # --- Arrange ---
+    clock = FakeClock()
+    model = CostModel()
+    model.record('Paidouts', pages=2, seconds=4.0)
+
+    def fetch(url, params, access_token=None):
+        clock.now += 2.0
+        return [{"Id": i} for i in range(params['$skip'], params['$skip'] + 1000)]
+
+    mock_api.side_effect = fetch
+    cursors = PageCursors("run-deadline")
+    deadline = Deadline(7.0, margin=0.0, clock=clock)
+
+    # --- Act ---
+    outcome = run_scheduled_sync(['Paidouts'], days_back=1, cursors=cursors, deadline=deadline, model=model)
+
+    # --- Assert ---
+    # Today's unit runs 3 pages (6s) before the next page would overrun; yesterday's never starts.
+    assert outcome['results']['Paidouts'] == {'status': 'incomplete', 'records_published': 3000}
+    deferred = {(unit['next_skip'], unit['error']) for unit in outcome['deferred_units']}
+    assert deferred == {(3000, DEADLINE_DEFERRED), (0, DEADLINE_DEFERRED)}
+    assert outcome['failed_units'] == []
+    assert sorted(unit['next_skip'] for unit in cursors.failed_units()) == [0, 3000]
+
+def test_cost_model_learns_only_from_units_that_paged():
+    """Probe-skipped and cursor-resumed units are not recorded; paged units record their real page count."""
+    # --- Arrange ---
+    model = CostModel()
+    outcomes = iter([
+        {'pages_fetched': 3, 'probe_skipped': 0, 'resumed': 0},
+        {'pages_fetched': 0, 'probe_skipped': 1, 'resumed': 0},
+        {'pages_fetched': 1, 'probe_skipped': 0, 'resumed': 1},
+    ])
+
+    def fake_sync(endpoint, days_back, report=None, **kwargs):
+        report.update(next(outcomes), failed_units=[], compression={})
+        return 2500
+
+    # --- Act ---
+    with patch('pos_poller.scheduler.sync_endpoint', side_effect=fake_sync), \
+         patch.object(model, 'record', wraps=model.record) as mock_record:
+        run_scheduled_sync(['Paidouts'], days_back=2, model=model)
+
+    # --- Assert ---
+    assert [call.args[:2] for call in mock_record.call_args_list] == [('Paidouts', 3)]
+
+def test_sync_deadline_checkpoints_work_for_resume(mock_api):
+    """/sync with a spent deadline defers everything with a run_id, and /sync/resume picks it up."""
+    from pos_poller.main import app
+    mock_api.return_value = [{"Id": 1}]
+
+    with app.test_client() as client:
+        response = client.post('/sync', json={'endpoints': ['Paidouts'], 'days_back': 0, 'deadline_seconds': 1})
+        body = response.get_json()
+        assert response.status_code == 207
+        assert body['deadline'] == {'seconds': 1, 'deferred_units': 1}
+        mock_api.assert_not_called()
+
+        resumed = client.post('/sync/resume', json={'run_id': body['run_id']})
+        assert resumed.get_json()['results']['Paidouts'] == {'status': 'success', 'records_published': 1}
+        assert client.post('/sync', json={'deadline_seconds': -1}).status_code == 400
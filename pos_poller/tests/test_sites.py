@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from pos_poller.sites import get_sites, run_multi_site_sync
+
+SITES = [
+    {"name": "downtown", "site_id": "site-a", "api_access_token": "token-a", "max_concurrency": 1},
+    {"name": "airport", "site_id": "site-b", "api_access_token": "token-b", "max_concurrency": 2},
+]
+
+@pytest.fixture
+def configured_sites(monkeypatch):
+    monkeypatch.setenv("SITES", json.dumps(SITES))
+    get_sites.cache_clear()
+    yield get_sites()
+    get_sites.cache_clear()
+
+def test_sites_are_served_round_robin_within_their_caps(configured_sites):
+    """Every site gets work from the start and none exceeds its max_concurrency."""
+    # --- Arrange ---
+    lock = threading.Lock()
+    in_flight = {"site-a": 0, "site-b": 0}
+    peak = {"site-a": 0, "site-b": 0}
+    started = []
+
+    def fake_sync(endpoint, days_back, site_id=None, access_token=None, report=None, **kwargs):
+        with lock:
+            started.append(site_id)
+            in_flight[site_id] += 1
+            peak[site_id] = max(peak[site_id], in_flight[site_id])
+        time.sleep(0.01)
+        with lock:
+            in_flight[site_id] -= 1
+        report['failed_units'] = []
+        return 5 if access_token == {"site-a": "token-a", "site-b": "token-b"}[site_id] else 0
+
+    # --- Act ---
+    with patch('pos_poller.sites.sync_endpoint', side_effect=fake_sync):
+        results = run_multi_site_sync(configured_sites, ['Checks', 'Customers'], days_back=2, max_workers=8)
+
+    # --- Assert ---
+    assert peak == {"site-a": 1, "site-b": 2}
+    assert set(started[:2]) == {"site-a", "site-b"}
+    # Two endpoints x three dates per site, each unit publishing 5 records with the site's own token.
+    assert results["downtown"]["records_published"] == 30
+    assert results["airport"]["endpoints"]["Customers"]["records_published"] == 15
+    assert results["airport"]["status"] == "success"
+
+def test_sync_reports_each_site(configured_sites):
+    """With SITES configured /sync polls every site with its own token and reports per site."""
+    from pos_poller.main import app
+
+    with patch('pos_poller.poller.publish_records'), \
+         patch('pos_poller.poller.fetch_odata_page') as mock_fetch:
+        mock_fetch.return_value = [{"Id": 1}]
+        with app.test_client() as client:
+            response = client.post('/sync', json={'endpoints': ['Customers'], 'days_back': 0})
+            rejected = client.post('/sync', json={'endpoints': ['Customers'], 'sites': ['uptown']})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['results']['Customers']['records_published'] == 2
+    assert {name: site['records_published'] for name, site in body['sites'].items()} == {'downtown': 1, 'airport': 1}
+    tokens = {call.kwargs['access_token'] for call in mock_fetch.call_args_list}
+    assert tokens == {'token-a', 'token-b'}
+    assert rejected.status_code == 400
+
+def test_deadline_defers_units_not_started_across_sites(configured_sites):
+    """Once the deadline passes no unit is started; the rest are deferred per site for a resume."""
+    # --- Arrange ---
+    from pos_poller.poller import DEADLINE_DEFERRED
+    from pos_poller.scheduler import Deadline
+
+    clock = [0.0]
+
+    def fake_sync(endpoint, days_back, report=None, should_stop=None, **kwargs):
+        # Every unit takes 10 seconds; the deadline is 15.
+        clock[0] += 10
+        report['failed_units'] = []
+        return 1
+
+    # --- Act ---
+    with patch('pos_poller.sites.sync_endpoint', side_effect=fake_sync):
+        results = run_multi_site_sync(configured_sites, ['Checks'], days_back=2, max_workers=1,
+                                      deadline=Deadline(15, margin=0, clock=lambda: clock[0]))
+
+    # --- Assert ---
+    assert sum(site['records_published'] for site in results.values()) == 2
+    deferred = [unit for site in results.values() for unit in site['failed_units']]
+    assert len(deferred) == 4
+    assert all(unit['error'] == DEADLINE_DEFERRED for unit in deferred)
+    assert {site['status'] for site in results.values()} == {'incomplete'}
+
+def test_sync_rejects_options_a_multi_site_or_async_sync_cannot_apply(configured_sites, monkeypatch):
+    """profile with several sites, and deadline_seconds or profile on async jobs, are refused instead of ignored."""
+    from pos_poller.main import app
+
+    with app.test_client() as client:
+        profiled = client.post('/sync', json={'endpoints': ['Customers'], 'profile': True})
+        monkeypatch.delenv("SITES")
+        async_deadline = client.post('/sync', json={'endpoints': ['Customers'], 'async': True, 'deadline_seconds': 30})
+        async_profile = client.post('/sync', json={'endpoints': ['Customers'], 'async': True, 'profile': True})
+
+    assert profiled.status_code == 400
+    assert async_deadline.status_code == 400
+    assert async_profile.status_code == 400
+
+def test_sites_report_their_own_compression_stats(configured_sites):
+    """Concurrent units started in the same second keep separate byte totals, summed per site and endpoint."""
+    # --- Arrange ---
+    from concurrent.futures import Future
+    from pos_poller.main import app
+
+    def published(*args, **kwargs):
+        future = Future()
+        future.set_result("message-id")
+        return future
+
+    records = [{"Id": i, "ObjectId": f"obj-{i}", "BusinessDate": "/Date(1719705600000)/"} for i in range(5)]
+
+    # --- Act ---
+    with patch('pos_poller.poller.PUBLISH_COMPRESSION', 'gzip'), \
+         patch('pos_poller.poller.get_publisher_client') as mock_get_publisher, \
+         patch('pos_poller.poller.fetch_odata_page', return_value=records):
+        mock_get_publisher.return_value.publish.side_effect = published
+        with app.test_client() as client:
+            body = client.post('/sync', json={'endpoints': ['Paidouts'], 'days_back': 0}).get_json()
+
+    # --- Assert ---
+    downtown = body['sites']['downtown']['endpoints']['Paidouts']['compression']['pos_paidouts']
+    airport = body['sites']['airport']['endpoints']['Paidouts']['compression']['pos_paidouts']
+    assert downtown['raw_bytes'] == airport['raw_bytes'] > 0
+    total = body['results']['Paidouts']['compression']['pos_paidouts']
+    assert total['raw_bytes'] == downtown['raw_bytes'] + airport['raw_bytes']
+    assert total['codec'] == 'gzip'
+
+def test_multi_site_units_join_the_sync_trace(configured_sites):
+    """Endpoint spans run on the worker pool are children of the request's sync span."""
+    # --- Arrange ---
+    from pos_common import tracing
+    from pos_poller import poller
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+
+    # --- Act ---
+    try:
+        with patch('pos_poller.poller.publish_records'), \
+             patch('pos_poller.poller.fetch_odata_page', return_value=[{"Id": 1}]):
+            with poller.TRACER.span("sync", run_id="run-1") as sync_span:
+                run_multi_site_sync(configured_sites, ['Customers'], days_back=0, max_workers=4)
+    finally:
+        tracing.set_exporter(None)
+
+    # --- Assert ---
+    endpoint_spans = [span for span in exporter.spans if span['name'] == 'endpoint']
+    assert len(endpoint_spans) == 2
+    assert all(span['parent_id'] == sync_span.span_id for span in endpoint_spans)
+    assert {span['trace_id'] for span in exporter.spans} == {sync_span.trace_id}
@@ -21,4 +21,16 @@ NORMALIZATION_RULES = {
         "modified_on": "DATETIME"
     }
     # Add other table-specific rules here as needed.
-}
\ No newline at end of file
+}
+# Daily per-site aggregates kept by pos_processor/rollups.py when ROLLUPS_ENABLED is true:
+# source table -> summary table and the summed measures. Every summary table also has row_count.
+ROLLUPS = {
+    "pos_checks": {
+        "summary_table": "pos_daily_check_totals",
+        "measures": ["gross_sales", "net_sales", "tax", "discounts", "comps"],
+    },
+    "pos_item_sales": {
+        "summary_table": "pos_daily_item_sales_totals",
+        "measures": ["quantity", "extended_price", "net_price", "tax_amount", "comp_amount", "promo_amount", "void_amount"],
+    },
+}
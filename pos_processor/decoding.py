@@ -0,0 +1,20 @@
+"""
+Decoding of POS event message bodies, shared by the push endpoint and the pull-based tools.
+"""
+import json
+from typing import Optional
+
+from pos_common.compression import decompress
+from pos_common.rowcodec import get_row_codecs, CONTENT_TYPE, CONTENT_TYPE_ATTRIBUTE
+
+
+def decode_message_data(data: bytes, attributes: Optional[dict] = None) -> dict:
+    """
+    Decodes a raw Pub/Sub message body into the event dict, decompressing it
+    first when the attributes declare a content_encoding. Bodies with the
+    binary row content_type are decoded with the schema-derived codecs.
+    """
+    data = decompress(data, attributes)
+    if (attributes or {}).get(CONTENT_TYPE_ATTRIBUTE) == CONTENT_TYPE:
+        return get_row_codecs().decode(data)
+    return json.loads(data.decode('utf-8'))
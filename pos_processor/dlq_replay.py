@@ -0,0 +1,260 @@
+"""
+High-throughput replay of the pos-events dead-letter queue.
+
+Pulls the DLQ subscription in large batches, groups messages by table_name,
+revalidates them across the validation process pool, bulk-inserts the valid rows into BigQuery and
+quarantines the rest to a JSONL file. Works against the Pub/Sub emulator when
+PUBSUB_EMULATOR_HOST is set.
+
+Usage:
+    python -m pos_processor.dlq_replay --subscription pos-events-dlq-pull-sub --dry-run
+    python -m pos_processor.dlq_replay --subscription pos-events-dlq-pull-sub --rate 2000 --quarantine-file quarantine.jsonl
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from google.api_core import exceptions as gcp_exceptions
+
+from pos_common.compression import CorruptPayloadError
+from pos_common.ratelimit import TokenBucket
+from pos_common.rowcodec import RowCodecError
+from pos_processor.decoding import decode_message_data
+from pos_processor.normalize import normalize_record
+from pos_processor.inserts import INSERT_MAX_ATTEMPTS, insert_rows_with_retry
+from pos_processor.schema_validator import validate_messages
+from pos_processor.sinks import create_sink
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_INSERT_CHUNK_SIZE = 500
+# Pub/Sub can answer a pull with nothing while messages are still outstanding, so
+# the subscription counts as drained only after this many pulls bring nothing new.
+DEFAULT_EMPTY_PULLS = 3
+
+
+def _new_table_report() -> dict:
+    return {'pulled': 0, 'valid': 0, 'inserted': 0, 'invalid': 0, 'insert_rejected': 0, 'insert_failed': 0}
+
+
+class DlqReplayer:
+    """
+    Replays one DLQ subscription. The subscriber is a pubsub_v1.SubscriberClient
+    (or a compatible fake) and insert_rows(table_id, rows) returns BigQuery-style errors.
+    """
+
+    def __init__(
+        self,
+        subscriber,
+        subscription_path: str,
+        insert_rows: Callable[[str, list], list],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        rate_limit: Optional[float] = None,
+        dry_run: bool = False,
+        workers: Optional[int] = None,
+        quarantine_path: Optional[str] = None,
+        insert_chunk_size: int = DEFAULT_INSERT_CHUNK_SIZE,
+        insert_attempts: int = INSERT_MAX_ATTEMPTS,
+        rollups=None,
+        empty_pulls: int = DEFAULT_EMPTY_PULLS,
+    ):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.rate_limiter = TokenBucket(rate_limit, capacity=max(rate_limit, batch_size)) if rate_limit else None
+        self.dry_run = dry_run
+        self.workers = workers
+        self.quarantine_path = quarantine_path
+        self.insert_chunk_size = insert_chunk_size
+        self.insert_attempts = insert_attempts
+        # A RollupAggregator (pos_processor/rollups.py) that counts the inserted rows, or None.
+        self.rollups = rollups
+        self.empty_pulls = empty_pulls
+        self.report: Dict[str, dict] = {}
+
+    def _table_report(self, table_name: str) -> dict:
+        return self.report.setdefault(table_name, _new_table_report())
+
+    def _pull(self) -> list:
+        try:
+            response = self.subscriber.pull(
+                request={"subscription": self.subscription_path, "max_messages": self.batch_size}, timeout=60
+            )
+        except gcp_exceptions.DeadlineExceeded:
+            # An empty subscription can time out instead of returning no messages.
+            return []
+        return list(response.received_messages)
+
+    def _ack(self, ack_ids: List[str]) -> None:
+        if ack_ids and not self.dry_run:
+            self.subscriber.acknowledge(request={"subscription": self.subscription_path, "ack_ids": ack_ids})
+
+    def _nack(self, ack_ids: List[str]) -> None:
+        # A dry run leaves messages leased so the same ones are not pulled again
+        # during the pass; they return to the DLQ when their ack deadline expires.
+        if ack_ids and not self.dry_run:
+            self.subscriber.modify_ack_deadline(
+                request={"subscription": self.subscription_path, "ack_ids": ack_ids, "ack_deadline_seconds": 0}
+            )
+
+    def _quarantine(self, entries: List[dict]) -> None:
+        if not entries or self.dry_run or not self.quarantine_path:
+            return
+        with open(self.quarantine_path, 'a', encoding='utf-8') as handle:
+            for entry in entries:
+                handle.write(json.dumps(entry) + '\n')
+
+    def process_batch(self, received_messages: list) -> None:
+        """Validates, inserts and acknowledges (or quarantines) one pulled batch."""
+        decoded = []
+        quarantined = []
+        for received in received_messages:
+            try:
+                message_data = decode_message_data(received.message.data, dict(received.message.attributes))
+                if not isinstance(message_data, dict):
+                    raise ValueError(f"Expected a JSON object, got {type(message_data).__name__}.")
+                decoded.append((received.ack_id, message_data))
+            # RuntimeError covers bodies from a newer row format and zstd bodies this host cannot inflate.
+            except (CorruptPayloadError, RowCodecError, ValueError, UnicodeDecodeError, RuntimeError) as e:
+                self._table_report('N/A')['pulled'] += 1
+                self._table_report('N/A')['invalid'] += 1
+                quarantined.append({'ack_id': received.ack_id, 'error': f"Malformed message data: {e}",
+                                    'data': received.message.data.decode('utf-8', errors='replace')})
+
+        validations = validate_messages([message for _, message in decoded], workers=self.workers)
+
+        valid_by_table: Dict[str, list] = {}
+        for (ack_id, message_data), (is_valid, error) in zip(decoded, validations):
+            table_name = str(message_data.get('table_name', 'N/A'))
+            table_report = self._table_report(table_name)
+            table_report['pulled'] += 1
+            if is_valid:
+                table_report['valid'] += 1
+                valid_by_table.setdefault(table_name, []).append((ack_id, message_data))
+            else:
+                table_report['invalid'] += 1
+                quarantined.append({'ack_id': ack_id, 'table_name': table_name, 'record_id': message_data.get('record_id'),
+                                    'error': error, 'message': message_data})
+
+        # Only drop bad messages from the DLQ once they are durably quarantined.
+        self._quarantine([{**entry, 'quarantined_at': datetime.now(timezone.utc).isoformat()} for entry in quarantined])
+        if self.quarantine_path:
+            self._ack([entry['ack_id'] for entry in quarantined])
+        else:
+            self._nack([entry['ack_id'] for entry in quarantined])
+
+        for table_name, messages in valid_by_table.items():
+            self._insert_table(table_name, messages)
+
+    def _insert_table(self, table_name: str, messages: list) -> None:
+        table_report = self._table_report(table_name)
+        for start in range(0, len(messages), self.insert_chunk_size):
+            chunk = messages[start:start + self.insert_chunk_size]
+            ack_ids = [ack_id for ack_id, _ in chunk]
+            if self.dry_run:
+                continue
+            rows = [normalize_record(message['data'], table_name) for _, message in chunk]
+            # Committed rows are acked even when others in the chunk fail; only failing rows are retried.
+            outcome = insert_rows_with_retry(table_name, rows, self.insert_rows, max_attempts=self.insert_attempts)
+            table_report['inserted'] += len(outcome['inserted'])
+            if self.rollups is not None:
+                for index in outcome['inserted']:
+                    self.rollups.observe(table_name, rows[index], chunk[index][1].get('record_id'))
+            self._ack([ack_ids[index] for index in outcome['inserted']])
+            if outcome['quarantined']:
+                logger.error(f"BigQuery rejected {len(outcome['quarantined'])} row(s) of {table_name}: {outcome['quarantined']}")
+                table_report['insert_rejected'] += len(outcome['quarantined'])
+                self._quarantine([{'ack_id': ack_ids[index], 'table_name': table_name,
+                                   'record_id': chunk[index][1].get('record_id'), 'error': errors,
+                                   'message': chunk[index][1], 'quarantined_at': datetime.now(timezone.utc).isoformat()}
+                                  for index, errors in outcome['quarantined']])
+                rejected = [ack_ids[index] for index, _ in outcome['quarantined']]
+                if self.quarantine_path:
+                    self._ack(rejected)
+                else:
+                    self._nack(rejected)
+            if outcome['failed']:
+                logger.error(f"Bulk insert of {len(outcome['failed'])} row(s) into {table_name} failed: {outcome['failed']}")
+                table_report['insert_failed'] += len(outcome['failed'])
+                self._nack([ack_ids[index] for index, _ in outcome['failed']])
+
+    def run(self, max_messages: Optional[int] = None) -> dict:
+        """Pulls and replays batches until the subscription is drained or max_messages is reached."""
+        processed = 0
+        empty_pulls = 0
+        seen_message_ids = set()
+        while max_messages is None or processed < max_messages:
+            # Nacked messages (and dry-run leases that expire) are redelivered; handle
+            # each message at most once per run so the pass terminates.
+            received_messages = [r for r in self._pull() if r.message.message_id not in seen_message_ids]
+            seen_message_ids.update(r.message.message_id for r in received_messages)
+            if not received_messages:
+                empty_pulls += 1
+                if empty_pulls >= self.empty_pulls:
+                    break
+                continue
+            empty_pulls = 0
+            if max_messages is not None and processed + len(received_messages) > max_messages:
+                overflow = received_messages[max_messages - processed:]
+                received_messages = received_messages[:max_messages - processed]
+                self._nack([received.ack_id for received in overflow])
+            if self.rate_limiter:
+                self.rate_limiter.acquire(len(received_messages))
+            self.process_batch(received_messages)
+            processed += len(received_messages)
+            logger.info(f"Replayed {processed} DLQ message(s) so far.")
+
+        if self.rollups is not None:
+            self.rollups.flush()
+        totals = _new_table_report()
+        for table_report in self.report.values():
+            for key, value in table_report.items():
+                totals[key] += value
+        return {'dry_run': self.dry_run, 'totals': totals, 'tables': self.report}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay messages from the pos-events dead-letter subscription.")
+    parser.add_argument('--subscription', default=os.environ.get('DLQ_SUBSCRIPTION_ID', 'pos-events-dlq-pull-sub'))
+    parser.add_argument('--project', default=os.environ.get('GCP_PROJECT_ID'))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-messages', type=int)
+    parser.add_argument('--rate', type=float, help="Maximum messages replayed per second.")
+    parser.add_argument('--workers', type=int, help="Validation worker processes (default: VALIDATION_WORKERS, the CPU count).")
+    parser.add_argument('--quarantine-file', help="JSONL file for messages that still fail validation.")
+    parser.add_argument('--dry-run', action='store_true', help="Validate and report only; nothing is inserted or acknowledged.")
+    args = parser.parse_args(argv)
+
+    from google.cloud import pubsub_v1
+    from pos_processor.rollups import rollups_enabled, get_rollups
+
+    # The sink comes from pos_processor.sinks directly, so the CLI does not build the Flask app.
+    sink = create_sink(os.environ.get("PROCESSOR_SINK"), project_id=args.project,
+                       dataset_id=os.environ.get("BIGQUERY_DATASET_ID"))
+
+    subscriber = pubsub_v1.SubscriberClient()
+    replayer = DlqReplayer(
+        subscriber,
+        subscriber.subscription_path(args.project, args.subscription),
+        sink.insert,
+        batch_size=args.batch_size,
+        rate_limit=args.rate,
+        dry_run=args.dry_run,
+        workers=args.workers,
+        quarantine_path=args.quarantine_file,
+        rollups=get_rollups() if rollups_enabled() and not args.dry_run else None,
+    )
+    summary = replayer.run(args.max_messages)
+    sink.close()
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['totals']['insert_failed'] else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Row-level handling of BigQuery streaming-insert errors.
+
+insert_rows_json reports errors per row as {'index': i, 'errors': [...]}, and
+rows without an entry were committed. insert_rows_with_retry keeps those rows
+and re-sends only the rows that failed. Rows rejected as 'invalid' will fail
+the same way every time, so they are not retried; they are returned as
+quarantined. The push handler leaves them unacknowledged for the dead-letter
+topic, and the DLQ replay tool writes them to its quarantine file. The other
+failures are retried with
+exponential backoff. That includes rows BigQuery 'stopped' because another row
+in the request was invalid. Rows that still fail after INSERT_MAX_ATTEMPTS are
+returned as failed, so Pub/Sub redelivers them.
+
+Configuration (environment):
+    INSERT_MAX_ATTEMPTS              insert attempts per row for batched inserts (default 3)
+    INSERT_RETRY_INITIAL_SECONDS     backoff before the first retry, doubled each time (default 0.5)
+    INSERT_RETRY_MAX_SECONDS         backoff ceiling (default 8)
+"""
+import os
+import time
+import logging
+from typing import Callable
+
+from pos_common.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+INSERT_MAX_ATTEMPTS = int(os.environ.get("INSERT_MAX_ATTEMPTS", "3"))
+INSERT_RETRY_INITIAL_SECONDS = float(os.environ.get("INSERT_RETRY_INITIAL_SECONDS", "0.5"))
+INSERT_RETRY_MAX_SECONDS = float(os.environ.get("INSERT_RETRY_MAX_SECONDS", "8"))
+
+# Reasons that a retry cannot fix; see https://cloud.google.com/bigquery/docs/error-messages
+PERMANENT_REASONS = {"invalid"}
+# The row was fine but not committed because another row of the request was invalid.
+STOPPED_REASON = "stopped"
+
+ROW_OUTCOMES = REGISTRY.counter(
+    "pos_processor_bq_row_outcomes_total", "Rows per insert outcome: inserted, retried, quarantined or failed.",
+    ["table", "outcome"],
+)
+
+
+def _reasons(row_errors: list) -> set:
+    """The reasons of one row's errors; plain strings are taken as the reason itself."""
+    return {error.get("reason") if isinstance(error, dict) else str(error) for error in row_errors}
+
+
+def _errors_by_row(errors: list, row_count: int) -> dict:
+    """Maps row index to its errors. An entry without an index applies to every row of the request."""
+    by_row = {}
+    for entry in errors:
+        if isinstance(entry, dict) and "index" in entry:
+            by_row.setdefault(entry["index"], []).extend(entry.get("errors", []))
+        else:
+            row_errors = entry.get("errors", [entry]) if isinstance(entry, dict) else [entry]
+            for index in range(row_count):
+                by_row.setdefault(index, []).extend(row_errors)
+    return by_row
+
+
+def insert_rows_with_retry(
+    table_id: str,
+    rows: list,
+    insert_fn: Callable[[str, list], list],
+    max_attempts: int = INSERT_MAX_ATTEMPTS,
+    initial_backoff: float = INSERT_RETRY_INITIAL_SECONDS,
+    max_backoff: float = INSERT_RETRY_MAX_SECONDS,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict:
+    """
+    Inserts rows through insert_fn(table_id, rows), which returns
+    insert_rows_json-style errors. Returns the row indexes by outcome:
+    {'inserted': [i, ...], 'quarantined': [(i, errors), ...], 'failed': [(i, errors), ...]}.
+    """
+    outcome = {"inserted": [], "quarantined": [], "failed": []}
+    pending = list(range(len(rows)))
+    backoff = initial_backoff
+    for attempt in range(1, max_attempts + 1):
+        errors = insert_fn(table_id, [rows[index] for index in pending]) or []
+        by_row = _errors_by_row(errors, len(pending))
+        retry = []
+        for position, index in enumerate(pending):
+            row_errors = by_row.get(position)
+            if not row_errors:
+                outcome["inserted"].append(index)
+            elif _reasons(row_errors) & PERMANENT_REASONS:
+                outcome["quarantined"].append((index, row_errors))
+            else:
+                retry.append((index, row_errors))
+        if not retry:
+            break
+        if attempt == max_attempts:
+            outcome["failed"].extend(retry)
+            break
+        pending = [index for index, _ in retry]
+        ROW_OUTCOMES.inc(len(pending), table=table_id, outcome="retried")
+        # Rows that were only stopped by an invalid neighbour can go straight back.
+        if any(_reasons(row_errors) - {STOPPED_REASON} for _, row_errors in retry):
+            logger.warning(f"Retrying {len(pending)} row(s) of {table_id} in {backoff:.1f}s (attempt {attempt + 1}/{max_attempts}).")
+            sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+    for key in ("inserted", "quarantined", "failed"):
+        if outcome[key]:
+            ROW_OUTCOMES.inc(len(outcome[key]), table=table_id, outcome=key)
+    return outcome
+
@@ -5,53 +5,58 @@ import os
 import json
 import base64
 import logging
-from datetime import datetime
+import time
 from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from pos_common.startup import StartupTracker, install_readiness
+STARTUP = StartupTracker("pos-processor")
+
 from flask import Flask, request, Response
 
-from google.cloud import bigquery
-from pos_processor.schema_validator import validate_message
-from pos_processor.config import NORMALIZATION_RULES
+from pos_processor.schema_validator import validate_message, warm_validators, table_label
+from pos_common.schema_store import get_schema_store
+from pos_processor.normalize import normalize_record
+from pos_processor.decoding import decode_message_data
+from pos_common.rowcodec import get_row_codecs
+from pos_processor.inserts import insert_rows_with_retry
+from pos_processor.rollups import rollups_enabled, get_rollups
+from pos_processor.sinks import Sink, BigQuerySink, create_sink
+from pos_common.metrics import REGISTRY, CONTENT_TYPE
+from pos_common.compression import CorruptPayloadError
+from pos_common.rowcodec import RowCodecError
+from pos_common.profiling import install_profiling
+from pos_common import tracing
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+STARTUP.checkpoint("imports")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+install_profiling(app)
+install_readiness(app, STARTUP)
 PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
 DATASET_ID = os.environ.get("BIGQUERY_DATASET_ID")
 
+# Process, decode, validate, normalize and insert spans, joined to the poller's page span.
+TRACER = tracing.Tracer("pos-processor")
+
+# --- Metrics ---
+MESSAGES_RECEIVED = REGISTRY.counter("pos_processor_messages_received_total", "Decoded Pub/Sub messages received.", ["table"])
+VALIDATION_LATENCY = REGISTRY.histogram("pos_processor_validation_seconds", "Schema validation time per message.", ["table"])
+VALIDATION_FAILURES = REGISTRY.counter("pos_processor_validation_failures_total", "Messages rejected by schema validation.", ["table"])
+
 @lru_cache(maxsize=1)
-def get_bigquery_client() -> bigquery.Client:
+def get_bigquery_client() -> "bigquery.Client":
     """Returns a cached instance of the BigQuery client."""
+    # Imported here: google.cloud.bigquery is the slowest import of the service.
+    from google.cloud import bigquery
     return bigquery.Client()
 
-def normalize_record(record: dict, table_name: str) -> dict:
-    """
-    Normalizes record fields based on a predefined set of rules for the given table.
-    """
-    rules = NORMALIZATION_RULES.get(table_name, {})
-    if not rules:
-        return record  # No rules for this table, return original record.
-
-    for field, target_format in rules.items():
-        if field not in record:
-            continue
-
-        field_value = record.get(field)
-        if not isinstance(field_value, str) or not field_value:
-            continue  # Skip if not a non-empty string.
-
-        try:
-            dt_object = datetime.fromisoformat(field_value.replace('Z', '+00:00'))
-            if target_format == "DATE":
-                record[field] = dt_object.strftime('%Y-%m-%d')
-            elif target_format == "DATETIME":
-                record[field] = dt_object.isoformat(sep=' ')
-        except (ValueError, TypeError):
-            logger.warning(f"Could not parse timestamp for field '{field}' with value '{field_value}' in table '{table_name}'.")
-    return record
-
 def _prepare_record_for_insertion(message_data: dict) -> tuple[str, list]:
     """Prepares a record for BigQuery insertion by normalizing it."""
     table_id = message_data['table_name']
@@ -62,16 +67,17 @@ def _prepare_record_for_insertion(message_data: dict) -> tuple[str, list]:
     
     return table_id, [normalized_record]
 
-def _insert_into_bigquery(table_id: str, rows: list) -> list:
+@lru_cache(maxsize=1)
+def get_sink() -> Sink:
+    """Returns the row sink selected by PROCESSOR_SINK (see pos_processor/sinks.py), created once."""
+    return create_sink(os.environ.get("PROCESSOR_SINK"), lambda: get_bigquery_client(), PROJECT_ID, DATASET_ID)
+
+def _insert_rows(table_id: str, rows: list) -> list:
     """
-    Inserts rows into the specified BigQuery table and returns a list of any errors.
+    Inserts rows through the configured sink and returns a list of any errors.
+    Rows without an error entry are committed; see pos_processor/inserts.py.
     """
-    full_table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_id}"
-    bq_client = get_bigquery_client()
-    errors = bq_client.insert_rows_json(full_table_id, rows)
-    if not errors:
-        logger.info(f"Successfully inserted {len(rows)} record(s) into {full_table_id}")
-    return errors
+    return get_sink().insert(table_id, rows)
 
 def _process_message(message_data: dict) -> Response:
     """
@@ -79,10 +85,17 @@ def _process_message(message_data: dict) -> Response:
     Returns a Flask Response object.
     """
     # --- 1. Schema Validation ---
-    is_valid, error = validate_message(message_data)
+    table_name = str(message_data.get('table_name', 'N/A'))
+    # table_name is untrusted until validated; metrics only label known tables.
+    label = table_label(message_data.get('table_name'))
+    MESSAGES_RECEIVED.inc(table=label)
+    start_time = time.perf_counter()
+    with TRACER.span("validate", table=label, record_id=message_data.get('record_id')):
+        is_valid, error = validate_message(message_data)
+    VALIDATION_LATENCY.observe(time.perf_counter() - start_time, table=label)
     if not is_valid:
+        VALIDATION_FAILURES.inc(table=label)
         record_id = message_data.get('record_id', 'N/A')
-        table_name = message_data.get('table_name', 'N/A')
         error_log_data = {
             "message": "Schema validation failed",
             "record_id": record_id,
@@ -95,26 +108,34 @@ def _process_message(message_data: dict) -> Response:
         return Response(f"Validation failed for record_id {record_id}", status=200)
 
     # --- 2. Prepare for BigQuery Insertion ---
-    table_id, rows_to_insert = _prepare_record_for_insertion(message_data)
-    
-    # --- 3. Optional Dry-Run Mode for safe testing ---
-    if os.getenv("BQ_DRY_RUN", "false").lower() == "true":
-        logger.info(f"[DRY-RUN] Would insert to {table_id}: {json.dumps(rows_to_insert)}")
-        return Response(status=204)
+    with TRACER.span("normalize", table=table_name):
+        table_id, rows_to_insert = _prepare_record_for_insertion(message_data)
 
-    # --- 3. Insert into BigQuery ---
+    # --- 3. Insert through the sink (BigQuery, dry-run or local files) ---
     logger.info(f"[DEBUG] Incoming table={table_id}, event_type={message_data.get('event_type')}")
     logger.info(f"[DEBUG] Insert payload preview: {json.dumps(rows_to_insert)[:500]}")
     logger.info(f"Attempting BigQuery insert to table {table_id} for sync_id={message_data.get('sync_id')} and record_id={message_data.get('record_id')}")
 
-    errors = _insert_into_bigquery(table_id, rows_to_insert)
+    # A push carries one row, and Pub/Sub redelivery already retries it with backoff.
+    with TRACER.span("insert", table=table_id, rows=len(rows_to_insert)):
+        outcome = insert_rows_with_retry(table_id, rows_to_insert, _insert_rows, max_attempts=1)
+
+    if outcome['quarantined']:
+        record_id = message_data.get('record_id', 'N/A')
+        logger.error(f"BigQuery rejected record_id {record_id} for table {table_id}: {outcome['quarantined']}")
+        # Not acknowledged: after the subscription's delivery attempts the dead-letter
+        # policy moves the message to pos-events-dlq, which is durable and replayable.
+        return Response(f"Insert rejected for record_id {record_id}", status=422)
 
-    if errors:
-        logger.error(f"BigQuery insert failed for table {table_id}: {errors}")
+    if outcome['failed']:
+        logger.error(f"BigQuery insert failed for table {table_id}: {outcome['failed']}")
         # Return a server error to trigger a Pub/Sub retry
         return Response("BigQuery insert failed", status=500)
 
     logger.info(f"Successfully inserted {len(rows_to_insert)} record(s) into table {table_id} (sync_id={message_data.get('sync_id')})")
+    # Rollups summarize BigQuery tables; dry runs and file sinks leave them alone.
+    if rollups_enabled() and isinstance(get_sink(), BigQuerySink):
+        get_rollups().observe(table_id, rows_to_insert[0], message_data.get('record_id'))
     
     # Acknowledge the message successfully
     return Response(status=204)
@@ -122,8 +143,13 @@ def _process_message(message_data: dict) -> Response:
 def _decode_pubsub_message(envelope: dict) -> dict:
     """Decodes the base64 data from a Pub/Sub message envelope."""
     pubsub_message = envelope['message']
-    message_data_str = base64.b64decode(pubsub_message['data']).decode('utf-8')
-    return json.loads(message_data_str)
+    message_data = base64.b64decode(pubsub_message['data'])
+    return decode_message_data(message_data, pubsub_message.get('attributes'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics() -> Response:
+    """Exposes the in-process metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/', methods=['POST'])
 def handle_pubsub_message():
@@ -134,11 +160,15 @@ def handle_pubsub_message():
         return Response("Bad Request: Invalid Pub/Sub message format", status=400)
 
     try:
-        message_data = _decode_pubsub_message(envelope)
-        # Delegate processing to the helper function
-        return _process_message(message_data)
-
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        pubsub_message = envelope['message']
+        with TRACER.span("process", parent=tracing.extract(pubsub_message.get('attributes')),
+                         message_id=pubsub_message.get('messageId')):
+            with TRACER.span("decode"):
+                message_data = _decode_pubsub_message(envelope)
+            # Delegate processing to the helper function
+            return _process_message(message_data)
+
+    except (json.JSONDecodeError, UnicodeDecodeError, CorruptPayloadError, RowCodecError) as e:
         logger.error(f"Error decoding Pub/Sub message data: {e}")
         # Acknowledge the message to prevent retries for malformed data
         return Response("Bad Request: Malformed message data", status=400)
@@ -147,6 +177,15 @@ def handle_pubsub_message():
         # Return a server error to trigger a Pub/Sub retry for transient issues
         return Response("Internal Server Error", status=500)
 
+# --- Warm-up ---
+# Loads and compiles the schemas and creates the BigQuery client before /ready reports ready.
+STARTUP.add_warmup_step("load_schemas", get_schema_store)
+STARTUP.add_warmup_step("compile_validators", warm_validators)
+STARTUP.add_warmup_step("row_codecs", get_row_codecs)
+STARTUP.add_warmup_step("sink", lambda: get_sink().warm())
+STARTUP.checkpoint("app_setup")
+STARTUP.start()
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8080))
     is_debug = os.environ.get("FLASK_DEBUG", "false").lower() == "true"
@@ -0,0 +1,36 @@
+"""
+Record normalization for the POS Processor service.
+Kept separate from the Flask app so batch paths can reuse it without importing the app.
+"""
+import logging
+from datetime import datetime
+
+from pos_processor.config import NORMALIZATION_RULES
+
+logger = logging.getLogger(__name__)
+
+def normalize_record(record: dict, table_name: str) -> dict:
+    """
+    Normalizes record fields based on a predefined set of rules for the given table.
+    """
+    rules = NORMALIZATION_RULES.get(table_name, {})
+    if not rules:
+        return record  # No rules for this table, return original record.
+
+    for field, target_format in rules.items():
+        if field not in record:
+            continue
+
+        field_value = record.get(field)
+        if not isinstance(field_value, str) or not field_value:
+            continue  # Skip if not a non-empty string.
+
+        try:
+            dt_object = datetime.fromisoformat(field_value.replace('Z', '+00:00'))
+            if target_format == "DATE":
+                record[field] = dt_object.strftime('%Y-%m-%d')
+            elif target_format == "DATETIME":
+                record[field] = dt_object.isoformat(sep=' ')
+        except (ValueError, TypeError):
+            logger.warning(f"Could not parse timestamp for field '{field}' with value '{field_value}' in table '{table_name}'.")
+    return record
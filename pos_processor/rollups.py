@@ -0,0 +1,304 @@
+"""
+Daily rollups maintained by the processor.
+
+As rows are inserted, RollupAggregator buffers each record's contribution to
+the rollup: its site_object_id, business_date and the measures in
+config.ROLLUPS, keyed by record_id. Flushing MERGEs the buffered
+contributions into a contributions table (<summary_table>_contributions) on
+record_id. A re-sent record overwrites its own row there instead of adding to
+a running total. The summary rows of every business_date the flush touched
+are then recomputed from the contributions table. Re-sends, re-syncs of the
+whole days_back window, and flushes repeated after a failure therefore leave
+the totals unchanged, whichever instance receives them. An edited record
+replaces its earlier values, even if it moved to another site-day.
+Dashboards read a few summary rows per day instead of scanning pos_checks and
+pos_item_sales.
+
+Flushes run on the request thread that finds one due: ROLLUP_FLUSH_SECONDS
+after the previous flush, or once ROLLUP_MAX_PENDING contributions are
+buffered. With Cloud Run's default CPU throttling, a background thread gets no
+CPU between requests. Whatever is still buffered is flushed at exit, during
+the shutdown grace period. Contributions lost with a crashed instance are
+restored by the next re-sync of their day, or from the fact tables with:
+
+    python -m pos_processor.rollups rebuild --days-back 3
+
+Configuration (environment):
+    ROLLUPS_ENABLED          maintain the rollups (default false)
+    ROLLUP_FLUSH_SECONDS     maximum age of buffered contributions (default 60)
+    ROLLUP_MAX_PENDING       buffered contributions that trigger a flush (default 5000)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import argparse
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from pos_common.metrics import REGISTRY
+from pos_processor.config import ROLLUPS
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FLUSH_SECONDS = float(os.environ.get("ROLLUP_FLUSH_SECONDS", "60"))
+ROLLUP_MAX_PENDING = int(os.environ.get("ROLLUP_MAX_PENDING", "5000"))
+
+ROLLUP_ROWS = REGISTRY.counter("pos_processor_rollup_rows_total", "Inserted rows by rollup outcome: buffered, replaced or ignored.", ["table", "outcome"])
+ROLLUP_FLUSHES = REGISTRY.counter("pos_processor_rollup_flushes_total", "Rollup MERGE scripts by status.", ["table", "status"])
+ROLLUP_PENDING = REGISTRY.gauge("pos_processor_rollup_pending_records", "Record contributions waiting to be flushed.", ["table"])
+
+
+def rollups_enabled() -> bool:
+    return os.environ.get("ROLLUPS_ENABLED", "false").lower() == "true"
+
+
+def _number(value) -> float:
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# --- Aggregation ---
+
+class RollupAggregator:
+    """Buffers the latest contribution of each record and hands them to flush_table(table, config, rows)."""
+
+    def __init__(self, flush_table: Callable[[str, dict, List[dict]], None],
+                 flush_seconds: float = ROLLUP_FLUSH_SECONDS, max_pending: int = ROLLUP_MAX_PENDING,
+                 clock: Callable[[], float] = time.monotonic):
+        self.flush_table = flush_table
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._clock = clock
+        self._last_flush = clock()
+        # table -> record_id -> contribution row not yet flushed.
+        self._pending: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _pending_count(self) -> int:
+        return sum(len(rows) for rows in self._pending.values())
+
+    def observe(self, table: str, row: dict, record_id: Optional[str] = None) -> str:
+        """
+        Buffers one inserted row's contribution and flushes if one is due.
+        Returns 'buffered', 'replaced' (a buffered contribution of the same
+        record was superseded) or 'ignored'.
+        """
+        config = ROLLUPS.get(table)
+        record_id = record_id or (str(row['id']) if row.get('id') is not None else None)
+        if config is None or not row.get('business_date') or not record_id:
+            outcome = 'ignored'
+        else:
+            contribution = {'record_id': record_id, 'site_object_id': row.get('site_object_id'),
+                            'business_date': str(row['business_date'])[:10]}
+            contribution.update((measure, _number(row.get(measure))) for measure in config['measures'])
+            with self._lock:
+                pending = self._pending.setdefault(table, {})
+                outcome = 'replaced' if record_id in pending else 'buffered'
+                pending[record_id] = contribution
+                ROLLUP_PENDING.set(len(pending), table=table)
+        ROLLUP_ROWS.inc(table=table, outcome=outcome)
+        if self.flush_due():
+            self.flush()
+        return outcome
+
+    def flush_due(self) -> bool:
+        with self._lock:
+            count = self._pending_count()
+        return count > 0 and (count >= self.max_pending or self._clock() - self._last_flush >= self.flush_seconds)
+
+    def flush(self) -> int:
+        """
+        Hands the buffered contributions of each table to flush_table; a failed
+        table keeps them for the next flush. Returns contributions flushed.
+        A flush already running on another thread is not waited for.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = self._clock()
+            flushed = 0
+            for table, contributions in pending.items():
+                config = ROLLUPS[table]
+                try:
+                    self.flush_table(table, config, list(contributions.values()))
+                    ROLLUP_FLUSHES.inc(table=table, status='success')
+                    flushed += len(contributions)
+                except Exception as e:
+                    logger.error(f"Rollup flush of {len(contributions)} record(s) into {config['summary_table']} failed: {e}")
+                    ROLLUP_FLUSHES.inc(table=table, status='error')
+                    with self._lock:
+                        # Contributions observed since the flush began are newer; keep those.
+                        merged = self._pending.setdefault(table, {})
+                        for record_id, contribution in contributions.items():
+                            merged.setdefault(record_id, contribution)
+            with self._lock:
+                for table in ROLLUPS:
+                    ROLLUP_PENDING.set(len(self._pending.get(table, {})), table=table)
+            return flushed
+        finally:
+            self._flush_lock.release()
+
+
+# --- BigQuery ---
+
+def _dataset_table_id(name: str) -> str:
+    return f"{os.environ.get('GCP_PROJECT_ID')}.{os.environ.get('BIGQUERY_DATASET_ID')}.{name}"
+
+
+def _summary_table_id(config: dict) -> str:
+    return _dataset_table_id(config['summary_table'])
+
+
+def _contributions_table_id(config: dict) -> str:
+    return _dataset_table_id(f"{config['summary_table']}_contributions")
+
+
+def _create_tables_sql(config: dict) -> str:
+    columns = ", ".join(f"{measure} FLOAT64" for measure in config['measures'])
+    return (f"CREATE TABLE IF NOT EXISTS `{_contributions_table_id(config)}` "
+            f"(record_id STRING, site_object_id STRING, business_date DATE, {columns}, updated_at TIMESTAMP) "
+            f"PARTITION BY business_date CLUSTER BY record_id; "
+            f"CREATE TABLE IF NOT EXISTS `{_summary_table_id(config)}` "
+            f"(site_object_id STRING, business_date DATE, row_count INT64, {columns}, updated_at TIMESTAMP) "
+            f"PARTITION BY business_date CLUSTER BY site_object_id")
+
+
+def _apply_sql(config: dict, source: str, affected_dates: str, prune: Optional[str] = None) -> str:
+    """
+    A script that MERGEs contributions from source into the contributions
+    table on record_id, then recomputes the summary rows of the affected
+    dates from it. prune, a condition on the contributions table, deletes
+    rows in it that source no longer has (used by rebuild).
+    """
+    measures = config['measures']
+    contribution_columns = ['record_id', 'site_object_id', 'business_date'] + measures
+    summary_columns = ['site_object_id', 'business_date', 'row_count'] + measures
+    contribution_updates = ", ".join(f"{column} = S.{column}" for column in contribution_columns[1:])
+    summary_updates = ", ".join(f"{column} = S.{column}" for column in summary_columns[2:])
+    sums = ", ".join(f"SUM(IFNULL({measure}, 0)) AS {measure}" for measure in measures)
+    prune_clause = f"WHEN NOT MATCHED BY SOURCE AND {prune} THEN DELETE " if prune else ""
+    return (
+        # Dates the source reaches now, and the dates its records had before (an edit can move a record).
+        f"DECLARE affected ARRAY<DATE> DEFAULT ({affected_dates}); "
+        f"MERGE `{_contributions_table_id(config)}` T USING ({source}) S ON T.record_id = S.record_id "
+        f"WHEN MATCHED THEN UPDATE SET {contribution_updates}, updated_at = CURRENT_TIMESTAMP() "
+        f"WHEN NOT MATCHED BY TARGET THEN INSERT ({', '.join(contribution_columns)}, updated_at) "
+        f"VALUES ({', '.join(f'S.{column}' for column in contribution_columns)}, CURRENT_TIMESTAMP()) "
+        f"{prune_clause}; "
+        f"MERGE `{_summary_table_id(config)}` T USING ("
+        f"SELECT site_object_id, business_date, COUNT(*) AS row_count, {sums} "
+        f"FROM `{_contributions_table_id(config)}` WHERE business_date IN UNNEST(affected) "
+        f"GROUP BY site_object_id, business_date) S "
+        f"ON IFNULL(T.site_object_id, '') = IFNULL(S.site_object_id, '') AND T.business_date = S.business_date "
+        f"WHEN MATCHED THEN UPDATE SET {summary_updates}, updated_at = CURRENT_TIMESTAMP() "
+        f"WHEN NOT MATCHED BY TARGET THEN INSERT ({', '.join(summary_columns)}, updated_at) "
+        f"VALUES ({', '.join(f'S.{column}' for column in summary_columns)}, CURRENT_TIMESTAMP()) "
+        f"WHEN NOT MATCHED BY SOURCE AND T.business_date IN UNNEST(affected) THEN DELETE"
+    )
+
+
+def _contributions_source(config: dict) -> str:
+    measures = ", ".join(f"CAST(JSON_VALUE(r, '$.{measure}') AS FLOAT64) AS {measure}" for measure in config['measures'])
+    return ("SELECT JSON_VALUE(r, '$.record_id') AS record_id, "
+            "JSON_VALUE(r, '$.site_object_id') AS site_object_id, "
+            f"DATE(JSON_VALUE(r, '$.business_date')) AS business_date, {measures} "
+            "FROM UNNEST(JSON_QUERY_ARRAY(@contributions)) AS r")
+
+
+def _incremental_affected_dates(config: dict) -> str:
+    source = _contributions_source(config)
+    return (f"SELECT ARRAY_AGG(DISTINCT business_date) FROM ("
+            f"SELECT business_date FROM ({source}) UNION ALL "
+            f"SELECT business_date FROM `{_contributions_table_id(config)}` "
+            f"WHERE record_id IN (SELECT record_id FROM ({source})))")
+
+
+def _fact_source(table: str, config: dict) -> str:
+    # record_id as the poller derives it (pos_poller.poller._create_pubsub_message_payload), so both
+    # paths key the same record alike. The latest version of each record wins, as the fact table can
+    # hold re-sent and updated copies.
+    record_id = "SUBSTR(TO_HEX(MD5(COALESCE(NULLIF(CAST(object_id AS STRING), ''), CAST(id AS STRING)))), 1, 12)"
+    measures = ", ".join(f"CAST({measure} AS FLOAT64) AS {measure}" for measure in config['measures'])
+    return (f"SELECT {record_id} AS record_id, site_object_id, DATE(business_date) AS business_date, {measures} "
+            f"FROM `{_dataset_table_id(table)}` WHERE DATE(business_date) BETWEEN @start_date AND @end_date "
+            f"QUALIFY ROW_NUMBER() OVER (PARTITION BY {record_id} ORDER BY modified_on DESC) = 1")
+
+
+class BigQueryRollupWriter:
+    """Applies contributions with a MERGE script, creating the tables on first use."""
+
+    def __init__(self, client):
+        self.client = client
+        self._created = set()
+
+    def _ensure_tables(self, config: dict) -> None:
+        if config['summary_table'] not in self._created:
+            self.client.query(_create_tables_sql(config)).result()
+            self._created.add(config['summary_table'])
+
+    def __call__(self, table: str, config: dict, rows: List[dict]) -> None:
+        from google.cloud import bigquery
+        self._ensure_tables(config)
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("contributions", "STRING", json.dumps(rows)),
+        ])
+        sql = _apply_sql(config, _contributions_source(config), _incremental_affected_dates(config))
+        self.client.query(sql, job_config=job_config).result()
+        logger.info(f"Merged {len(rows)} record contribution(s) into {config['summary_table']}.")
+
+    def rebuild(self, table: str, start_date: date, end_date: date) -> None:
+        """Recomputes the contributions and summary rows of a date range from the fact table."""
+        from google.cloud import bigquery
+        config = ROLLUPS[table]
+        self._ensure_tables(config)
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("start_date", "DATE", start_date),
+            bigquery.ScalarQueryParameter("end_date", "DATE", end_date),
+        ])
+        sql = _apply_sql(config, _fact_source(table, config),
+                         "GENERATE_DATE_ARRAY(@start_date, @end_date)",
+                         prune="T.business_date BETWEEN @start_date AND @end_date")
+        self.client.query(sql, job_config=job_config).result()
+        logger.info(f"Rebuilt {config['summary_table']} for {start_date}..{end_date} from {table}.")
+
+
+@lru_cache(maxsize=1)
+def get_rollups() -> RollupAggregator:
+    """Returns the process-wide aggregator, which flushes to BigQuery from the request path and at exit."""
+    from pos_processor.main import get_bigquery_client
+    aggregator = RollupAggregator(BigQueryRollupWriter(get_bigquery_client()))
+    atexit.register(aggregator.flush)
+    return aggregator
+
+
+# --- CLI ---
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the daily rollup tables.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="Recompute recent days of the rollups from the fact tables.")
+    rebuild.add_argument("--days-back", type=int, default=3)
+    rebuild.add_argument("--tables", nargs="+", choices=sorted(ROLLUPS), default=sorted(ROLLUPS))
+    args = parser.parse_args(argv)
+
+    from google.cloud import bigquery
+    writer = BigQueryRollupWriter(bigquery.Client())
+    end_date = date.today()
+    for table in args.tables:
+        writer.rebuild(table, end_date - timedelta(days=args.days_back), end_date)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
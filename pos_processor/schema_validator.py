@@ -1,45 +1,102 @@
 """
 Handles loading and validating messages against JSON schemas.
+
+validate_message() applies the tiered validation policy used on the hot
+path. Every message gets a cheap structural check: envelope fields, the
+table_name / event_type pair, required and unknown data keys, and primitive
+types. It is derived from the schemas, so it only rejects messages that full
+validation would reject too. Full Draft 2020-12 validation (validate_full)
+then runs on a sample of each table's messages. When the sampled failure
+rate of a table reaches the escalation threshold, every message of that
+table is fully validated until a full window of samples is back under it.
+
+Configuration (environment):
+    VALIDATION_DEEP_SAMPLE_RATE       share of messages fully validated (default 1.0)
+    VALIDATION_DEEP_SAMPLE_RATES      per-table overrides as JSON, e.g. {"pos_item_sales": 0.05}
+    VALIDATION_ESCALATION_THRESHOLD   sampled failure rate that escalates a table to 100% (default 0.01)
+    VALIDATION_ESCALATION_WINDOW      samples the failure rate is measured over (default 200)
+    VALIDATION_ESCALATION_MIN_SAMPLES samples needed before a table can escalate (default 20)
+
+validate_messages() fully validates a batch, sharding large batches across a
+pool of worker processes that each preload the compiled validators:
+    VALIDATION_WORKERS        worker processes (default: the CPU count; 1 disables the pool)
+    VALIDATION_INLINE_BATCH   batches smaller than this are validated inline (default 256)
+
+Benchmark throughput against the number of cores:
+    python -m pos_processor.schema_validator bench --messages 20000 --workers 1,2,4
 """
 import os
+import sys
 import json
+import time
+import uuid
+import random
 import logging
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
 from functools import lru_cache
-from typing import Optional, Tuple
-from jsonschema import Draft202012Validator, ValidationError
-from referencing import Registry, Resource
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pos_common.metrics import REGISTRY
+from pos_common.schema_store import get_schema_store
+
+# jsonschema and referencing are imported when the first validator is built, so
+# they load during warm-up (or the first message) rather than at import time.
 
 logger = logging.getLogger(__name__)
 
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", str(os.cpu_count() or 1)))
+VALIDATION_INLINE_BATCH = int(os.environ.get("VALIDATION_INLINE_BATCH", "256"))
+
+TIER_CHECKS = REGISTRY.counter("pos_processor_validation_tier_checks_total", "Messages checked by each validation tier.", ["tier", "table"])
+TIER_FAILURES = REGISTRY.counter("pos_processor_validation_tier_failures_total", "Messages rejected by each validation tier.", ["tier", "table"])
+DEEP_SAMPLE_RATE = REGISTRY.gauge("pos_processor_validation_deep_sample_rate", "Current share of messages fully validated per table.", ["table"])
+ESCALATIONS = REGISTRY.counter("pos_processor_validation_escalations_total", "Times a table was escalated to full validation.", ["table"])
+
 @lru_cache(maxsize=1)
-def get_schema_store() -> dict:
+def known_tables() -> frozenset:
+    """The table_name of every table schema in the store."""
+    return frozenset(
+        schema["properties"]["table_name"]["const"] for schema in get_schema_store().values()
+        if "const" in schema.get("properties", {}).get("table_name", {})
+    )
+
+def table_label(table_name) -> str:
     """
-    Loads all JSON schemas from the 'schemas' directory into a store.
+    The metric label for a message's table_name. The value comes from the
+    message, so anything but a known table is reported as 'unknown' to keep
+    the label's cardinality bounded.
     """
-    store = {}
-    schema_dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'schemas'))
-    logger.info(f"Attempting to load schemas from absolute path: {schema_dir_path}")
-    try:
-        filenames = os.listdir(schema_dir_path)
-        logger.info(f"Found files in schema directory: {filenames}")
-    except FileNotFoundError:
-        logger.error(f"FATAL: Schema directory not found at {schema_dir_path}")
-        return {}
-
-    for filename in filenames:
-        if filename.endswith('.json'):
-            try:
-                with open(os.path.join(schema_dir_path, filename), 'r') as f:
-                    schema = json.load(f)
-                    if '$id' in schema:
-                        store[schema['$id']] = schema
-                    else:
-                        logger.warning(f"Schema file {filename} is missing a top-level '$id' property.")
-            except Exception as e:
-                logger.error(f"Failed to load or parse schema file {filename}: {e}")
-    
-    logger.info(f"SCHEMA STORE INITIALIZED. Contains IDs: {list(store.keys())}")
-    return store
+    return table_name if isinstance(table_name, str) and table_name in known_tables() else "unknown"
+
+@lru_cache(maxsize=1)
+def _get_schema_registry():
+    """Builds the registry of all known schemas once, allowing for $ref resolution."""
+    from referencing import Registry, Resource
+    return Registry().with_resources(
+        (resource["$id"], Resource.from_contents(resource))
+        for resource in get_schema_store().values()
+    )
+
+@lru_cache(maxsize=None)
+def get_validator(schema_id: str):
+    """Returns a cached Draft 2020-12 validator for a schema in the store."""
+    from jsonschema import Draft202012Validator
+    return Draft202012Validator(get_schema_store()[schema_id], registry=_get_schema_registry())
+
+def warm_validators() -> int:
+    """
+    Builds every validator and runs it once so $ref resolution and format
+    checkers are loaded before the first message. Returns the number compiled.
+    """
+    for schema_id in get_schema_store():
+        get_validator(schema_id).is_valid({})
+        _structure(schema_id)
+    return len(get_schema_store())
 
 def _find_schema_for_message(message: dict, schema_store: dict) -> Tuple[Optional[dict], Optional[str]]:
     """Finds the appropriate schema for a message based on its event_type."""
@@ -56,7 +113,14 @@ def _find_schema_for_message(message: dict, schema_store: dict) -> Tuple[Optiona
     
     return main_schema, None
 
-def validate_message(message: dict) -> Tuple[bool, Optional[str]]:
+def _error_details(path, message: str, instance_value) -> str:
+    # To avoid logging sensitive data, we'll truncate long instance values.
+    if isinstance(instance_value, str) and len(instance_value) > 200:
+        instance_value = instance_value[:200] + '...'
+    error_path = "->".join(map(str, path)) if path else "root"
+    return json.dumps({"path": error_path, "message": message, "instance_value": instance_value})
+
+def validate_full(message: dict) -> Tuple[bool, Optional[str]]:
     """
     Validates an incoming message against the appropriate JSON schema.
     """
@@ -66,31 +130,292 @@ def validate_message(message: dict) -> Tuple[bool, Optional[str]]:
         if error:
             return False, error
         
-        # Create a registry of all known schemas, allowing for $ref resolution.
-        registry = Registry().with_resources(
-            (resource["$id"], Resource.from_contents(resource))
-            for resource in schema_store.values()
-        )
-        
-        validator = Draft202012Validator(main_schema, registry=registry)
+        validator = get_validator(main_schema['$id'])
         errors = sorted(validator.iter_errors(message), key=lambda e: e.path)
 
         if not errors:
             return True, None
 
         e = errors[0]
-        # To avoid logging sensitive data, we'll truncate long instance values.
-        instance_value = e.instance
-        if isinstance(instance_value, str) and len(instance_value) > 200:
-            instance_value = instance_value[:200] + '...'
-
-        error_path = "->".join(map(str, e.path)) if e.path else "root"
-        error_details = {
-            "path": error_path,
-            "message": e.message,
-            "instance_value": instance_value
-        }
-        return False, json.dumps(error_details)
+        return False, _error_details(e.path, e.message, e.instance)
+    except Exception as e:
+        logger.error(f"Unexpected validation error: {e}", exc_info=True)
+        return False, "An unexpected error occurred during validation."
+
+# --- Tiered Validation ---
+
+_JSON_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: (isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, float) and v.is_integer()),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+}
+
+def _type_check(spec: dict) -> Optional[Tuple[Tuple[str, ...], Callable[[object], bool]]]:
+    types = spec.get("type")
+    if types is None:
+        return None
+    types = (types,) if isinstance(types, str) else tuple(types)
+    checks = [_JSON_TYPES[t] for t in types if t in _JSON_TYPES]
+    return types, lambda value: any(check(value) for check in checks)
+
+@lru_cache(maxsize=None)
+def _structure(schema_id: str) -> dict:
+    """The subset of a schema the structural tier checks, compiled once per schema."""
+    store = get_schema_store()
+    schema = store[schema_id]
+    parts = [schema] + [store.get(ref["$ref"], {}) for ref in schema.get("allOf", []) if "$ref" in ref]
+    required, envelope, consts = [], {}, {}
+    for part in parts:
+        required.extend(part.get("required", []))
+        for name, spec in part.get("properties", {}).items():
+            if "const" in spec:
+                consts[name] = spec["const"]
+            check = _type_check(spec)
+            if check and name not in envelope:
+                envelope[name] = check
+    data_schema = schema.get("properties", {}).get("data", {})
+    data_fields = {name: _type_check(spec) for name, spec in data_schema.get("properties", {}).items()}
+    return {
+        "required": list(dict.fromkeys(required)),
+        "envelope": envelope,
+        "consts": consts,
+        "data_fields": data_fields,
+        "data_required": data_schema.get("required", []),
+        "data_closed": data_schema.get("additionalProperties") is False,
+    }
+
+def check_structure(message: dict) -> Tuple[bool, Optional[str]]:
+    """
+    The cheap tier: envelope fields, table/event_type consistency, required and
+    unknown data keys, and primitive types. Formats, patterns and ranges are
+    left to full validation.
+    """
+    if not isinstance(message, dict):
+        return False, _error_details([], "Message is not an object.", None)
+    main_schema, error = _find_schema_for_message(message, get_schema_store())
+    if error:
+        return False, error
+    structure = _structure(main_schema['$id'])
+    for name in structure["required"]:
+        if name not in message:
+            return False, _error_details([], f"'{name}' is a required property", None)
+    for name, expected in structure["consts"].items():
+        if name in message and message[name] != expected:
+            return False, _error_details([name], f"{expected!r} was expected", message[name])
+    for name, (types, check) in structure["envelope"].items():
+        if name in message and not check(message[name]):
+            return False, _error_details([name], f"{message[name]!r} is not of type {', '.join(map(repr, types))}", message[name])
+    data = message.get("data")
+    if not isinstance(data, dict):
+        return True, None
+    for name in structure["data_required"]:
+        if name not in data:
+            return False, _error_details(["data"], f"'{name}' is a required property", None)
+    fields = structure["data_fields"]
+    for name, value in data.items():
+        if name not in fields:
+            if structure["data_closed"]:
+                return False, _error_details(["data"], f"Additional properties are not allowed ('{name}' was unexpected)", data)
+            continue
+        type_check = fields[name]
+        if type_check and not type_check[1](value):
+            return False, _error_details(["data", name], f"{value!r} is not of type {', '.join(map(repr, type_check[0]))}", value)
+    return True, None
+
+class ValidationPolicy:
+    """Runs the structural tier on every message and full validation on a per-table sample, escalating on failures."""
+
+    def __init__(
+        self,
+        default_rate: float = 1.0,
+        table_rates: Optional[Dict[str, float]] = None,
+        escalation_threshold: float = 0.01,
+        window: int = 200,
+        min_samples: int = 20,
+        full_validator: Callable[[dict], Tuple[bool, Optional[str]]] = validate_full,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.default_rate = default_rate
+        self.table_rates = dict(table_rates or {})
+        self.escalation_threshold = escalation_threshold
+        self.window = window
+        self.min_samples = min(min_samples, window)
+        self.full_validator = full_validator
+        self._rng = rng
+        self._samples: Dict[str, deque] = {}
+        self._escalated: set = set()
+        self._lock = threading.Lock()
+
+    def sample_rate(self, table: str) -> float:
+        if table in self._escalated:
+            return 1.0
+        return self.table_rates.get(table, self.default_rate)
+
+    def _record_sample(self, table: str, failed: bool) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(table, deque(maxlen=self.window))
+            samples.append(failed)
+            failure_rate = sum(samples) / len(samples)
+            if table not in self._escalated:
+                if len(samples) >= self.min_samples and failure_rate >= self.escalation_threshold:
+                    self._escalated.add(table)
+                    samples.clear()
+                    ESCALATIONS.inc(table=table)
+                    logger.warning(f"Sampled validation failure rate for {table} reached {failure_rate:.1%}; "
+                                   f"validating every message until it recovers.")
+            elif len(samples) == self.window and failure_rate < self.escalation_threshold:
+                self._escalated.discard(table)
+                logger.info(f"Validation failure rate for {table} is back to {failure_rate:.1%}; resuming sampling.")
+            DEEP_SAMPLE_RATE.set(self.sample_rate(table), table=table)
+
+    def validate(self, message: dict) -> Tuple[bool, Optional[str]]:
+        table = table_label(message.get('table_name') if isinstance(message, dict) else None)
+        TIER_CHECKS.inc(tier="structural", table=table)
+        is_valid, error = check_structure(message)
+        if not is_valid:
+            TIER_FAILURES.inc(tier="structural", table=table)
+            return False, error
+        if self._rng() >= self.sample_rate(table):
+            return True, None
+        TIER_CHECKS.inc(tier="full", table=table)
+        is_valid, error = self.full_validator(message)
+        if not is_valid:
+            TIER_FAILURES.inc(tier="full", table=table)
+        self._record_sample(table, not is_valid)
+        return is_valid, error
+
+@lru_cache(maxsize=1)
+def get_validation_policy() -> ValidationPolicy:
+    """Returns the process-wide validation policy configured from the environment."""
+    return ValidationPolicy(
+        default_rate=float(os.environ.get("VALIDATION_DEEP_SAMPLE_RATE", "1.0")),
+        table_rates=json.loads(os.environ.get("VALIDATION_DEEP_SAMPLE_RATES", "{}")),
+        escalation_threshold=float(os.environ.get("VALIDATION_ESCALATION_THRESHOLD", "0.01")),
+        window=int(os.environ.get("VALIDATION_ESCALATION_WINDOW", "200")),
+        min_samples=int(os.environ.get("VALIDATION_ESCALATION_MIN_SAMPLES", "20")),
+    )
+
+def validate_message(message: dict) -> Tuple[bool, Optional[str]]:
+    """Validates a message under the tiered policy: structural check always, full validation on a sample."""
+    try:
+        return get_validation_policy().validate(message)
     except Exception as e:
         logger.error(f"Unexpected validation error: {e}", exc_info=True)
-        return False, "An unexpected error occurred during validation."
\ No newline at end of file
+        return False, "An unexpected error occurred during validation."
+
+# --- Batch Validation ---
+
+def _init_validation_worker() -> None:
+    """Compiles every validator once per worker process, before it takes work."""
+    warm_validators()
+
+def _validate_chunk(messages: List[dict]) -> List[Tuple[bool, Optional[str]]]:
+    return [validate_full(message) for message in messages]
+
+@lru_cache(maxsize=None)
+def _get_validation_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn rather than fork: the services run Flask, Pub/Sub and BigQuery client threads
+    # that must not be duplicated into the workers mid-operation.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_validation_worker,
+    )
+
+def validate_messages(messages: List[dict], workers: Optional[int] = None,
+                      inline_batch: Optional[int] = None) -> List[Tuple[bool, Optional[str]]]:
+    """
+    Fully validates a batch and returns one (is_valid, error) per message, in
+    order. Batches of at least inline_batch messages are split into one chunk
+    per worker process; smaller ones run inline to skip the IPC cost.
+    """
+    workers = VALIDATION_WORKERS if workers is None else workers
+    inline_batch = VALIDATION_INLINE_BATCH if inline_batch is None else inline_batch
+    if workers <= 1 or len(messages) < max(inline_batch, 2):
+        return _validate_chunk(messages)
+    chunk_size = -(-len(messages) // workers)
+    chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+    try:
+        results = []
+        for chunk_results in _get_validation_pool(workers).map(_validate_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+    except BrokenProcessPool as e:
+        logger.error(f"Validation pool failed ({e}); validating the batch inline.")
+        _get_validation_pool.cache_clear()
+        return _validate_chunk(messages)
+
+# --- Benchmark ---
+
+_SAMPLE_VALUES = {"string": "sample", "integer": 1, "number": 1.5, "boolean": True, "null": None}
+_SAMPLE_FORMATS = {"uuid": lambda: str(uuid.uuid4()), "date-time": lambda: "2025-06-30T12:00:00+00:00",
+                   "date": lambda: "2025-06-30", "email": lambda: "guest@example.com"}
+
+def _sample_message(schema: dict) -> dict:
+    """A valid message for a table schema, with every data field populated."""
+    table_name = schema["properties"]["table_name"]["const"]
+    data = {}
+    for name, spec in schema["properties"]["data"].get("properties", {}).items():
+        if spec.get("format") in _SAMPLE_FORMATS:
+            data[name] = _SAMPLE_FORMATS[spec["format"]]()
+            continue
+        types = spec.get("type", "string")
+        data[name] = _SAMPLE_VALUES.get(types if isinstance(types, str) else types[0], "sample")
+    prefix = table_name.replace("pos_", "").title().replace("_", "")
+    return {
+        "record_id": uuid.uuid4().hex[:12],
+        "sync_id": f"{prefix}_20250630_120000",
+        "processed_at": "2025-06-30T12:00:00+00:00",
+        "event_type": schema["properties"]["event_type"]["const"],
+        "table_name": table_name,
+        "data": data,
+    }
+
+def benchmark(message_count: int, worker_counts: List[int]) -> List[dict]:
+    """Measures validate_messages throughput for each worker count over the same mixed-table batch."""
+    schemas = [schema for schema in get_schema_store().values()
+               if "const" in schema.get("properties", {}).get("table_name", {})]
+    templates = [_sample_message(schema) for schema in schemas]
+    messages = [templates[i % len(templates)] for i in range(message_count)]
+    results = []
+    for workers in worker_counts:
+        if workers > 1:
+            # Start the pool and compile its validators outside the timed run.
+            validate_messages(messages[:workers * 2], workers=workers, inline_batch=0)
+        else:
+            warm_validators()
+        start = time.perf_counter()
+        outcomes = validate_messages(messages, workers=workers, inline_batch=0)
+        seconds = time.perf_counter() - start
+        results.append({
+            "workers": workers,
+            "messages": len(messages),
+            "valid": sum(1 for is_valid, _ in outcomes if is_valid),
+            "seconds": round(seconds, 3),
+            "messages_per_second": round(len(messages) / seconds),
+        })
+    return results
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Schema validation tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("bench", help="Measure batch validation throughput against the number of worker processes.")
+    bench.add_argument("--messages", type=int, default=20000)
+    bench.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, 4, os.cpu_count() or 1})),
+                       help="Comma-separated worker counts to measure.")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.messages, [int(n) for n in args.workers.split(",")])
+    baseline = results[0]["messages_per_second"]
+    for result in results:
+        result["speedup"] = round(result["messages_per_second"] / baseline, 2)
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
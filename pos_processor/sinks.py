@@ -0,0 +1,279 @@
+"""
+Row sinks for the POS Processor: where validated, normalized rows land.
+
+PROCESSOR_SINK selects one sink at startup:
+
+    bigquery   streaming inserts into BIGQUERY_DATASET_ID (default)
+    dry_run    logs the rows and drops them (BQ_DRY_RUN=true also selects it)
+    file       compressed columnar files under FILE_SINK_DIR, partitioned as
+               <table_name>/business_date=<YYYY-MM-DD>/part-<time>-<n>.<ext>
+
+Every sink's insert(table_id, rows) returns insert_rows_json-style errors, so
+pos_processor/inserts.py treats them all the same way.
+
+The file sink buffers rows per partition. A file is written when a partition
+reaches FILE_SINK_BATCH_ROWS rows, when its oldest row is FILE_SINK_ROLLOVER_SECONDS
+old, and at exit. Rows are acknowledged once they are buffered, so a crash
+loses the open buffers. It is a landing zone and a way to profile the
+processor without network I/O, not a replacement for BigQuery. The format is
+Parquet when pyarrow is installed. Otherwise it is column-major JSON, one
+object of {column: [values]} per file, compressed with FILE_SINK_CODEC (zstd,
+or gzip without the zstandard package). read_sink_file reads either format.
+
+Configuration (environment):
+    PROCESSOR_SINK               bigquery, dry_run or file (default bigquery)
+    FILE_SINK_DIR                root directory of the file sink (default /tmp/pos_sink)
+    FILE_SINK_FORMAT             parquet or columnar (default parquet if pyarrow is installed)
+    FILE_SINK_CODEC              zstd or gzip (default zstd)
+    FILE_SINK_BATCH_ROWS         rows per file (default 5000)
+    FILE_SINK_ROLLOVER_SECONDS   maximum age of a buffered partition (default 30)
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pos_common.metrics import REGISTRY
+from pos_common.compression import IDENTITY, compress, decompress, resolve_codec, CONTENT_ENCODING_ATTRIBUTE
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional; column-major JSON needs no extra package.
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+SINK_NAMES = ("bigquery", "dry_run", "file")
+FILE_FORMATS = ("parquet", "columnar")
+DEFAULT_FILE_SINK_DIR = "/tmp/pos_sink"
+
+BQ_INSERT_LATENCY = REGISTRY.histogram("pos_processor_bq_insert_latency_seconds", "BigQuery insert_rows_json latency.", ["table"])
+BQ_ROWS_INSERTED = REGISTRY.counter("pos_processor_bq_rows_inserted_total", "Rows successfully inserted into BigQuery.", ["table"])
+BQ_INSERT_ERRORS = REGISTRY.counter("pos_processor_bq_insert_errors_total", "BigQuery inserts that returned errors.", ["table"])
+FILE_SINK_ROWS = REGISTRY.counter("pos_processor_file_sink_rows_total", "Rows written to file sink files.", ["table"])
+FILE_SINK_FILES = REGISTRY.counter("pos_processor_file_sink_files_total", "Files written by the file sink.", ["table"])
+
+
+class Sink:
+    """Interface of a row sink."""
+    name = "sink"
+
+    def insert(self, table_id: str, rows: list) -> list:
+        """Stores rows and returns insert_rows_json-style errors ([] on success)."""
+        raise NotImplementedError
+
+    def warm(self) -> None:
+        """Creates clients ahead of the first message (startup warm-up)."""
+
+    def close(self) -> None:
+        """Writes out anything buffered."""
+
+
+class BigQuerySink(Sink):
+    """Streaming inserts with insert_rows_json."""
+    name = "bigquery"
+
+    def __init__(self, client_factory: Callable[[], "object"], project_id: Optional[str], dataset_id: Optional[str]):
+        # The client is looked up on every insert so it is created lazily and can be replaced in tests.
+        self.client_factory = client_factory
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+
+    def warm(self) -> None:
+        self.client_factory()
+
+    def insert(self, table_id: str, rows: list) -> list:
+        full_table_id = f"{self.project_id}.{self.dataset_id}.{table_id}"
+        start_time = time.perf_counter()
+        # Invalid rows are reported without holding back the rest of the request.
+        errors = self.client_factory().insert_rows_json(full_table_id, rows, skip_invalid_rows=True)
+        BQ_INSERT_LATENCY.observe(time.perf_counter() - start_time, table=table_id)
+        if not errors:
+            BQ_ROWS_INSERTED.inc(len(rows), table=table_id)
+            logger.info(f"Successfully inserted {len(rows)} record(s) into {full_table_id}")
+        else:
+            BQ_INSERT_ERRORS.inc(table=table_id)
+            failed_rows = {entry['index'] for entry in errors if isinstance(entry, dict) and 'index' in entry}
+            if failed_rows and len(failed_rows) == len(errors):
+                BQ_ROWS_INSERTED.inc(len(rows) - len(failed_rows), table=table_id)
+        return errors
+
+
+class DryRunSink(Sink):
+    """Logs what would be inserted."""
+    name = "dry_run"
+
+    def insert(self, table_id: str, rows: list) -> list:
+        logger.info(f"[DRY-RUN] Would insert to {table_id}: {json.dumps(rows, default=str)[:500]}")
+        return []
+
+
+def _partition_date(row: dict) -> str:
+    value = row.get('business_date')
+    return str(value)[:10] if value else "unknown"
+
+
+def _columns(rows: List[dict]) -> Dict[str, list]:
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+class FileSink(Sink):
+    """Partitioned, batched, compressed columnar files on local disk."""
+    name = "file"
+
+    def __init__(self, directory: str = DEFAULT_FILE_SINK_DIR, file_format: Optional[str] = None,
+                 codec: str = "zstd", batch_rows: int = 5000, rollover_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        file_format = file_format or ("parquet" if pyarrow is not None else "columnar")
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unsupported file sink format '{file_format}'. Use one of {list(FILE_FORMATS)}.")
+        if file_format == "parquet" and pyarrow is None:
+            logger.warning("Parquet output requested but the 'pyarrow' package is not installed; writing columnar JSON.")
+            file_format = "columnar"
+        self.directory = directory
+        self.file_format = file_format
+        self.codec = resolve_codec(codec)
+        self.batch_rows = batch_rows
+        self.rollover_seconds = rollover_seconds
+        self._clock = clock
+        # (table_id, business_date) -> (time of the first buffered row, rows)
+        self._buffers: Dict[Tuple[str, str], Tuple[float, List[dict]]] = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def insert(self, table_id: str, rows: list) -> list:
+        full = []
+        with self._lock:
+            for row in rows:
+                key = (table_id, _partition_date(row))
+                _, buffered = self._buffers.setdefault(key, (self._clock(), []))
+                buffered.append(row)
+                if len(buffered) >= self.batch_rows:
+                    full.append((key, self._buffers.pop(key)[1]))
+        for key, batch in full:
+            self._write(key, batch)
+        self.roll_over()
+        return []
+
+    def roll_over(self, force: bool = False) -> int:
+        """Writes the partitions whose oldest row has waited rollover_seconds (all with force). Returns files written."""
+        now = self._clock()
+        with self._lock:
+            due = [key for key, (started, _) in self._buffers.items() if force or now - started >= self.rollover_seconds]
+            batches = [(key, self._buffers.pop(key)[1]) for key in due]
+        for key, batch in batches:
+            self._write(key, batch)
+        return len(batches)
+
+    def _path(self, table_id: str, business_date: str) -> str:
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        if self.file_format == "parquet":
+            extension = "parquet"
+        else:
+            extension = "columns.json" + {"zstd": ".zst", "gzip": ".gz"}.get(self.codec, "")
+        directory = os.path.join(self.directory, table_id, f"business_date={business_date}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"part-{stamp}-{os.getpid()}-{sequence:06d}.{extension}")
+
+    def _write(self, key: Tuple[str, str], rows: List[dict]) -> None:
+        table_id, business_date = key
+        path = self._path(table_id, business_date)
+        try:
+            with self._write_lock:
+                if self.file_format == "parquet":
+                    table = pyarrow.Table.from_pydict(_columns(rows))
+                    pyarrow.parquet.write_table(table, path, compression="gzip" if self.codec == "gzip" else "zstd")
+                else:
+                    body = json.dumps({'table_name': table_id, 'row_count': len(rows), 'columns': _columns(rows)},
+                                      default=str).encode('utf-8')
+                    data, _ = compress(body, self.codec)
+                    with open(path + ".tmp", "wb") as handle:
+                        handle.write(data)
+                    # Readers never see a partial file.
+                    os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.error(f"File sink could not write {len(rows)} {table_id} row(s) to {path}: {e}; keeping them buffered.")
+            with self._lock:
+                _, buffered = self._buffers.setdefault(key, (self._clock(), []))
+                buffered[:0] = rows
+            return
+        FILE_SINK_ROWS.inc(len(rows), table=table_id)
+        FILE_SINK_FILES.inc(table=table_id)
+        logger.info(f"File sink wrote {len(rows)} {table_id} row(s) to {path}")
+
+    def start(self) -> None:
+        """Rolls over idle partitions on a daemon thread, and writes everything at exit."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop_event.wait(max(self.rollover_seconds / 2, 0.1)):
+                self.roll_over()
+
+        self._thread = threading.Thread(target=run, name="file-sink-rollover", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self.roll_over(force=True)
+
+
+def read_sink_file(path: str) -> List[dict]:
+    """Reads the rows of one file written by FileSink."""
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("Reading Parquet files needs the 'pyarrow' package.")
+        return pyarrow.parquet.read_table(path).to_pylist()
+    with open(path, "rb") as handle:
+        data = handle.read()
+    codec = "zstd" if path.endswith(".zst") else "gzip" if path.endswith(".gz") else IDENTITY
+    payload = json.loads(decompress(data, {CONTENT_ENCODING_ATTRIBUTE: codec}))
+    columns = payload['columns']
+    return [{name: values[i] for name, values in columns.items()} for i in range(payload['row_count'])]
+
+
+@lru_cache(maxsize=1)
+def default_bigquery_client() -> "object":
+    """A cached BigQuery client for callers that do not bring their own, such as the DLQ replay CLI."""
+    from google.cloud import bigquery
+    return bigquery.Client()
+
+
+def create_sink(name: Optional[str], bigquery_client_factory: Optional[Callable[[], "object"]] = None,
+                project_id: Optional[str] = None, dataset_id: Optional[str] = None) -> Sink:
+    """
+    Builds the sink named by PROCESSOR_SINK (name), honoring the older BQ_DRY_RUN switch.
+    The BigQuery sink uses default_bigquery_client unless bigquery_client_factory is given.
+    """
+    if not name:
+        name = "dry_run" if os.environ.get("BQ_DRY_RUN", "false").lower() == "true" else "bigquery"
+    name = name.lower()
+    if name == "bigquery":
+        return BigQuerySink(bigquery_client_factory or default_bigquery_client, project_id, dataset_id)
+    if name == "dry_run":
+        return DryRunSink()
+    if name == "file":
+        sink = FileSink(
+            directory=os.environ.get("FILE_SINK_DIR", DEFAULT_FILE_SINK_DIR),
+            file_format=os.environ.get("FILE_SINK_FORMAT"),
+            codec=os.environ.get("FILE_SINK_CODEC", "zstd"),
+            batch_rows=int(os.environ.get("FILE_SINK_BATCH_ROWS", "5000")),
+            rollover_seconds=float(os.environ.get("FILE_SINK_ROLLOVER_SECONDS", "30")),
+        )
+        sink.start()
+        return sink
+    raise ValueError(f"Unknown PROCESSOR_SINK '{name}'. Use one of {list(SINK_NAMES)}.")
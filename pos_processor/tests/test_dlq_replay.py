@@ -0,0 +1,188 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from pos_processor.dlq_replay import DlqReplayer
+
+SUBSCRIPTION = "projects/local-project/subscriptions/pos-events-dlq-pull-sub"
+
+def _received(message_id: str, payload) -> SimpleNamespace:
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+    return SimpleNamespace(
+        ack_id=f"ack-{message_id}",
+        message=SimpleNamespace(message_id=message_id, data=data, attributes={}),
+    )
+
+def _event(table_name: str, record_id: str, data: dict) -> dict:
+    endpoint = {"pos_paidouts": "Paidouts", "pos_customers": "Customers"}[table_name]
+    return {
+        "record_id": record_id,
+        "sync_id": f"{endpoint}_20250630_120000",
+        "event_type": f"pos.{table_name.replace('pos_', '')}",
+        "table_name": table_name,
+        "processed_at": "2025-06-30T12:00:00+00:00",
+        "data": data,
+    }
+
+class FakeSubscriber:
+    """Serves pre-built batches, then redelivers anything that was nacked."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.acked, self.nacked = [], []
+
+    def pull(self, request, timeout):
+        batch = self.batches.pop(0) if self.batches else []
+        return SimpleNamespace(received_messages=batch[:request['max_messages']])
+
+    def acknowledge(self, request):
+        self.acked.extend(request['ack_ids'])
+
+    def modify_ack_deadline(self, request):
+        self.nacked.extend(request['ack_ids'])
+
+def _batch():
+    return [
+        _received("1", _event("pos_paidouts", "r1", {"id": 1, "business_date": "2025-06-30T00:00:00+00:00"})),
+        _received("2", _event("pos_paidouts", "r2", {"id": 2})),
+        _received("3", _event("pos_customers", "r3", {"id": 3})),
+        _received("4", _event("pos_customers", "r4", {"object_id": 12345})),  # Invalid: uuid must be a string.
+        _received("5", b"not json"),
+    ]
+
+def test_replay_inserts_valid_rows_per_table_and_quarantines_the_rest(tmp_path):
+    """Valid messages are bulk-inserted per table; invalid ones are quarantined and acked."""
+    subscriber = FakeSubscriber([_batch()])
+    insert_rows = MagicMock(return_value=[])
+    quarantine = tmp_path / "quarantine.jsonl"
+
+    summary = DlqReplayer(subscriber, SUBSCRIPTION, insert_rows, quarantine_path=str(quarantine)).run()
+
+    assert insert_rows.call_count == 2
+    inserted = {call.args[0]: call.args[1] for call in insert_rows.call_args_list}
+    assert len(inserted["pos_paidouts"]) == 2
+    assert inserted["pos_paidouts"][0]["business_date"] == "2025-06-30"  # Normalized before insert.
+    assert summary['totals'] == {'pulled': 5, 'valid': 3, 'inserted': 3, 'invalid': 2, 'insert_rejected': 0, 'insert_failed': 0}
+    assert sorted(subscriber.acked) == ["ack-1", "ack-2", "ack-3", "ack-4", "ack-5"]
+    assert len(quarantine.read_text().splitlines()) == 2
+
+def test_failed_insert_is_nacked_and_not_retried_in_the_same_run():
+    """A failed bulk insert leaves its messages in the DLQ and the run still terminates."""
+    batch = _batch()[:2]
+    subscriber = FakeSubscriber([batch, batch])
+    insert_rows = MagicMock(return_value=[{'index': 0, 'errors': ['backendError']}, {'index': 1, 'errors': ['backendError']}])
+
+    summary = DlqReplayer(subscriber, SUBSCRIPTION, insert_rows, insert_attempts=1).run()
+
+    assert insert_rows.call_count == 1
+    assert summary['totals']['insert_failed'] == 2
+    assert subscriber.nacked == ["ack-1", "ack-2"]
+    assert subscriber.acked == []
+
+def test_dry_run_changes_nothing():
+    """A dry run validates and reports without inserting, acking or nacking."""
+    subscriber = FakeSubscriber([_batch()])
+    insert_rows = MagicMock()
+
+    summary = DlqReplayer(subscriber, SUBSCRIPTION, insert_rows, dry_run=True).run()
+
+    insert_rows.assert_not_called()
+    assert subscriber.acked == [] and subscriber.nacked == []
+    assert summary['totals']['valid'] == 3
+    assert summary['tables']['pos_customers']['invalid'] == 1
+
+def test_rate_limit_paces_batches():
+    """The token bucket is charged one token per replayed message."""
+    subscriber = FakeSubscriber([_batch()])
+    replayer = DlqReplayer(subscriber, SUBSCRIPTION, MagicMock(return_value=[]), rate_limit=2, batch_size=5)
+    replayer.rate_limiter = MagicMock()
+
+    replayer.run(max_messages=4)
+
+    replayer.rate_limiter.acquire.assert_called_once_with(4)
+    # ack-5 is beyond max_messages; ack-4 is invalid and there is no quarantine file to move it to.
+    assert sorted(subscriber.nacked) == ["ack-4", "ack-5"]
+
+def test_partial_insert_failure_acks_committed_rows_and_retries_only_the_rest(tmp_path):
+    """Committed rows are acked, a transient failure is retried on its own and a rejected row is quarantined."""
+    batch = [_received(str(i), _event("pos_paidouts", f"r{i}", {"id": i})) for i in range(1, 4)]
+    subscriber = FakeSubscriber([batch])
+    insert_rows = MagicMock(side_effect=[
+        [{'index': 1, 'errors': [{'reason': 'backendError'}]}, {'index': 2, 'errors': [{'reason': 'invalid'}]}],
+        [],
+    ])
+    quarantine = tmp_path / "quarantine.jsonl"
+
+    with patch('pos_processor.inserts.time.sleep'):
+        summary = DlqReplayer(subscriber, SUBSCRIPTION, insert_rows, quarantine_path=str(quarantine)).run()
+
+    assert [len(call.args[1]) for call in insert_rows.call_args_list] == [3, 1]
+    assert insert_rows.call_args.args[1][0]['id'] == 2
+    assert summary['tables']['pos_paidouts'] == {'pulled': 3, 'valid': 3, 'inserted': 2, 'invalid': 0,
+                                                  'insert_rejected': 1, 'insert_failed': 0}
+    assert sorted(subscriber.acked) == ["ack-1", "ack-2", "ack-3"]
+    [entry] = [json.loads(line) for line in quarantine.read_text().splitlines()]
+    assert entry['record_id'] == "r3" and entry['error'] == [{'reason': 'invalid'}]
+
+def test_undecodable_bodies_are_quarantined_without_stopping_the_batch(tmp_path):
+    """Corrupt compressed bodies, bad binary rows and rows from a newer format are quarantined; the rest replay."""
+    # --- Arrange ---
+    from pos_common.rowcodec import CONTENT_TYPE, CONTENT_TYPE_ATTRIBUTE, MAGIC
+
+    def undecodable(message_id: str, data: bytes, attributes: dict) -> SimpleNamespace:
+        received = _received(message_id, data)
+        received.message.attributes = attributes
+        return received
+
+    batch = [
+        _received("1", _event("pos_paidouts", "r1", {"id": 1})),
+        undecodable("2", b"not gzip", {"content_encoding": "gzip"}),
+        undecodable("3", b"\x00\x01", {CONTENT_TYPE_ATTRIBUTE: CONTENT_TYPE}),
+        undecodable("4", MAGIC + b"\x09", {CONTENT_TYPE_ATTRIBUTE: CONTENT_TYPE}),
+        _received("5", [1, 2]),
+    ]
+    subscriber = FakeSubscriber([batch])
+    quarantine = tmp_path / "quarantine.jsonl"
+
+    # --- Act ---
+    summary = DlqReplayer(subscriber, SUBSCRIPTION, MagicMock(return_value=[]), quarantine_path=str(quarantine)).run()
+
+    # --- Assert ---
+    assert summary['totals']['inserted'] == 1
+    assert summary['tables']['N/A']['invalid'] == 4
+    assert sorted(subscriber.acked) == ["ack-1", "ack-2", "ack-3", "ack-4", "ack-5"]
+    assert len(quarantine.read_text().splitlines()) == 4
+
+def test_replay_keeps_pulling_past_empty_and_redelivered_batches():
+    """One pull with nothing new does not end the pass; only consecutive empty pulls do."""
+    # --- Arrange ---
+    first, second = _batch()[:2], _batch()[2:3]
+    subscriber = FakeSubscriber([first, [], first, second])
+    insert_rows = MagicMock(return_value=[])
+
+    # --- Act ---
+    summary = DlqReplayer(subscriber, SUBSCRIPTION, insert_rows).run()
+
+    # --- Assert ---
+    assert summary['totals']['inserted'] == 3
+    assert sorted(subscriber.acked) == ["ack-1", "ack-2", "ack-3"]
+
+def test_cli_inserts_through_the_configured_sink(capsys):
+    """The CLI builds its sink from pos_processor.sinks and closes it after the pass."""
+    # --- Arrange ---
+    from pos_processor import dlq_replay
+    subscriber = FakeSubscriber([_batch()[:1]])
+    subscriber.subscription_path = lambda project, subscription: SUBSCRIPTION
+    sink = MagicMock()
+    sink.insert.return_value = []
+
+    # --- Act ---
+    with patch('google.cloud.pubsub_v1.SubscriberClient', return_value=subscriber), \
+         patch('pos_processor.dlq_replay.create_sink', return_value=sink):
+        exit_code = dlq_replay.main(['--project', 'local-project'])
+
+    # --- Assert ---
+    assert exit_code == 0
+    sink.insert.assert_called_once()
+    sink.close.assert_called_once()
+    assert json.loads(capsys.readouterr().out)['totals']['inserted'] == 1
@@ -1,6 +1,7 @@
 import pytest
 import json
 import base64
+import gzip
 from unittest.mock import patch, MagicMock
 
 # Import the Flask app object from your main application file
@@ -142,6 +143,29 @@ def test_bigquery_insertion_failure(mock_validate_message, mock_get_bq_client, c
     # The BigQuery client was still called.
     mock_bq_client.insert_rows_json.assert_called_once()
 
+@patch('pos_processor.main.get_bigquery_client')
+@patch('pos_processor.main.validate_message')
+def test_row_rejected_by_bigquery_is_left_for_the_dead_letter_topic(mock_validate_message, mock_get_bq_client, client):
+    """
+    A row BigQuery rejects as invalid is not acknowledged, so the subscription's
+    dead-letter policy moves it to the durable DLQ topic.
+    """
+    # --- Arrange ---
+    valid_data = {"event_type": "pos.checks", "table_name": "pos_checks", "record_id": "abc", "data": {"id": 1}}
+    envelope = create_pubsub_envelope(valid_data)
+    mock_validate_message.return_value = (True, None)
+    mock_get_bq_client.return_value.insert_rows_json.return_value = [
+        {'index': 0, 'errors': [{'reason': 'invalid', 'message': 'no such field: bogus'}]}
+    ]
+
+    # --- Act ---
+    response = client.post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 422
+    assert b"Insert rejected for record_id abc" in response.data
+    mock_get_bq_client.return_value.insert_rows_json.assert_called_once()
+
 def test_malformed_pubsub_envelope(client):
     """
     Tests that the endpoint correctly handles a request that is not a valid
@@ -183,4 +207,106 @@ def test_unknown_event_type_is_acknowledged(mock_get_bq_client, client):
     assert b"Validation failed" in response.data
     
     # The BigQuery client should NOT be called for this unprocessable message.
-    mock_get_bq_client.return_value.insert_rows_json.assert_not_called()
\ No newline at end of file
+    mock_get_bq_client.return_value.insert_rows_json.assert_not_called()
+@patch('pos_processor.main.get_bigquery_client')
+@patch('pos_processor.main.validate_message')
+def test_metrics_endpoint_reports_insert_counts(mock_validate_message, mock_get_bq_client, client):
+    """
+    Tests that a processed message is reflected in the Prometheus-style
+    counters exposed on the /metrics endpoint.
+    """
+    # --- Arrange ---
+    mock_validate_message.return_value = (True, None)
+    mock_get_bq_client.return_value.insert_rows_json.return_value = []
+    envelope = create_pubsub_envelope({"event_type": "pos.paidouts", "table_name": "pos_paidouts", "data": {}})
+
+    # --- Act ---
+    client.post('/', json=envelope)
+    response = client.get('/metrics')
+
+    # --- Assert ---
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'pos_processor_bq_rows_inserted_total{table="pos_paidouts"} 1' in body
+    assert 'pos_processor_bq_insert_latency_seconds_count{table="pos_paidouts"} 1' in body
+
+def test_unknown_table_names_share_one_metric_label(client):
+    """Arbitrary table_name values from messages do not create new metric series."""
+    # --- Arrange ---
+    envelopes = [create_pubsub_envelope({"event_type": "pos.x", "table_name": f"made_up_{i}", "data": {}})
+                 for i in range(3)]
+
+    # --- Act ---
+    for envelope in envelopes:
+        client.post('/', json=envelope)
+    body = client.get('/metrics').get_data(as_text=True)
+
+    # --- Assert ---
+    assert "made_up_" not in body
+    assert 'pos_processor_validation_failures_total{table="unknown"}' in body
+    assert 'pos_processor_validation_tier_failures_total{tier="structural",table="unknown"}' in body
+
+@patch('pos_processor.main.get_bigquery_client')
+@patch('pos_processor.main.validate_message')
+def test_compressed_message_is_decompressed(mock_validate_message, mock_get_bq_client, client):
+    """
+    Tests that a gzip body declared through the content_encoding attribute
+    is decompressed transparently before validation.
+    """
+    # --- Arrange ---
+    mock_validate_message.return_value = (True, None)
+    mock_get_bq_client.return_value.insert_rows_json.return_value = []
+    payload = {"event_type": "pos.paidouts", "table_name": "pos_paidouts", "data": {"id": 7}}
+    envelope = create_pubsub_envelope(payload)
+    envelope["message"]["data"] = base64.b64encode(gzip.compress(json.dumps(payload).encode('utf-8'))).decode('utf-8')
+    envelope["message"]["attributes"] = {"content_encoding": "gzip"}
+
+    # --- Act ---
+    response = client.post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 204
+    mock_validate_message.assert_called_once_with(payload)
+
+def test_corrupt_compressed_message_is_acknowledged(client):
+    """A body that does not match its declared encoding is treated as malformed."""
+    # --- Arrange ---
+    envelope = create_pubsub_envelope({"event_type": "pos.paidouts"})
+    envelope["message"]["attributes"] = {"content_encoding": "gzip"}
+
+    # --- Act ---
+    response = client.post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 400
+
+@patch('pos_processor.main.get_bigquery_client')
+def test_binary_row_message_is_decoded_and_inserted(mock_get_bq_client, client):
+    """
+    Tests that a message in the schema-derived binary encoding is decoded
+    into the same event dict, validated against the real schema and inserted.
+    """
+    # --- Arrange ---
+    from pos_common.rowcodec import get_row_codecs
+    mock_get_bq_client.return_value.insert_rows_json.return_value = []
+    payload = {
+        "record_id": "a1b2c3d4e5f6",
+        "sync_id": "Paidouts_20250630_120000",
+        "event_type": "pos.paidouts",
+        "table_name": "pos_paidouts",
+        "processed_at": "2025-06-30T12:00:00Z",
+        "data": {"id": 7, "business_date": "2025-06-30", "amount": 12.5},
+    }
+    body, attributes = get_row_codecs().encode(payload)
+    envelope = create_pubsub_envelope({})
+    envelope["message"]["data"] = base64.b64encode(body).decode('utf-8')
+    envelope["message"]["attributes"] = attributes
+
+    # --- Act ---
+    response = client.post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 204
+    mock_get_bq_client.return_value.insert_rows_json.assert_called_once()
+    assert mock_get_bq_client.return_value.insert_rows_json.call_args.args[1] == [payload["data"]]
@@ -0,0 +1,105 @@
+import json
+import base64
+from unittest.mock import MagicMock, patch
+
+from pos_processor.main import app
+from pos_processor.rollups import BigQueryRollupWriter, RollupAggregator
+
+SITE = "d8e9313b-7e54-4bb1-950b-8cadab263f13"
+
+def _check(check_id: int, gross: float, business_date: str = "2025-06-30") -> dict:
+    return {"id": check_id, "site_object_id": SITE, "business_date": business_date,
+            "gross_sales": gross, "net_sales": gross - 1, "tax": 1.0, "discounts": 0, "comps": None}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_contributions_are_keyed_by_record_and_flushed_when_due():
+    """A re-sent or edited record replaces its buffered contribution; a failed flush keeps them for the next one."""
+    # --- Arrange ---
+    flushed = []
+    fail = [True]
+
+    def flush_table(table, config, rows):
+        if fail[0]:
+            raise RuntimeError("quota exceeded")
+        flushed.append((config['summary_table'], rows))
+
+    clock = FakeClock()
+    aggregator = RollupAggregator(flush_table, flush_seconds=60, max_pending=100, clock=clock)
+
+    # --- Act ---
+    outcomes = [
+        aggregator.observe("pos_checks", _check(1, 10.0), "r1"),
+        aggregator.observe("pos_checks", _check(1, 10.0), "r1"),
+        aggregator.observe("pos_checks", _check(2, 5.0), "r2"),
+        aggregator.observe("pos_checks", _check(1, 12.5), "r1"),
+        aggregator.observe("pos_payments", {"id": 3, "business_date": "2025-06-30"}, "r3"),
+    ]
+    assert flushed == []
+    assert aggregator.flush() == 0
+    fail[0] = False
+    clock.now = 61
+    # The first observation after ROLLUP_FLUSH_SECONDS flushes on the request thread.
+    aggregator.observe("pos_checks", _check(4, 1.0, "2025-07-01"), "r4")
+
+    # --- Assert ---
+    assert outcomes == ['buffered', 'replaced', 'buffered', 'replaced', 'ignored']
+    [(summary_table, rows)] = flushed
+    assert summary_table == "pos_daily_check_totals"
+    by_record = {row['record_id']: row for row in rows}
+    assert sorted(by_record) == ["r1", "r2", "r4"]
+    assert by_record["r1"] == {'record_id': "r1", 'site_object_id': SITE, 'business_date': "2025-06-30",
+                               'gross_sales': 12.5, 'net_sales': 11.5, 'tax': 1.0, 'discounts': 0.0, 'comps': 0.0}
+    assert aggregator.flush() == 0
+
+def test_writer_merges_contributions_on_record_id_and_recomputes_the_days():
+    """Re-flushing the same contributions overwrites them instead of adding to the totals."""
+    # --- Arrange ---
+    client = MagicMock()
+    writer = BigQueryRollupWriter(client)
+    aggregator = RollupAggregator(writer)
+    item_sale = {"id": 1, "site_object_id": SITE, "business_date": "2025-06-30", "quantity": 2, "extended_price": 9.5}
+    aggregator.observe("pos_item_sales", item_sale, "r1")
+
+    # --- Act ---
+    aggregator.flush()
+    aggregator.observe("pos_item_sales", item_sale, "r1")
+    aggregator.flush()
+
+    # --- Assert ---
+    create, merge, again = [call.args[0] for call in client.query.call_args_list]
+    assert create.count("CREATE TABLE IF NOT EXISTS") == 2 and "pos_daily_item_sales_totals_contributions" in create
+    assert merge == again
+    assert "ON T.record_id = S.record_id" in merge
+    assert "quantity = S.quantity" in merge
+    assert "+ S." not in merge
+    assert "SUM(IFNULL(quantity, 0)) AS quantity" in merge
+    [parameter] = client.query.call_args.kwargs['job_config'].query_parameters
+    assert json.loads(parameter.value) == [{'record_id': 'r1', 'site_object_id': SITE, 'business_date': '2025-06-30',
+                                            'quantity': 2.0, 'extended_price': 9.5, 'net_price': 0.0, 'tax_amount': 0.0,
+                                            'comp_amount': 0.0, 'promo_amount': 0.0, 'void_amount': 0.0}]
+
+@patch('pos_processor.main.get_bigquery_client')
+@patch('pos_processor.main.validate_message', return_value=(True, None))
+def test_processor_counts_inserted_rows_when_enabled(mock_validate_message, mock_get_bq_client, monkeypatch):
+    """With ROLLUPS_ENABLED, each successfully inserted row reaches the aggregator."""
+    # --- Arrange ---
+    monkeypatch.setenv("ROLLUPS_ENABLED", "true")
+    mock_get_bq_client.return_value.insert_rows_json.return_value = []
+    aggregator = MagicMock()
+    payload = {"table_name": "pos_checks", "record_id": "r1", "data": _check(1, 10.0)}
+    envelope = {"message": {"data": base64.b64encode(json.dumps(payload).encode()).decode(), "attributes": {}}}
+
+    # --- Act ---
+    with patch('pos_processor.main.get_rollups', return_value=aggregator):
+        response = app.test_client().post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 204
+    table, row, record_id = aggregator.observe.call_args.args
+    assert (table, record_id, row['gross_sales']) == ("pos_checks", "r1", 10.0)
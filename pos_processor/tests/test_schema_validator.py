@@ -0,0 +1,78 @@
+from unittest.mock import patch
+
+import pytest
+
+from pos_processor.schema_validator import ValidationPolicy, check_structure, validate_full, validate_messages
+
+def _message(**data) -> dict:
+    return {
+        "record_id": "abc123abc123",
+        "sync_id": "Paidouts_20250630_120000",
+        "processed_at": "2025-06-30T12:00:00+00:00",
+        "event_type": "pos.paidouts",
+        "table_name": "pos_paidouts",
+        "data": data or {"id": 7, "amount": 10.5},
+    }
+
+@pytest.mark.parametrize("message", [
+    _message(id=7, amount="ten"),
+    _message(id=7, unknown_field=1),
+    {**_message(), "table_name": "pos_checks"},
+    {key: value for key, value in _message().items() if key != "record_id"},
+    {**_message(), "data": "not an object"},
+], ids=["wrong_type", "unknown_key", "table_mismatch", "missing_envelope", "data_not_object"])
+def test_structural_check_agrees_with_full_validation(message):
+    """The structural tier rejects envelope and type errors with the same verdict as full validation."""
+    assert check_structure(message)[0] is False
+    assert validate_full(message)[0] is False
+
+def test_structural_check_leaves_formats_to_full_validation():
+    """A valid message passes both tiers; format errors are only caught by the full tier."""
+    assert check_structure(_message()) == (True, None)
+    assert validate_full(_message()) == (True, None)
+    assert check_structure({**_message(), "sync_id": "bad"}) == (True, None)
+    assert validate_full({**_message(), "sync_id": "bad"})[0] is False
+
+def test_sampled_failures_escalate_the_table_to_full_validation():
+    """Full validation runs on the sample only, until sampled failures escalate the table to every message."""
+    # --- Arrange ---
+    calls = []
+    failing = {"on": True}
+
+    def full_validator(message):
+        calls.append(message)
+        return (False, "bad") if failing["on"] else (True, None)
+
+    draws = iter([0.05, 0.5] * 100 + [0.5] * 1000)
+    policy = ValidationPolicy(default_rate=0.1, escalation_threshold=0.5, window=4, min_samples=2,
+                              full_validator=full_validator, rng=lambda: next(draws))
+
+    # --- Act / Assert ---
+    assert policy.validate(_message()) == (False, "bad")   # sampled
+    assert policy.validate(_message()) == (True, None)     # not sampled
+    assert len(calls) == 1
+    policy.validate(_message())                            # second sampled failure escalates
+    assert policy.sample_rate("pos_paidouts") == 1.0
+
+    failing["on"] = False
+    for _ in range(4):
+        policy.validate(_message())
+    assert len(calls) == 6                                 # every message while escalated
+    assert policy.sample_rate("pos_paidouts") == 0.1       # a clean window restores sampling
+
+def test_validate_messages_shards_across_processes_in_order():
+    """A large batch is validated in worker processes with the same per-message results, in order."""
+    batch = [_message() if i % 3 else _message(id=i, amount="bad") for i in range(12)]
+
+    results = validate_messages(batch, workers=2, inline_batch=4)
+
+    assert results == [validate_full(message) for message in batch]
+    assert [is_valid for is_valid, _ in results] == [bool(i % 3) for i in range(12)]
+
+def test_validate_messages_runs_small_batches_inline():
+    """Batches under the inline threshold never touch the process pool."""
+    with patch('pos_processor.schema_validator._get_validation_pool') as mock_pool:
+        results = validate_messages([_message(), _message(id=1, amount="bad")], workers=4, inline_batch=10)
+
+    mock_pool.assert_not_called()
+    assert [is_valid for is_valid, _ in results] == [True, False]
@@ -0,0 +1,75 @@
+import glob
+import json
+import base64
+import os
+from unittest.mock import patch
+
+import pytest
+
+from pos_processor.main import app
+from pos_processor.sinks import BigQuerySink, DryRunSink, FileSink, create_sink, read_sink_file
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def _files(root) -> dict:
+    return {os.path.relpath(os.path.dirname(path), root): read_sink_file(path)
+            for path in sorted(glob.glob(os.path.join(root, "*", "*", "part-*")))}
+
+def test_file_sink_batches_partitions_and_rolls_over(tmp_path):
+    """Full batches are written at once, idle partitions after the rollover time, and the rest on close."""
+    # --- Arrange ---
+    clock = FakeClock()
+    sink = FileSink(str(tmp_path), file_format="columnar", batch_rows=2, rollover_seconds=10, clock=clock)
+    rows = [{"id": 1, "business_date": "2025-06-30", "net_sales": 1.5},
+            {"id": 2, "business_date": "2025-06-30"},
+            {"id": 3, "business_date": "2025-07-01", "net_sales": None}]
+
+    # --- Act & Assert ---
+    assert sink.insert("pos_checks", rows) == []
+    # Columns are shared by the rows of a file; a missing field reads back as None.
+    assert _files(tmp_path) == {os.path.join("pos_checks", "business_date=2025-06-30"): [rows[0], {**rows[1], "net_sales": None}]}
+
+    clock.now = 11
+    sink.insert("pos_customers", [{"id": 4}])
+    files = _files(tmp_path)
+    assert files[os.path.join("pos_checks", "business_date=2025-07-01")] == [rows[2]]
+    assert os.path.join("pos_customers", "business_date=unknown") not in files
+
+    sink.close()
+    assert _files(tmp_path)[os.path.join("pos_customers", "business_date=unknown")] == [{"id": 4}]
+    assert all(path.endswith(".columns.json.zst") for path in glob.glob(str(tmp_path / "*" / "*" / "*")))
+
+def test_sink_is_chosen_from_the_environment(monkeypatch, tmp_path):
+    """PROCESSOR_SINK picks the sink; BQ_DRY_RUN still selects the dry run."""
+    # --- Act & Assert ---
+    assert isinstance(create_sink(None, lambda: None), BigQuerySink)
+    monkeypatch.setenv("BQ_DRY_RUN", "true")
+    assert isinstance(create_sink(None, lambda: None), DryRunSink)
+    monkeypatch.setenv("FILE_SINK_DIR", str(tmp_path))
+    file_sink = create_sink("file", lambda: None)
+    file_sink.close()
+    assert isinstance(file_sink, FileSink) and file_sink.directory == str(tmp_path)
+    with pytest.raises(ValueError):
+        create_sink("s3", lambda: None)
+
+@patch('pos_processor.main.validate_message', return_value=(True, None))
+def test_processor_lands_rows_in_the_file_sink(mock_validate_message, tmp_path):
+    """With the file sink the processor writes normalized rows to disk instead of BigQuery."""
+    # --- Arrange ---
+    sink = FileSink(str(tmp_path), file_format="columnar", codec="gzip", batch_rows=1)
+    payload = {"table_name": "pos_paidouts", "record_id": "r1",
+               "data": {"id": 7, "business_date": "2025-06-30T00:00:00+00:00"}}
+    envelope = {"message": {"data": base64.b64encode(json.dumps(payload).encode()).decode(), "attributes": {}}}
+
+    # --- Act ---
+    with patch('pos_processor.main.get_sink', return_value=sink):
+        response = app.test_client().post('/', json=envelope)
+
+    # --- Assert ---
+    assert response.status_code == 204
+    assert _files(tmp_path) == {os.path.join("pos_paidouts", "business_date=2025-06-30"): [{"id": 7, "business_date": "2025-06-30"}]}
@@ -28,4 +28,13 @@ curl -X PUT "http://${PUBSUB_EMULATOR_HOST}/v1/projects/local-project/subscripti
         }
       }'
 
+# Pull subscription on the DLQ for the replay tool (python -m pos_processor.dlq_replay)
+echo "Creating DLQ pull subscription: pos-events-dlq-pull-sub"
+curl -X PUT "http://${PUBSUB_EMULATOR_HOST}/v1/projects/local-project/subscriptions/pos-events-dlq-pull-sub" \
+  -H "Content-Type: application/json" \
+  -d '{
+        "topic": "projects/local-project/topics/pos-events-dlq",
+        "ackDeadlineSeconds": 60
+      }'
+
 echo -e "\nLocal Pub/Sub setup complete."
\ No newline at end of file